@@ -0,0 +1,146 @@
+"""Per-user rate limits and a concurrency cap for expensive routes.
+
+Refreshing or subscribing fetches and parses whole feeds while the request
+waits, so a single user repeating them can take all of a worker's CPU.
+Each user gets a token bucket per limited route, refilled continuously,
+and the expensive routes together, background work they leave behind
+included, only run MAX_EXPENSIVE_IN_FLIGHT at a time. Requests over either
+limit are turned away at once, with a Retry-After, instead of queueing
+behind the work that overloads the worker.
+
+The state lives in the worker process. With several API workers each one
+enforces its share of the limits and of the cap, which adds up to the
+configured figures while requests spread evenly over the workers.
+"""
+
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from math import ceil
+from typing import Callable
+
+from observability.metrics import REGISTRY
+
+# a pod has half a CPU, parsing more feeds at once only makes each slower
+MAX_EXPENSIVE_IN_FLIGHT = 4
+OVERLOADED_RETRY_SECONDS = 5
+# buckets of the least recently seen users are dropped past this, they
+# start again full, which is the state an idle bucket refills to anyway
+MAX_TRACKED_BUCKETS = 10_000
+
+SHED_REQUESTS = REGISTRY.counter(
+    "http_requests_shed_total",
+    "Requests turned away before running, by route and reason.",
+    ("route", "reason"),
+)
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    per_minute: float
+    burst: int
+    # counts towards the concurrency cap
+    expensive: bool = False
+
+    def share(self, workers: int) -> "RateLimit":
+        return RateLimit(
+            per_minute=self.per_minute / workers,
+            burst=max(self.burst // workers, 1),
+            expensive=self.expensive,
+        )
+
+
+class RequestShed(Exception):
+    status_code: int
+    reason: str
+
+    def __init__(self, retry_after: float) -> None:
+        super().__init__(f"Too many requests, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(ceil(self.retry_after), 1))
+
+
+class RateLimited(RequestShed):
+    status_code = 429
+    reason = "rate_limited"
+
+
+class Overloaded(RequestShed):
+    status_code = 503
+    reason = "overloaded"
+
+
+class TokenBucket:
+    __slots__ = ("limit", "tokens", "updated")
+
+    def __init__(self, limit: RateLimit, now: float) -> None:
+        self.limit = limit
+        self.tokens = float(limit.burst)
+        self.updated = now
+
+    def take(self, now: float) -> float:
+        """Seconds until a token is available, 0 when one was taken."""
+        refilled = (now - self.updated) * self.limit.per_minute / 60
+        self.tokens = min(self.tokens + refilled, self.limit.burst)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) * 60 / self.limit.per_minute
+
+
+class Admission:
+    def __init__(
+        self,
+        limits: dict[str, RateLimit],
+        max_in_flight: int = MAX_EXPENSIVE_IN_FLIGHT,
+        clock: Callable[[], float] = time.monotonic,
+        workers: int = 1,
+    ) -> None:
+        self.limits = {route: limit.share(workers) for route, limit in limits.items()}
+        self.max_in_flight = max(max_in_flight // workers, 1)
+        self.clock = clock
+        self.in_flight = 0
+        self._buckets: OrderedDict[tuple[str, str], TokenBucket] = OrderedDict()
+
+    def enter(self, route: str, user_id: str) -> None:
+        """Admits the request or raises RequestShed, admitted requests must
+        leave once done."""
+        limit = self.limits[route]
+        # overloaded requests keep their token, they did not run
+        if limit.expensive and self.in_flight >= self.max_in_flight:
+            SHED_REQUESTS.inc(route, Overloaded.reason)
+            raise Overloaded(OVERLOADED_RETRY_SECONDS)
+        wait = self._bucket(route, user_id, limit).take(self.clock())
+        if wait > 0:
+            SHED_REQUESTS.inc(route, RateLimited.reason)
+            raise RateLimited(wait)
+        if limit.expensive:
+            self.in_flight += 1
+
+    def hold(self, route: str) -> None:
+        """Keeps the place of an admitted request for work it leaves running
+        after its response, which must leave once done."""
+        if self.limits[route].expensive:
+            self.in_flight += 1
+
+    def leave(self, route: str) -> None:
+        if self.limits[route].expensive:
+            self.in_flight -= 1
+
+    def clear(self) -> None:
+        self._buckets.clear()
+
+    def _bucket(self, route: str, user_id: str, limit: RateLimit) -> TokenBucket:
+        key = (route, user_id)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(limit, self.clock())
+            while len(self._buckets) > MAX_TRACKED_BUCKETS:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
@@ -0,0 +1,93 @@
+"""Micro-benchmark of EpisodeAssets.from_feed_entry.
+
+Runs the current implementation next to the timedelta/mktime based one it
+replaced, on entries produced by feedparser from a generated feed.
+
+    python -m benchmarks.bench_feed_entry --entries 3000
+"""
+
+import argparse
+import timeit
+from datetime import datetime, timedelta
+from time import mktime
+from typing import Any, Callable
+
+import feedparser
+
+from business.podcast import EpisodeAssets
+
+ITEM = """<item>
+  <title>episode {index}</title>
+  <description>description of episode {index}</description>
+  <pubDate>Wed, 01 Jan 2025 12:{minute:02d}:00 GMT</pubDate>
+  <itunes:duration>{duration}</itunes:duration>
+  <link>https://example.com/episodes/{index}</link>
+  <enclosure url="https://example.com/{index}.mp3" type="audio/mpeg" length="1"/>
+</item>"""
+
+
+def generate_entries(count: int) -> list[Any]:
+    durations = ["3723", "01:02:03", "45:10", "1:02:03"]
+    items = "".join(
+        ITEM.format(index=i, minute=i % 60, duration=durations[i % len(durations)])
+        for i in range(count)
+    )
+    document = (
+        '<?xml version="1.0"?><rss version="2.0" '
+        'xmlns:itunes="http://www.itunes.com/dtds/podcast-1.0.dtd">'
+        f"<channel><title>bench</title>{items}</channel></rss>"
+    )
+    return feedparser.parse(document.encode())["entries"]
+
+
+def legacy_from_feed_entry(entry: Any) -> EpisodeAssets:
+    audio_file = next(
+        (link for link in entry["links"] if link["type"] == "audio/mpeg"), None
+    )
+    length = None
+    if itunes_duration := entry.get("itunes_duration"):
+        if ":" in itunes_duration:
+            values = itunes_duration.split(":")
+            match len(values):
+                case 2:
+                    length = timedelta(
+                        seconds=int(values[1]), minutes=int(values[0])
+                    ).seconds
+                case 3:
+                    length = timedelta(
+                        seconds=int(values[2]),
+                        minutes=int(values[1]),
+                        hours=int(values[0]),
+                    ).seconds
+        else:
+            length = int(itunes_duration)
+    assert audio_file is not None
+    return EpisodeAssets(
+        title=entry["title"],
+        description=entry.get("summary", None),
+        download_link=audio_file.get("href", None),
+        published_date=datetime.fromtimestamp(mktime(entry["published_parsed"])),
+        length=length,
+    )
+
+
+def time_per_entry(
+    function: Callable[[Any], EpisodeAssets], entries: list[Any], repeat: int
+) -> float:
+    timings = timeit.repeat(
+        lambda: [function(entry) for entry in entries], number=1, repeat=repeat
+    )
+    return min(timings) / len(entries)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entries", type=int, default=3000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    entries = generate_entries(args.entries)
+    legacy = time_per_entry(legacy_from_feed_entry, entries, args.repeat)
+    current = time_per_entry(EpisodeAssets.from_feed_entry, entries, args.repeat)
+    print(f"legacy:  {legacy * 1e6:.2f} us/entry")
+    print(f"current: {current * 1e6:.2f} us/entry ({current / legacy:.0%} of legacy)")
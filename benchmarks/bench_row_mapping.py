@@ -0,0 +1,152 @@
+"""Micro-benchmark of mapping episode query rows to play infos.
+
+Runs persistence.rows.play_info next to the pydantic model based mapping it
+replaced, on rows shaped like the home feed query's, half of them listened
+to. Reports time, the memory the mapped page keeps alive and the number of
+allocations per row, and the time to serialize the page to JSON.
+
+    python -m benchmarks.bench_row_mapping --rows 1000
+"""
+
+import argparse
+import gc
+import timeit
+import tracemalloc
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Callable, Optional
+
+from pydantic import BaseModel, ConfigDict, TypeAdapter
+
+from business.podcast import PlayInfo
+from persistence.rows import play_info
+
+
+@dataclass
+class LegacyEpisodeAssets:
+    title: str
+    description: Optional[str]
+    download_link: Optional[str]
+    published_date: datetime
+    length: Optional[int]
+
+
+@dataclass
+class LegacyEpisode:
+    id: str
+    feed_id: str
+    assets: LegacyEpisodeAssets
+    cover_art_url: str
+
+
+class LegacyPreviousListen(BaseModel):
+    time_listened: timedelta
+    time: datetime
+
+    model_config = ConfigDict(ser_json_timedelta="float")
+
+
+class LegacyPlayInfo(BaseModel):
+    episode: LegacyEpisode
+    previous_listen: Optional[LegacyPreviousListen]
+
+
+def legacy_play_info(row: Any) -> LegacyPlayInfo:
+    if row[8] is None or row[9] is None:
+        previous_listen = None
+    else:
+        previous_listen = LegacyPreviousListen(
+            time_listened=row[8], time=datetime.fromtimestamp(row[9])
+        )
+    return LegacyPlayInfo(
+        previous_listen=previous_listen,
+        episode=LegacyEpisode(
+            id=row[0],
+            feed_id=row[1],
+            assets=LegacyEpisodeAssets(
+                title=row[2],
+                description=row[3],
+                download_link=row[4],
+                published_date=datetime.fromtimestamp(row[5]),
+                length=row[6],
+            ),
+            cover_art_url=row[7],
+        ),
+    )
+
+
+def generate_rows(count: int) -> list[tuple[Any, ...]]:
+    return [
+        (
+            f"episode-{i}",
+            "feed",
+            f"episode {i}",
+            "description " * 20,
+            f"https://example.com/{i}.mp3",
+            1_700_000_000 + i * 3600,
+            3600,
+            "https://example.com/cover.jpg",
+            i * 7 if i % 2 else None,
+            1_700_000_000.0 + i if i % 2 else None,
+        )
+        for i in range(count)
+    ]
+
+
+@dataclass
+class Result:
+    seconds_per_row: float
+    retained_bytes_per_row: float
+    peak_bytes_per_row: float
+    blocks_per_row: float
+    dump_seconds: float
+
+
+def measure(
+    mapper: Callable[[Any], Any], kind: Any, rows: list[Any], repeat: int
+) -> Result:
+    seconds = min(
+        timeit.repeat(lambda: [mapper(row) for row in rows], number=1, repeat=repeat)
+    )
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    mapped = [mapper(row) for row in rows]
+    retained, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename"))
+    adapter = TypeAdapter(list[kind])
+    dump_seconds = min(
+        timeit.repeat(lambda: adapter.dump_json(mapped), number=1, repeat=repeat)
+    )
+    return Result(
+        seconds_per_row=seconds / len(rows),
+        retained_bytes_per_row=retained / len(rows),
+        peak_bytes_per_row=peak / len(rows),
+        blocks_per_row=blocks / len(rows),
+        dump_seconds=dump_seconds,
+    )
+
+
+def report(name: str, result: Result) -> str:
+    return (
+        f"{name:<8} {result.seconds_per_row * 1e6:6.2f} us/row"
+        f"  retained {result.retained_bytes_per_row:5.0f} B/row"
+        f"  peak {result.peak_bytes_per_row:5.0f} B/row"
+        f"  {result.blocks_per_row:4.1f} blocks/row"
+        f"  json {result.dump_seconds * 1e3:5.2f} ms"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=7)
+    args = parser.parse_args()
+
+    rows = generate_rows(args.rows)
+    legacy = measure(legacy_play_info, LegacyPlayInfo, rows, args.repeat)
+    current = measure(play_info, PlayInfo, rows, args.repeat)
+    print(report("legacy:", legacy))
+    print(report("current:", current))
@@ -0,0 +1,277 @@
+"""/my_feed latency and throughput while slow subscribes are in flight.
+
+Clients hammer /my_feed at increasing concurrency while other clients keep
+subscribing to a feed that takes --fetch-latency seconds to download. The
+"async" mode is the app as deployed: handlers await the database threads of
+the writer and of --readers read connections, and feed downloads run under
+their own limiter. The "threadpool" mode replays
+how the handlers used to run, each call on the default worker pool with its
+own connection, so slow downloads take threads away from /my_feed.
+
+    python -m benchmarks.concurrency --scale small --concurrency 8,32,64,128
+"""
+
+import argparse
+import asyncio
+import logging
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import closing
+from dataclasses import dataclass
+from functools import partial
+from itertools import count
+from pathlib import Path
+from typing import Any, Callable, Optional, Union
+
+import httpx
+from anyio import to_thread
+from fastapi import Request
+
+from benchmarks.generator import SCALES, generate, user_email
+from business.async_podcast_service import AsyncPodcastService, Reader
+from business.podcast_service import PodcastService
+from business.rss import FakeRssParser, PodcastImport, RssParser
+from persistence.connection import connect
+from persistence.database_thread import DatabaseThread
+from persistence.datastore import Datastore
+from persistence.migration import migrate
+
+SLOW_FEED_URL = "https://slow.example.com/feed.xml"
+
+
+@dataclass
+class SlowRssParser(RssParser):
+    parser: RssParser
+    latency_seconds: float
+
+    def import_feed(self, feed_url: str, etag: Optional[str] = None) -> PodcastImport:
+        time.sleep(self.latency_seconds)
+        # every subscribe asks for a new url, they all get the same feed
+        return self.parser.import_feed(feed_url.partition("?")[0], etag)
+
+
+class ThreadpoolPodcastService:
+    """Runs each sync PodcastService call on the default worker pool."""
+
+    def __init__(self, path: Path, rss_parser: RssParser) -> None:
+        self.path = path
+        self.rss_parser = rss_parser
+
+    def __getattr__(self, name: str) -> Callable[..., Any]:
+        async def call(*args: Any, **kwargs: Any) -> Any:
+            return await to_thread.run_sync(partial(self._call, name, *args, **kwargs))
+
+        return call
+
+    def _call(self, name: str, *args: Any, **kwargs: Any) -> Any:
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        try:
+            service = PodcastService(
+                datastore=Datastore(connection=connection),
+                rss_parser=self.rss_parser,
+            )
+            return getattr(service, name)(*args, **kwargs)
+        finally:
+            connection.close()
+
+
+@dataclass
+class Level:
+    mode: str
+    concurrency: int
+    requests: int
+    seconds: float
+    p50: float
+    p95: float
+    p99: float
+    subscribes: int
+    failed_subscribes: int
+
+    @property
+    def requests_per_second(self) -> float:
+        return self.requests / self.seconds
+
+
+async def run_level(
+    client: httpx.AsyncClient,
+    mode: str,
+    concurrency: int,
+    slow_clients: int,
+    duration: float,
+    users: int,
+) -> Level:
+    deadline = time.perf_counter() + duration
+    timings: list[float] = []
+    subscribes = failed_subscribes = 0
+    request_numbers = count()
+
+    async def read(worker: int) -> None:
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            response = await client.get(
+                "/my_feed", headers={"x-user": user_email(worker % users)}
+            )
+            assert response.status_code == 200, response.text
+            timings.append((time.perf_counter() - start) * 1000)
+
+    async def subscribe(worker: int) -> None:
+        nonlocal subscribes, failed_subscribes
+        while time.perf_counter() < deadline:
+            # a known url would be subscribed to without fetching it
+            response = await client.post(
+                "/subscribe",
+                params={"feed_url": f"{SLOW_FEED_URL}?request={next(request_numbers)}"},
+                headers={"x-user": user_email(worker % users)},
+            )
+            # concurrent writers on separate connections can time out on the lock
+            if response.status_code == 200:
+                subscribes += 1
+            else:
+                failed_subscribes += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(read(worker) for worker in range(concurrency)),
+        *(subscribe(worker) for worker in range(slow_clients)),
+    )
+    seconds = time.perf_counter() - start
+    cuts = statistics.quantiles(timings, n=100, method="inclusive")
+    return Level(
+        mode=mode,
+        concurrency=concurrency,
+        requests=len(timings),
+        seconds=seconds,
+        p50=cuts[49],
+        p95=cuts[94],
+        p99=cuts[98],
+        subscribes=subscribes,
+        failed_subscribes=failed_subscribes,
+    )
+
+
+async def run_mode(
+    mode: str, path: Path, rss_parser: RssParser, args: argparse.Namespace
+) -> list[Level]:
+    import endpoints
+
+    def threaded(name: str) -> Reader:
+        connection = connect(str(path), check_same_thread=False)
+        return Reader(
+            service=PodcastService(
+                datastore=Datastore(connection=connection), rss_parser=rss_parser
+            ),
+            database=DatabaseThread(connection, name=name),
+        )
+
+    databases: list[DatabaseThread] = []
+    service: Union[AsyncPodcastService, ThreadpoolPodcastService]
+    if mode == "async":
+        writer = threaded("database")
+        readers = [threaded(f"database-reader-{n}") for n in range(args.readers)]
+        service = AsyncPodcastService(
+            service=writer.service, database=writer.database, readers=readers
+        )
+        databases = [writer.database, *(reader.database for reader in readers)]
+    else:
+        service = ThreadpoolPodcastService(path, rss_parser)
+
+    # sync like the real token check, which runs on the worker pool
+    def email(request: Request) -> str:
+        return request.headers["x-user"]
+
+    async def provide_service() -> Union[AsyncPodcastService, ThreadpoolPodcastService]:
+        return service
+
+    overrides = endpoints.app.dependency_overrides
+    overrides[endpoints.authenticated_user_email] = email
+    # the old dependency was a sync generator, so it also took a worker thread
+    overrides[endpoints.podcast_service] = (
+        provide_service if mode == "async" else lambda: service
+    )
+    transport = httpx.ASGITransport(app=endpoints.app, raise_app_exceptions=False)
+    levels = []
+    try:
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://bench"
+        ) as client:
+            for concurrency in args.concurrency:
+                levels.append(
+                    await run_level(
+                        client,
+                        mode,
+                        concurrency,
+                        args.slow_clients,
+                        args.duration,
+                        SCALES[args.scale].users,
+                    )
+                )
+    finally:
+        overrides.clear()
+        for database in databases:
+            database.close()
+    return levels
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scale", choices=SCALES, default="small")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--data-dir", default="./benchmarks/data")
+    parser.add_argument(
+        "--concurrency",
+        type=lambda value: [int(level) for level in value.split(",")],
+        default=[8, 32, 64, 128],
+    )
+    parser.add_argument("--slow-clients", type=int, default=16)
+    # read connections of the async mode, READ_CONNECTIONS in the API
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--fetch-latency", type=float, default=1.0)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument(
+        "--mode", choices=("async", "threadpool", "both"), default="both"
+    )
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    template = Path(args.data_dir) / f"{args.scale}-{args.seed}.db"
+    if not template.exists():
+        template.parent.mkdir(parents=True, exist_ok=True)
+        print(f"generating {args.scale} dataset in {template}", file=sys.stderr)
+        generate(template, SCALES[args.scale], seed=args.seed)
+    # a dataset cached before the latest migrations is brought up to date
+    with closing(sqlite3.connect(template)) as connection:
+        migrate(connection)
+
+    rss_parser = SlowRssParser(
+        parser=FakeRssParser(
+            imports={
+                SLOW_FEED_URL: PodcastImport(
+                    title="slow podcast", cover_art_url="", episode_assets=[]
+                )
+            }
+        ),
+        latency_seconds=args.fetch_latency,
+    )
+    modes = ("async", "threadpool") if args.mode == "both" else (args.mode,)
+    with tempfile.TemporaryDirectory() as directory:
+        for mode in modes:
+            # the subscribes write, each mode starts from the same data
+            path = Path(directory) / f"{mode}.db"
+            shutil.copyfile(template, path)
+            for level in asyncio.run(run_mode(mode, path, rss_parser, args)):
+                print(
+                    f"{level.mode:<10} {level.concurrency:>4} clients"
+                    f"  {level.requests_per_second:8.1f} req/s"
+                    f"  p50 {level.p50:8.2f}ms  p95 {level.p95:8.2f}ms"
+                    f"  p99 {level.p99:8.2f}ms  {level.subscribes} subscribes"
+                    f" ({level.failed_subscribes} failed)"
+                )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
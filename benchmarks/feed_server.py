@@ -0,0 +1,185 @@
+"""Local HTTP server publishing generated RSS feeds.
+
+Lets the real fetch and parse path run without the network. Each feed is
+deterministic for a given seed and index, and its behaviour (slow, broken,
+redirected) is fixed per feed so repeated cycles hit the same feeds.
+"""
+
+import hashlib
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from email.utils import format_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from xml.sax.saxutils import escape
+
+FIRST_EPISODE_DATE = datetime(2020, 1, 1, 6, 0)
+
+
+@dataclass
+class FeedServerConfig:
+    feeds: int = 1_000
+    episodes_per_feed: int = 100
+    description_bytes: int = 1_000
+    latency_seconds: float = 0.0
+    error_rate: float = 0.0
+    redirect_rate: float = 0.0
+    etags: bool = True
+    seed: int = 42
+
+
+@dataclass
+class ServerCounters:
+    requests: int = 0
+    not_modified: int = 0
+    redirects: int = 0
+    errors: int = 0
+    bytes_sent: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, **increments: int) -> None:
+        with self.lock:
+            for name, value in increments.items():
+                setattr(self, name, getattr(self, name) + value)
+
+
+@dataclass(frozen=True)
+class FeedBehaviour:
+    broken: bool
+    redirected: bool
+
+
+def render_feed(config: FeedServerConfig, index: int, generation: int) -> bytes:
+    """A feed gains one episode per generation, newest first like real feeds."""
+    description = escape(
+        ("Show notes with <a href='https://example.com'>links</a>. " * 64)[
+            : config.description_bytes
+        ]
+    )
+    episodes = config.episodes_per_feed + generation
+    items: list[str] = []
+    for number in range(episodes - 1, -1, -1):
+        published = FIRST_EPISODE_DATE + timedelta(days=number, minutes=index)
+        items.append(
+            f"<item><title>podcast {index} episode {number}</title>"
+            f"<description>{description}</description>"
+            f"<pubDate>{format_datetime(published)}</pubDate>"
+            f"<itunes:duration>{1800 + number % 1800}</itunes:duration>"
+            f'<enclosure url="https://media.example.com/{index}/{number}.mp3" '
+            'type="audio/mpeg" length="1"/></item>'
+        )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<rss version="2.0" xmlns:itunes="http://www.itunes.com/dtds/podcast-1.0.dtd">'
+        f"<channel><title>podcast {index}</title>"
+        f'<itunes:image href="https://images.example.com/{index}.jpg"/>'
+        f"{''.join(items)}</channel></rss>"
+    ).encode()
+
+
+class FakeFeedServer:
+    """Serves /feeds/<index>.xml, use as a context manager."""
+
+    def __init__(self, config: FeedServerConfig) -> None:
+        self.config = config
+        self.counters = ServerCounters()
+        self.generation = 0
+        self._documents: dict[tuple[int, int], tuple[bytes, str]] = {}
+        self._documents_lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def __enter__(self) -> "FakeFeedServer":
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        assert self._server is not None
+        self._server.shutdown()
+        self._server.server_close()
+
+    @property
+    def base_url(self) -> str:
+        assert self._server is not None
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def url(self, index: int) -> str:
+        return f"{self.base_url}/feeds/{index}.xml"
+
+    def publish(self) -> None:
+        """Adds a new episode to every feed."""
+        self.generation += 1
+
+    def behaviour(self, index: int) -> FeedBehaviour:
+        rng = random.Random(self.config.seed * 1_000_003 + index)
+        return FeedBehaviour(
+            broken=rng.random() < self.config.error_rate,
+            redirected=rng.random() < self.config.redirect_rate,
+        )
+
+    def document(self, index: int) -> tuple[bytes, str]:
+        key = (index, self.generation)
+        with self._documents_lock:
+            cached = self._documents.get(key)
+        if cached is None:
+            body = render_feed(self.config, index, self.generation)
+            cached = (body, f'"{hashlib.sha1(body).hexdigest()}"')
+            with self._documents_lock:
+                self._documents[key] = cached
+        return cached
+
+    def _handler(self) -> type[BaseHTTPRequestHandler]:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self) -> None:
+                server.counters.add(requests=1)
+                if server.config.latency_seconds:
+                    time.sleep(server.config.latency_seconds)
+                prefix, _, name = self.path.rpartition("/")
+                if prefix not in ("/feeds", "/moved") or not name.endswith(".xml"):
+                    return self._empty(404)
+                try:
+                    index = int(name.removesuffix(".xml"))
+                except ValueError:
+                    return self._empty(404)
+                if not 0 <= index < server.config.feeds:
+                    return self._empty(404)
+
+                behaviour = server.behaviour(index)
+                if behaviour.broken:
+                    server.counters.add(errors=1)
+                    return self._empty(503)
+                if behaviour.redirected and prefix == "/feeds":
+                    server.counters.add(redirects=1)
+                    return self._empty(301, Location=f"/moved/{index}.xml")
+
+                body, etag = server.document(index)
+                if server.config.etags and self.headers.get("If-None-Match") == etag:
+                    server.counters.add(not_modified=1)
+                    return self._empty(304, ETag=etag)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/rss+xml")
+                self.send_header("Content-Length", str(len(body)))
+                if server.config.etags:
+                    self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(body)
+                server.counters.add(bytes_sent=len(body))
+
+            def _empty(self, status: int, **headers: str) -> None:
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, format, *args) -> None: ...
+
+        return Handler
@@ -0,0 +1,211 @@
+"""Deterministic synthetic dataset for the benchmarks.
+
+The same scale and seed always produce the same database, so timings from
+different runs are comparable. Feeds follow a long-tailed popularity and
+size distribution, users subscribe mostly to popular feeds and have both
+finished and in-progress listens on recent episodes.
+"""
+
+import random
+import sqlite3
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterator
+
+from persistence.datastore import Datastore
+from persistence.migration import migrate
+
+BATCH_SIZE = 10_000
+DESCRIPTION_PARAGRAPH = (
+    "<p>In this episode we talk about the things that matter, with links to "
+    '<a href="https://example.com/show-notes">the show notes</a> and a few '
+    "tangents nobody asked for.</p>"
+)
+
+
+@dataclass(frozen=True)
+class Scale:
+    users: int
+    feeds: int
+    episodes: int
+    mean_subscriptions: int
+    listens_per_user: int
+
+
+SCALES = {
+    "tiny": Scale(
+        users=50, feeds=20, episodes=2_000, mean_subscriptions=5, listens_per_user=10
+    ),
+    "small": Scale(
+        users=1_000,
+        feeds=500,
+        episodes=100_000,
+        mean_subscriptions=10,
+        listens_per_user=40,
+    ),
+    "medium": Scale(
+        users=5_000,
+        feeds=2_000,
+        episodes=1_000_000,
+        mean_subscriptions=15,
+        listens_per_user=100,
+    ),
+    "large": Scale(
+        users=10_000,
+        feeds=5_000,
+        episodes=5_000_000,
+        mean_subscriptions=20,
+        listens_per_user=200,
+    ),
+}
+
+
+def user_id(index: int) -> str:
+    return f"user-{index}"
+
+
+def user_email(index: int) -> str:
+    return f"user{index}@example.com"
+
+
+def feed_id(index: int) -> str:
+    return f"feed-{index}"
+
+
+def feed_url(index: int) -> str:
+    return f"https://feeds.example.com/{index}.xml"
+
+
+def episode_id(feed_index: int, index: int) -> str:
+    return f"episode-{feed_index}-{index}"
+
+
+def episodes_per_feed(scale: Scale, rng: random.Random) -> list[int]:
+    # a few feeds with decades of daily episodes, most with a few hundred
+    weights = [rng.paretovariate(1.2) for _ in range(scale.feeds)]
+    total = sum(weights)
+    return [max(1, int(scale.episodes * weight / total)) for weight in weights]
+
+
+def batched(rows: Iterator[tuple], size: int = BATCH_SIZE) -> Iterator[list[tuple]]:
+    batch: list[tuple] = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def generate(path: Path, scale: Scale, seed: int = 42) -> None:
+    rng = random.Random(seed)
+    now = datetime(2025, 6, 1, 12)
+    connection = sqlite3.connect(path)
+    connection.execute("pragma journal_mode = wal;")
+    connection.execute("pragma synchronous = off;")
+    migrate(connection)
+
+    with connection:
+        connection.executemany(
+            "insert into user (id, email) values (?, ?);",
+            ((user_id(i), user_email(i)) for i in range(scale.users)),
+        )
+        connection.executemany(
+            "insert into podcast_feed (id, feed_url, cover_art_url, title) values (?,?,?,?);",
+            (
+                (
+                    feed_id(i),
+                    feed_url(i),
+                    f"https://images.example.com/{i}.jpg",
+                    f"podcast {i}",
+                )
+                for i in range(scale.feeds)
+            ),
+        )
+
+    sizes = episodes_per_feed(scale, rng)
+
+    def episode_rows() -> Iterator[tuple]:
+        for feed_index, size in enumerate(sizes):
+            interval = timedelta(days=rng.choice([1, 1, 7, 7, 7, 14]))
+            for index in range(size):
+                published = now - interval * (size - index)
+                yield (
+                    episode_id(feed_index, index),
+                    f"episode {index} of podcast {feed_index}",
+                    DESCRIPTION_PARAGRAPH * rng.randint(1, 8),
+                    f"https://cdn.example.com/{feed_index}/{index}.mp3",
+                    published.timestamp(),
+                    feed_id(feed_index),
+                    rng.randint(20, 120) * 60,
+                )
+
+    for batch in batched(episode_rows()):
+        with connection:
+            connection.executemany(
+                "insert into episode (episode_id, title, description, download_link, published_date, feed_id, length) values (?,?,?,?,?,?,?);",
+                batch,
+            )
+
+    # popular feeds get most subscribers
+    popularity = [1 / (rank + 1) for rank in range(scale.feeds)]
+    subscriptions: dict[int, list[int]] = {}
+    for user_index in range(scale.users):
+        wanted = min(
+            scale.feeds,
+            max(1, int(rng.lognormvariate(0, 0.8) * scale.mean_subscriptions)),
+        )
+        chosen: set[int] = set()
+        while len(chosen) < wanted:
+            chosen.update(rng.choices(range(scale.feeds), popularity, k=wanted))
+        subscriptions[user_index] = sorted(chosen)[:wanted]
+
+    with connection:
+        connection.executemany(
+            "insert into subscription (user_id, feed_id) values (?,?);",
+            (
+                (user_id(user_index), feed_id(feed_index))
+                for user_index, feeds in subscriptions.items()
+                for feed_index in feeds
+            ),
+        )
+
+    def listen_rows() -> Iterator[tuple]:
+        for user_index, feeds in subscriptions.items():
+            seen: set[str] = set()
+            for _ in range(scale.listens_per_user):
+                feed_index = rng.choice(feeds)
+                # mostly the latest episodes, with a tail into the back catalogue
+                back = min(sizes[feed_index] - 1, int(rng.expovariate(0.3)))
+                index = sizes[feed_index] - 1 - back
+                episode = episode_id(feed_index, index)
+                if episode in seen:
+                    continue
+                seen.add(episode)
+                length = 60 * 60
+                seconds = length if rng.random() < 0.6 else rng.randint(1, length - 60)
+                listened = now - timedelta(minutes=rng.randint(1, 60 * 24 * 90))
+                yield (
+                    episode,
+                    user_id(user_index),
+                    seconds,
+                    listened.timestamp(),
+                    int(seconds >= length),
+                )
+
+    for batch in batched(listen_rows()):
+        with connection:
+            connection.executemany(
+                "insert into previous_listen (episode_id, user_id, seconds, time, finished) values (?,?,?,?,?);",
+                batch,
+            )
+
+    datastore = Datastore(connection=connection)
+    datastore.rebuild_timeline()
+    datastore.recount_subscriptions()
+    datastore.backfill_listening_stats()
+    connection.execute("analyze;")
+    connection.execute("pragma journal_mode = delete;")
+    connection.close()
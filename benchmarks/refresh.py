@@ -0,0 +1,135 @@
+"""Feed refresh throughput against a local feed server.
+
+Runs the real FeedParserRssParser and PodcastService._update_feeds over
+HTTP for a number of cycles. The first cycle imports every episode, each
+later one sees a single new episode per feed.
+
+    python -m benchmarks.refresh --feeds 500 --cycles 3 --latency 0.01
+"""
+
+import argparse
+import logging
+import resource
+import sqlite3
+import time
+from dataclasses import dataclass
+
+from benchmarks.feed_server import FakeFeedServer, FeedServerConfig
+from business.podcast_service import PENDING_COVER_ART_URL, PodcastService
+from business.rss import FeedFetcher, FeedParserRssParser
+from persistence.datastore import Datastore
+from persistence.migration import migrate
+
+
+@dataclass
+class CycleReport:
+    cycle: int
+    seconds: float
+    processed: int
+    failed: int
+    cpu_seconds: float
+    peak_rss_mb: float
+    db_changes: int
+    requests: int
+
+    @property
+    def feeds_per_second(self) -> float:
+        return (self.processed + self.failed) / self.seconds
+
+
+def cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def prepare(server: FakeFeedServer, connection: sqlite3.Connection) -> PodcastService:
+    migrate(connection)
+    datastore = Datastore(connection=connection)
+    for index in range(server.config.feeds):
+        datastore.save_podcast_feed(
+            feed_id=f"feed-{index}",
+            feed_url=server.url(index),
+            title=f"podcast {index}",
+            cover_art_url=PENDING_COVER_ART_URL,
+        )
+    return PodcastService(
+        datastore=datastore,
+        rss_parser=FeedParserRssParser(fetcher=FeedFetcher()),
+    )
+
+
+def run(config: FeedServerConfig, cycles: int) -> list[CycleReport]:
+    reports = []
+    connection = sqlite3.connect(":memory:")
+    with FakeFeedServer(config) as server:
+        service = prepare(server, connection)
+        for cycle in range(cycles):
+            if cycle:
+                server.publish()
+            # render outside the measurement, the server shares our CPU clock
+            for index in range(config.feeds):
+                server.document(index)
+            feeds = service.datastore.get_all_feeds()
+            requests_before = server.counters.requests
+            changes_before = connection.total_changes
+            cpu_before = cpu_seconds()
+            start = time.perf_counter()
+            summary = service._update_feeds(feeds)
+            reports.append(
+                CycleReport(
+                    cycle=cycle,
+                    seconds=time.perf_counter() - start,
+                    processed=summary.processed,
+                    failed=summary.failed,
+                    cpu_seconds=cpu_seconds() - cpu_before,
+                    peak_rss_mb=peak_rss_mb(),
+                    db_changes=connection.total_changes - changes_before,
+                    requests=server.counters.requests - requests_before,
+                )
+            )
+    connection.close()
+    return reports
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--feeds", type=int, default=200)
+    parser.add_argument("--episodes", type=int, default=100)
+    parser.add_argument("--description-bytes", type=int, default=1_000)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--redirect-rate", type=float, default=0.0)
+    parser.add_argument("--no-etags", action="store_true")
+    parser.add_argument("--cycles", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    # failing feeds are expected here, their tracebacks would bury the report
+    logging.disable(logging.ERROR)
+    config = FeedServerConfig(
+        feeds=args.feeds,
+        episodes_per_feed=args.episodes,
+        description_bytes=args.description_bytes,
+        latency_seconds=args.latency,
+        error_rate=args.error_rate,
+        redirect_rate=args.redirect_rate,
+        etags=not args.no_etags,
+        seed=args.seed,
+    )
+    for report in run(config, args.cycles):
+        print(
+            f"cycle {report.cycle}: {report.feeds_per_second:8.1f} feeds/s"
+            f"  {report.seconds:7.2f}s wall  {report.cpu_seconds:7.2f}s cpu"
+            f"  {report.processed} ok  {report.failed} failed"
+            f"  {report.requests} requests  {report.db_changes} db changes"
+            f"  peak rss {report.peak_rss_mb:.0f}MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
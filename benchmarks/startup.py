@@ -0,0 +1,148 @@
+"""Import time of each entrypoint, checked against a startup budget.
+
+Every API worker, refresher and CLI command pays for its imports before it
+does anything, so restarts and readiness probes wait on them. Each module is
+imported in a fresh interpreter under -X importtime, which is repeated and
+the fastest run kept. Modules an entrypoint must not load at all are listed
+with its budget, they are only needed later by some requests or commands.
+
+    python -m benchmarks.startup --runs 5
+"""
+
+import argparse
+import subprocess
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+
+REPO_DIR = Path(__file__).parent.parent
+
+# too heavy to pay for on every start
+HEAVY_MODULES = (
+    "apscheduler",
+    "cryptography",
+    "feedparser",
+    "jwt",
+    "requests",
+    "uvicorn",
+)
+WEB_MODULES = ("fastapi", "pydantic", "pydantic_settings", "starlette")
+
+
+@dataclass
+class Budget:
+    module: str
+    milliseconds: float
+    forbidden: tuple[str, ...]
+
+
+BUDGETS = [
+    Budget(module="endpoints", milliseconds=3000, forbidden=HEAVY_MODULES),
+    Budget(
+        module="refresher", milliseconds=2000, forbidden=HEAVY_MODULES + ("fastapi",)
+    ),
+    Budget(module="cli", milliseconds=300, forbidden=HEAVY_MODULES + WEB_MODULES),
+    Budget(
+        module="persistence.migration",
+        milliseconds=300,
+        forbidden=HEAVY_MODULES + WEB_MODULES,
+    ),
+]
+
+
+@dataclass
+class Import:
+    name: str
+    depth: int
+    # including everything it imported
+    milliseconds: float
+
+
+@dataclass
+class Startup:
+    module: str
+    # what importing the module loaded, itself last
+    imports: list[Import]
+
+    @property
+    def milliseconds(self) -> float:
+        return self.imports[-1].milliseconds
+
+    def loaded(self, package: str) -> bool:
+        return any(
+            i.name == package or i.name.startswith(f"{package}.") for i in self.imports
+        )
+
+    def heaviest(self, count: int) -> list[Import]:
+        direct = [i for i in self.imports if i.depth == 1]
+        return sorted(direct, key=lambda i: i.milliseconds, reverse=True)[:count]
+
+
+def import_once(module: str) -> Startup:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append(Import(name.strip(), depth, int(cumulative) / 1000))
+    # the interpreter's own imports come first, each at depth 0
+    start = len(imports) - 1
+    while start > 0 and imports[start - 1].depth > 0:
+        start -= 1
+    return Startup(module=module, imports=imports[start:])
+
+
+def measure(module: str, runs: int) -> Startup:
+    return min(
+        (import_once(module) for _ in range(runs)),
+        key=lambda startup: startup.milliseconds,
+    )
+
+
+def check(budget: Budget, startup: Startup) -> list[str]:
+    problems = [
+        f"{budget.module} imports {package}"
+        for package in budget.forbidden
+        if startup.loaded(package)
+    ]
+    if startup.milliseconds > budget.milliseconds:
+        problems.append(
+            f"{budget.module} takes {startup.milliseconds:.0f}ms to import,"
+            f" over its {budget.milliseconds:.0f}ms budget"
+        )
+    return problems
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--heaviest", type=int, default=5)
+    args = parser.parse_args()
+
+    problems = []
+    for budget in BUDGETS:
+        startup = measure(budget.module, args.runs)
+        heaviest = ", ".join(
+            f"{i.name} {i.milliseconds:.0f}ms" for i in startup.heaviest(args.heaviest)
+        )
+        print(
+            f"{budget.module:<24} {startup.milliseconds:8.1f}ms"
+            f" (budget {budget.milliseconds:.0f}ms)  {heaviest}"
+        )
+        problems += check(budget, startup)
+    for problem in problems:
+        print(problem, file=sys.stderr)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
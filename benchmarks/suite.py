@@ -0,0 +1,378 @@
+"""Latency benchmarks for Datastore queries, PodcastService flows and the API.
+
+Every case runs against its own fresh copy of a generated dataset, migrated
+to the current schema, so the writes of one case never skew the next. Each
+reports p50/p95/p99 in milliseconds. Results can be saved as a baseline and
+later runs compared against it, failing when a percentile regresses by more
+than the threshold.
+
+    python -m benchmarks.suite --scale small --save-baseline benchmarks/baseline.json
+    python -m benchmarks.suite --scale small --baseline benchmarks/baseline.json
+"""
+
+import argparse
+import json
+import logging
+import random
+import sqlite3
+import statistics
+import sys
+import time
+from contextlib import closing, contextmanager
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Callable, Iterator
+
+from fastapi.testclient import TestClient
+
+from benchmarks.generator import (
+    SCALES,
+    Scale,
+    feed_id,
+    feed_url,
+    generate,
+    user_email,
+    user_id,
+)
+from business.async_podcast_service import AsyncPodcastService
+from business.podcast_service import PodcastService
+from business.rss import FakeRssParser, PodcastImport
+from persistence.database_thread import DatabaseThread
+from persistence.datastore import Datastore
+from persistence.migration import migrate
+
+PERCENTILES = ("p50", "p95", "p99")
+
+
+@dataclass
+class Result:
+    name: str
+    p50: float
+    p95: float
+    p99: float
+
+    def as_dict(self) -> dict[str, float]:
+        return {"p50": self.p50, "p95": self.p95, "p99": self.p99}
+
+
+class Inputs:
+    """Random but reproducible arguments for the cases."""
+
+    def __init__(self, connection: sqlite3.Connection, scale: Scale, seed: int) -> None:
+        self.rng = random.Random(seed)
+        self.scale = scale
+        self.listens = connection.execute(
+            "select user_id, episode_id from previous_listen order by rowid limit 10000;"
+        ).fetchall()
+        self.subscriptions = connection.execute(
+            "select user_id, feed_id from subscription order by rowid limit 10000;"
+        ).fetchall()
+
+    def user_index(self) -> int:
+        return self.rng.randrange(self.scale.users)
+
+    def user(self) -> str:
+        return user_id(self.user_index())
+
+    def listen(self) -> tuple[str, str]:
+        return self.rng.choice(self.listens)
+
+    def subscription(self) -> tuple[str, str]:
+        return self.rng.choice(self.subscriptions)
+
+    def feed_index(self) -> int:
+        return self.rng.randrange(self.scale.feeds)
+
+
+def measure(name: str, case: Callable[[], object], iterations: int) -> Result:
+    for _ in range(min(5, iterations)):
+        case()
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        case()
+        timings.append((time.perf_counter() - start) * 1000)
+    cuts = statistics.quantiles(timings, n=100, method="inclusive")
+    return Result(name=name, p50=cuts[49], p95=cuts[94], p99=cuts[98])
+
+
+def datastore_cases(
+    datastore: Datastore, inputs: Inputs
+) -> dict[str, Callable[[], object]]:
+    since = date(2025, 6, 1) - timedelta(weeks=12)
+
+    def set_current_time() -> None:
+        user, episode = inputs.listen()
+        datastore.set_current_time(
+            episode_id=episode,
+            user_id=user,
+            seconds=inputs.rng.randint(0, 3600),
+            time=datetime.now(),
+        )
+
+    return {
+        "datastore.get_user_by_email": lambda: datastore.get_user_by_email(
+            user_email(inputs.user_index())
+        ),
+        "datastore.get_user_home_feed": lambda: datastore.get_user_home_feed(
+            user_id=inputs.user(),
+            number_of_episodes=10,
+            page=1,
+            search=None,
+            include_finished=False,
+            chronological=False,
+        ),
+        "datastore.get_user_home_feed.page_20": lambda: datastore.get_user_home_feed(
+            user_id=inputs.user(),
+            number_of_episodes=10,
+            page=20,
+            search=None,
+            include_finished=False,
+            chronological=False,
+        ),
+        "datastore.get_user_home_feed.search": lambda: datastore.get_user_home_feed(
+            user_id=inputs.user(),
+            number_of_episodes=10,
+            page=1,
+            search="tangents",
+            include_finished=False,
+            chronological=False,
+        ),
+        "datastore.get_single_feed": lambda: datastore.get_single_feed(
+            *inputs.subscription(), number_of_episodes=10, page=1, chronological=False
+        ),
+        "datastore.get_episode": lambda: datastore.get_episode(
+            *reversed(inputs.listen())
+        ),
+        "datastore.get_previous_listen": lambda: datastore.get_previous_listen(
+            *inputs.listen()
+        ),
+        "datastore.get_latest_listen_play_info": lambda: (
+            datastore.get_latest_listen_play_info(inputs.user())
+        ),
+        "datastore.get_in_progress_play_infos": lambda: (
+            datastore.get_in_progress_play_infos(inputs.user(), limit=10)
+        ),
+        "datastore.get_user_subscribed_feeds": lambda: (
+            datastore.get_user_subscribed_feeds(inputs.user())
+        ),
+        "datastore.get_all_feeds": datastore.get_all_feeds,
+        "datastore.get_latest_episode": lambda: datastore.get_latest_episode(
+            feed_id(inputs.feed_index())
+        ),
+        "datastore.get_feeds_by_urls": lambda: datastore.get_feeds_by_urls(
+            [feed_url(inputs.feed_index()) for _ in range(100)]
+        ),
+        "datastore.get_listening_by_day": lambda: datastore.get_listening_by_day(
+            inputs.user(), since=since
+        ),
+        "datastore.get_listening_by_feed": lambda: datastore.get_listening_by_feed(
+            inputs.user(), since=since
+        ),
+        "datastore.set_current_time": set_current_time,
+    }
+
+
+def refresh_parser(connection: sqlite3.Connection, scale: Scale) -> FakeRssParser:
+    """Imports that look like the stored feeds plus one new episode each."""
+    imports: dict[str, PodcastImport] = {}
+    datastore = Datastore(connection=connection)
+    for index in range(min(scale.feeds, 50)):
+        latest = datastore.get_latest_episode(feed_id(index))
+        new_episode = latest.assets
+        imports[feed_url(index)] = PodcastImport(
+            title=f"podcast {index}",
+            cover_art_url=f"https://images.example.com/{index}.jpg",
+            episode_assets=[
+                type(new_episode)(
+                    title=f"{new_episode.title} (new)",
+                    description=new_episode.description,
+                    download_link=new_episode.download_link,
+                    published_date=new_episode.published_date + timedelta(days=1),
+                    length=new_episode.length,
+                ),
+                new_episode,
+            ],
+        )
+    return FakeRssParser(imports=imports)
+
+
+def service_cases(
+    service: PodcastService, inputs: Inputs
+) -> dict[str, Callable[[], object]]:
+    def refresh_one_feed() -> None:
+        index = inputs.rng.randrange(min(inputs.scale.feeds, 50))
+        service._update_feeds(service.datastore.get_feeds_by_urls([feed_url(index)]))
+
+    def update_current_play_time() -> None:
+        user, episode = inputs.listen()
+        service.update_current_play_time(
+            episode_id=episode, user_id=user, seconds=inputs.rng.randint(0, 3600)
+        )
+
+    return {
+        "service.get_user_home_feed": lambda: service.get_user_home_feed(
+            user_id=inputs.user(), page=1
+        ),
+        "service.get_play_information": lambda: service.get_play_information(
+            *reversed(inputs.listen())
+        ),
+        "service.update_current_play_time": update_current_play_time,
+        "service.get_continue_listening": lambda: service.get_continue_listening(
+            inputs.user(), limit=10
+        ),
+        "service.get_listening_stats": lambda: service.get_listening_stats(
+            inputs.user(), weeks=12
+        ),
+        "service.refresh_feed": refresh_one_feed,
+    }
+
+
+def api_cases(
+    service: PodcastService, database: DatabaseThread, inputs: Inputs
+) -> dict[str, Callable[[], object]]:
+    import endpoints
+
+    current_email = {"email": user_email(0)}
+    endpoints.app.dependency_overrides[endpoints.authenticated_user_email] = lambda: (
+        current_email["email"]
+    )
+    async_service = AsyncPodcastService(service=service, database=database)
+    endpoints.app.dependency_overrides[endpoints.podcast_service] = lambda: (
+        async_service
+    )
+    client = TestClient(endpoints.app)
+
+    def get(path: str) -> Callable[[], object]:
+        def case() -> object:
+            current_email["email"] = user_email(inputs.user_index())
+            response = client.get(path)
+            assert response.status_code == 200, response.text
+            return response
+
+        return case
+
+    def listened() -> object:
+        user, episode = inputs.listen()
+        current_email["email"] = user_email(int(user.removeprefix("user-")))
+        response = client.post(
+            f"/listened/{episode}?seconds_listened={inputs.rng.randint(0, 3600)}"
+        )
+        assert response.status_code == 200, response.text
+        return response
+
+    return {
+        "api.my_feed": get("/my_feed"),
+        "api.my_feed.search": get("/my_feed?search=tangents"),
+        "api.latest": get("/latest"),
+        "api.continue_listening": get("/continue_listening"),
+        "api.subscribed_feeds": get("/subscribed_feeds"),
+        "api.stats": get("/stats"),
+        "api.listened": listened,
+    }
+
+
+def working_copy(template: Path) -> sqlite3.Connection:
+    """Writes made by the cases must not leak into the next run."""
+    source = sqlite3.connect(template)
+    connection = sqlite3.connect(":memory:", check_same_thread=False)
+    source.backup(connection)
+    source.close()
+    return connection
+
+
+@contextmanager
+def fresh_cases(
+    template: Path, scale: Scale, seed: int
+) -> Iterator[dict[str, Callable[[], object]]]:
+    """Every case, bound to its own working copy of the dataset."""
+    import endpoints
+
+    connection = working_copy(template)
+    database = DatabaseThread(connection)
+    inputs = Inputs(connection, scale, seed=seed)
+    service = PodcastService(
+        datastore=Datastore(connection=connection),
+        rss_parser=refresh_parser(connection, scale),
+    )
+    try:
+        yield {
+            **datastore_cases(service.datastore, inputs),
+            **service_cases(service, inputs),
+            **api_cases(service, database, inputs),
+        }
+    finally:
+        endpoints.app.dependency_overrides.clear()
+        database.close()
+
+
+def compare(
+    results: list[Result], baseline: dict[str, dict[str, float]], threshold: float
+) -> list[str]:
+    regressions = []
+    for result in results:
+        reference = baseline.get(result.name)
+        if reference is None:
+            continue
+        for percentile in PERCENTILES:
+            before, after = reference[percentile], getattr(result, percentile)
+            if after > before * (1 + threshold):
+                regressions.append(
+                    f"{result.name} {percentile}: {before:.3f}ms -> {after:.3f}ms"
+                )
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scale", choices=SCALES, default="small")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--data-dir", default="./benchmarks/data")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--only", default="", help="run cases starting with this")
+    parser.add_argument("--baseline")
+    parser.add_argument("--save-baseline")
+    parser.add_argument("--threshold", type=float, default=0.25)
+    args = parser.parse_args()
+
+    # Per-request and per-feed INFO logs would dominate the output and timings.
+    logging.disable(logging.INFO)
+    scale = SCALES[args.scale]
+    template = Path(args.data_dir) / f"{args.scale}-{args.seed}.db"
+    if not template.exists():
+        template.parent.mkdir(parents=True, exist_ok=True)
+        print(f"generating {args.scale} dataset in {template}", file=sys.stderr)
+        generate(template, scale, seed=args.seed)
+    # a dataset cached before the latest migrations is brought up to date
+    with closing(sqlite3.connect(template)) as connection:
+        migrate(connection)
+
+    with fresh_cases(template, scale, args.seed) as cases:
+        names = [name for name in cases if name.startswith(args.only)]
+
+    results = []
+    for name in names:
+        with fresh_cases(template, scale, args.seed) as cases:
+            result = measure(name, cases[name], args.iterations)
+        results.append(result)
+        print(
+            f"{name:<48} p50 {result.p50:8.3f}ms  p95 {result.p95:8.3f}ms  p99 {result.p99:8.3f}ms"
+        )
+
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(
+            json.dumps({r.name: r.as_dict() for r in results}, indent=2) + "\n"
+        )
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
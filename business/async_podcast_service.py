@@ -0,0 +1,221 @@
+import logging
+from dataclasses import dataclass, field
+from functools import partial
+from itertools import cycle
+from typing import Callable, Concatenate, Iterator, Optional, ParamSpec, TypeVar
+
+from anyio import CapacityLimiter, to_thread
+
+from business.entities import User
+from business.events import EventHub
+from business.opml import ImportProgress, export_opml
+from business.podcast import Episode, Feed, PlayInfo
+from business.podcast_service import PodcastService, RefreshSummary
+from business.rss import FeedNotModified, PodcastImport
+from business.stats import ListeningStats
+from persistence.database_thread import DatabaseThread
+from persistence.datastore import RefreshStatus
+
+logger = logging.getLogger(__name__)
+
+MAX_CONCURRENT_FETCHES = 8
+
+P = ParamSpec("P")
+T = TypeVar("T")
+
+
+@dataclass
+class Reader:
+    """A PodcastService on its own connection and database thread."""
+
+    service: PodcastService
+    database: DatabaseThread
+
+
+@dataclass
+class AsyncPodcastService:
+    """PodcastService for the event loop.
+
+    Writes run on the database thread, which owns the connection of the
+    wrapped service. Reads take turns on the readers, which in WAL mode never
+    wait for the writer, so a slow write does not hold up every page. Reads
+    needing archived episodes find out on a reader and have the database
+    thread restore them first. Without readers, reads share the database
+    thread, which is what in-memory databases need. Feed downloads run on
+    worker threads under their own limiter, so slow feeds can hold at most
+    MAX_CONCURRENT_FETCHES threads and never the ones requests need.
+    """
+
+    service: PodcastService
+    database: DatabaseThread
+    readers: list[Reader] = field(default_factory=list)
+    fetch_limiter: CapacityLimiter = field(
+        default_factory=lambda: CapacityLimiter(MAX_CONCURRENT_FETCHES)
+    )
+    events: EventHub = field(init=False)
+    _next_reader: Iterator[Reader] = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self._next_reader = cycle(
+            self.readers or [Reader(service=self.service, database=self.database)]
+        )
+        datastore = self.service.datastore
+        self.events = EventHub(
+            fetch_latest_id=partial(self.database.run, datastore.get_latest_event_id),
+            fetch_after=partial(self.database.run, datastore.get_events_after),
+            fetch_user_after=partial(
+                self.database.run, datastore.get_user_events_after
+            ),
+        )
+
+    async def find_user_by_email(self, user_email: str) -> User:
+        return await self._read(PodcastService.find_user_by_email, user_email)
+
+    async def save_user(self, user_email: str) -> User:
+        return await self.database.run(self.service.save_user, user_email)
+
+    async def get_user_home_feed(
+        self,
+        user_id: str,
+        page: int,
+        search: Optional[str] = None,
+        chronological: bool = False,
+        include_finished: Optional[bool] = False,
+    ) -> list[PlayInfo]:
+        if await self._read(
+            PodcastService.home_feed_needs_restore, user_id, page, search, chronological
+        ):
+            await self.database.run(
+                self.service.restore_home_feed, user_id, page, search, chronological
+            )
+        return await self._read(
+            PodcastService.read_user_home_feed,
+            user_id=user_id,
+            page=page,
+            search=search,
+            chronological=chronological,
+            include_finished=include_finished,
+        )
+
+    async def get_single_feed(
+        self, user_id: str, page: int, feed_id: str, chronological: bool = False
+    ) -> list[PlayInfo]:
+        if await self._read(
+            PodcastService.single_feed_needs_restore, feed_id, page, chronological
+        ):
+            await self.database.run(
+                self.service.restore_single_feed, feed_id, page, chronological
+            )
+        return await self._read(
+            PodcastService.read_single_feed,
+            user_id=user_id,
+            page=page,
+            feed_id=feed_id,
+            chronological=chronological,
+        )
+
+    async def subscribe_user_to_podcast(self, user_id: str, feed_url: str) -> None:
+        if await self.database.run(
+            self.service.subscribe_to_known_feed, user_id, feed_url
+        ):
+            return
+        podcast = await self._import_feed(feed_url)
+        await self.database.run(
+            self.service.save_subscription, user_id, feed_url, podcast
+        )
+
+    async def get_episode(self, episode_id: str, user_id: str) -> Episode:
+        await self._restore_episode(episode_id)
+        return await self._read(PodcastService.read_episode, episode_id, user_id)
+
+    async def get_play_information(self, episode_id: str, user_id: str) -> PlayInfo:
+        await self._restore_episode(episode_id)
+        return await self._read(
+            PodcastService.read_play_information, episode_id, user_id
+        )
+
+    async def _restore_episode(self, episode_id: str) -> None:
+        if await self._read(PodcastService.episode_needs_restore, episode_id):
+            await self.database.run(self.service.restore_episode, episode_id)
+
+    async def update_current_play_time(
+        self, episode_id: str, user_id: str, seconds: int
+    ) -> None:
+        await self.database.run(
+            self.service.update_current_play_time, episode_id, user_id, seconds
+        )
+        self.events.wake()
+
+    async def update_user_feeds(self, user_id: str) -> RefreshSummary:
+        feeds = await self.database.run(
+            self.service.datastore.get_user_subscribed_feeds, user_id
+        )
+        summary = RefreshSummary()
+        for feed in feeds:
+            try:
+                etag = await self.database.run(
+                    self.service.datastore.get_feed_etag, feed.id
+                )
+                podcast = await self._import_feed(feed.url, etag)
+                await self.database.run(self.service.reconcile_feed, feed, podcast)
+                self.events.wake()
+                summary.processed += 1
+            except FeedNotModified:
+                summary.processed += 1
+            except Exception:
+                logger.exception(f"refresh of {feed.url} failed")
+                summary.failed += 1
+        return summary
+
+    async def get_latest_listen_play_info(self, user_id: str) -> Optional[PlayInfo]:
+        return await self._read(PodcastService.get_latest_listen_play_info, user_id)
+
+    async def get_continue_listening(self, user_id: str, limit: int) -> list[PlayInfo]:
+        return await self._read(PodcastService.get_continue_listening, user_id, limit)
+
+    async def get_listening_stats(self, user_id: str, weeks: int) -> ListeningStats:
+        return await self._read(PodcastService.get_listening_stats, user_id, weeks)
+
+    async def get_user_subscribed_feeds(self, user_id: str) -> list[Feed]:
+        return await self._read(PodcastService.get_user_subscribed_feeds, user_id)
+
+    async def import_opml(self, user_id: str, document: bytes) -> list[Feed]:
+        return await self.database.run(self.service.import_opml, user_id, document)
+
+    async def save_opml_import(self, progress: ImportProgress) -> None:
+        await self.database.run(self.service.datastore.save_opml_import, progress)
+
+    async def get_opml_import(self, import_id: str) -> Optional[ImportProgress]:
+        return await self.database.run(
+            self.service.datastore.get_opml_import, import_id
+        )
+
+    async def export_opml(self, user_id: str) -> Iterator[str]:
+        return export_opml(await self.get_user_subscribed_feeds(user_id))
+
+    async def get_refresh_status(self, job_id: str) -> Optional[RefreshStatus]:
+        return await self.database.run(
+            self.service.datastore.get_refresh_status, job_id
+        )
+
+    async def get_cover_art_digest(self, url: str) -> Optional[str]:
+        return await self.database.run(self.service.datastore.get_cover_art_digest, url)
+
+    async def _read(
+        self,
+        method: Callable[Concatenate[PodcastService, P], T],
+        *args: P.args,
+        **kwargs: P.kwargs,
+    ) -> T:
+        reader = next(self._next_reader)
+        return await reader.database.run(method, reader.service, *args, **kwargs)
+
+    async def _import_feed(
+        self, feed_url: str, etag: Optional[str] = None
+    ) -> PodcastImport:
+        return await to_thread.run_sync(
+            self.service.rss_parser.import_feed,
+            feed_url,
+            etag,
+            limiter=self.fetch_limiter,
+        )
@@ -0,0 +1,84 @@
+"""Resized cover art, so clients showing a 64px icon do not download the
+3000px original from a slow third-party host.
+
+The refresher fetches each cover art url once and saves WebP and JPEG
+thumbnails at THUMBNAIL_SIZES, which the API serves from local disk.
+"""
+
+import hashlib
+import io
+import logging
+from dataclasses import dataclass, field
+
+from business.rss import FeedFetcher
+from persistence.cover_art import CoverArtStore
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SIZES = (64, 256, 600)
+# preferred first, WebP is about a third smaller at the same quality
+FORMATS = ("webp", "jpeg")
+MEDIA_TYPES = {"webp": "image/webp", "jpeg": "image/jpeg"}
+MAX_COVER_ART_BYTES = 20 * 1024 * 1024
+# decoded size limit, a small file can still decode to gigabytes of pixels
+MAX_COVER_ART_PIXELS = 40_000_000
+JPEG_QUALITY = 85
+WEBP_QUALITY = 80
+
+
+class CoverArtTooLarge(Exception): ...
+
+
+def make_thumbnails(original: bytes) -> dict[tuple[int, str], bytes]:
+    """Every size and format of a cover, none larger than the original."""
+    # Pillow is only loaded by the processes making thumbnails
+    from PIL import Image, features
+
+    formats = [f for f in FORMATS if f != "webp" or features.check("webp")]
+    # only reads the header, pixels are decoded by draft() and convert()
+    image = Image.open(io.BytesIO(original))
+    width, height = image.size
+    if width * height > MAX_COVER_ART_PIXELS:
+        raise CoverArtTooLarge(f"cover art of {width}x{height} pixels")
+    # JPEG decodes straight to a fraction of its size, much faster than
+    # decoding every pixel of a huge original and shrinking it afterwards
+    image.draft("RGB", (max(THUMBNAIL_SIZES), max(THUMBNAIL_SIZES)))
+    if image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info:
+        # transparent areas come out white rather than black
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image, mask=image.getchannel("A"))
+        image = background
+    image = image.convert("RGB")
+    thumbnails = {}
+    # each size is shrunk from the previous, larger one
+    for size in sorted(THUMBNAIL_SIZES, reverse=True):
+        image.thumbnail((size, size), Image.Resampling.LANCZOS)
+        for format in formats:
+            output = io.BytesIO()
+            if format == "webp":
+                image.save(output, "WEBP", quality=WEBP_QUALITY)
+            else:
+                image.save(output, "JPEG", quality=JPEG_QUALITY, optimize=True)
+            thumbnails[size, format] = output.getvalue()
+    return thumbnails
+
+
+@dataclass
+class CoverArtCache:
+    store: CoverArtStore
+    fetcher: FeedFetcher = field(
+        default_factory=lambda: FeedFetcher(max_bytes=MAX_COVER_ART_BYTES)
+    )
+
+    def fetch(self, url: str) -> str:
+        """Downloads and resizes the cover art, returns its digest."""
+        original = self.fetcher.fetch(url).body
+        digest = hashlib.sha256(original).hexdigest()
+        # another feed may have the same image under a different url
+        if all(self.store.has(digest, size, "jpeg") for size in THUMBNAIL_SIZES):
+            return digest
+        for (size, format), thumbnail in make_thumbnails(original).items():
+            self.store.put(digest, size, format, thumbnail)
+        logger.info(f"made thumbnails of {url} ({len(original)} bytes)")
+        return digest
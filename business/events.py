@@ -0,0 +1,191 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import time
+from dataclasses import dataclass
+from typing import AsyncGenerator, Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+NEW_EPISODES = "new_episodes"
+PROGRESS = "progress"
+# how long a reconnecting client can resume from its last event id
+EVENT_RETENTION_SECONDS = 24 * 60 * 60
+EVENT_POLL_SECONDS = 1.0
+KEEPALIVE_SECONDS = 15.0
+EVENTS_PER_POLL = 1000
+# EventSource reconnects with the url it was opened with, long enough to
+# outlast a network change, short enough not to be worth leaking
+EVENT_TOKEN_SECONDS = 10 * 60
+
+
+@dataclass
+class Event:
+    id: int
+    user_id: str
+    kind: str
+    # json
+    data: str
+
+    def encode(self) -> str:
+        return f"id: {self.id}\nevent: {self.kind}\ndata: {self.data}\n\n"
+
+
+def sign_event_token(secret: str, user_id: str, expires_at: int) -> str:
+    """A token opening the event stream of the user until expires_at.
+
+    EventSource cannot send an Authorization header, the token goes in the
+    url instead.
+    """
+    payload = f"{user_id}.{expires_at}"
+    signature = hmac.new(secret.encode(), payload.encode(), hashlib.sha256)
+    return f"{payload}.{signature.hexdigest()}"
+
+
+def verify_event_token(
+    secret: str, token: str, now: Optional[float] = None
+) -> Optional[str]:
+    """The user id the token was signed for, None when it is not valid."""
+    user_id, _, rest = token.partition(".")
+    expires_at, _, _ = rest.partition(".")
+    if not expires_at.isdigit():
+        return None
+    if int(expires_at) < (time.time() if now is None else now):
+        return None
+    if not hmac.compare_digest(
+        token, sign_event_token(secret, user_id, int(expires_at))
+    ):
+        return None
+    return user_id
+
+
+def new_episodes_data(feed_id: str, count: int) -> str:
+    return json.dumps({"feed_id": feed_id, "count": count})
+
+
+def progress_data(episode_id: str, seconds: int) -> str:
+    return json.dumps({"episode_id": episode_id, "seconds": seconds})
+
+
+class EventHub:
+    """Fans the events saved in the database out to the streams open in this
+    process.
+
+    Events are written by whichever process caused them, the API workers
+    or the refresher, so each worker polls the event table once per
+    interval for all its streams, and only while it has any. An idle
+    stream costs a queue and a keepalive every KEEPALIVE_SECONDS.
+    """
+
+    def __init__(
+        self,
+        fetch_latest_id: Callable[[], Awaitable[int]],
+        fetch_after: Callable[[int], Awaitable[list[Event]]],
+        fetch_user_after: Callable[[str, int], Awaitable[list[Event]]],
+        poll_seconds: float = EVENT_POLL_SECONDS,
+    ) -> None:
+        self.fetch_latest_id = fetch_latest_id
+        self.fetch_after = fetch_after
+        self.fetch_user_after = fetch_user_after
+        self.poll_seconds = poll_seconds
+        self.queues: dict[str, set[asyncio.Queue[Event]]] = {}
+        self.last_id = 0
+        self.poller: Optional[asyncio.Task[None]] = None
+        self.ready: Optional[asyncio.Future[None]] = None
+        self.woken = asyncio.Event()
+
+    @property
+    def streams(self) -> int:
+        return sum(len(queues) for queues in self.queues.values())
+
+    def wake(self) -> None:
+        """Polls now, for events this process just saved."""
+        if (
+            self.poller is not None
+            and self.poller.get_loop() is asyncio.get_running_loop()
+        ):
+            self.woken.set()
+
+    async def stream(
+        self,
+        user_id: str,
+        after_id: Optional[int],
+        keepalive_seconds: float = KEEPALIVE_SECONDS,
+    ) -> AsyncGenerator[Optional[Event], None]:
+        """The user's events after after_id, then as they happen.
+
+        Yields None when nothing happened for keepalive_seconds.
+        """
+        queue: asyncio.Queue[Event] = asyncio.Queue()
+        self.queues.setdefault(user_id, set()).add(queue)
+        try:
+            # from here on the poller queues every event after last_id, and
+            # the missed ones up to it are in the database already
+            await self._start()
+            if after_id is not None:
+                for event in await self.fetch_user_after(user_id, after_id):
+                    yield event
+                    after_id = event.id
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), keepalive_seconds)
+                except TimeoutError:
+                    yield None
+                    continue
+                if after_id is not None and event.id <= after_id:
+                    continue
+                yield event
+        finally:
+            queues = self.queues[user_id]
+            queues.discard(queue)
+            if not queues:
+                del self.queues[user_id]
+
+    async def _start(self) -> None:
+        loop = asyncio.get_running_loop()
+        # the poller stops with the last stream, or with its event loop in tests
+        if (
+            self.poller is None
+            or self.poller.done()
+            or self.poller.get_loop() is not loop
+        ):
+            self.ready = loop.create_future()
+            self.poller = loop.create_task(self._poll(self.ready))
+        assert self.ready is not None
+        await asyncio.shield(self.ready)
+
+    async def _poll(self, ready: asyncio.Future[None]) -> None:
+        # events from before are not delivered to streams started after
+        try:
+            self.last_id = await self.fetch_latest_id()
+        except Exception as error:
+            ready.set_exception(error)
+            return
+        ready.set_result(None)
+        self.woken = asyncio.Event()
+        while self.queues:
+            try:
+                await asyncio.wait_for(self.woken.wait(), self.poll_seconds)
+            except TimeoutError:
+                pass
+            self.woken.clear()
+            try:
+                await self._deliver()
+            except Exception:
+                logger.exception("polling events failed")
+
+    async def _deliver(self) -> None:
+        while True:
+            events = await self.fetch_after(self.last_id)
+            for event in events:
+                self.last_id = event.id
+                for queue in self.queues.get(event.user_id, ()):
+                    queue.put_nowait(event)
+            if len(events) < EVENTS_PER_POLL:
+                return
+
+    def close(self) -> None:
+        if self.poller is not None:
+            self.poller.cancel()
@@ -0,0 +1,86 @@
+"""Normalization of the raw values feedparser exposes on a feed entry.
+
+These run once per entry on every refresh of every feed, so they avoid
+building intermediate objects and never raise on malformed input: anything
+unusable comes back as None and the caller decides what that means.
+"""
+
+from datetime import datetime
+from time import struct_time
+from typing import Optional
+
+AUDIO_EXTENSIONS = (".mp3", ".m4a", ".m4b", ".aac", ".ogg", ".oga", ".opus", ".wav")
+
+
+def parse_duration(value: Optional[str]) -> Optional[int]:
+    """Seconds in an itunes:duration.
+
+    The tag holds either a number of seconds or a [[hh:]mm:]ss timecode,
+    sometimes with a fractional part on the last component.
+    """
+    if not value:
+        return None
+    parts = value.split(":")
+    if len(parts) > 3:
+        return None
+    try:
+        last = parts[-1]
+        total: float = float(last) if "." in last else int(last)
+        multiplier = 60
+        for part in reversed(parts[:-1]):
+            total += int(part) * multiplier
+            multiplier *= 60
+        seconds = int(total)
+    except (ValueError, OverflowError):
+        return None
+    if seconds < 0:
+        return None
+    return seconds
+
+
+# feedparser entries are dict subclasses whose item access goes through a
+# key remapping layer, and entry["enclosures"] rebuilds a list of new dicts
+# on every access. Reading the underlying dict directly skips all of that.
+_get = dict.get
+
+
+def _is_audio(link: dict, href: str) -> bool:
+    media_type = _get(link, "type")
+    if media_type:
+        return media_type.startswith("audio/")
+    # some feeds omit the type, fall back on the file name
+    return href.split("?", 1)[0].lower().endswith(AUDIO_EXTENSIONS)
+
+
+def find_audio_url(entry: dict) -> Optional[str]:
+    """Download link of the first audio enclosure, whatever the audio format.
+
+    feedparser exposes enclosures as links with rel="enclosure", those are
+    preferred over other audio links of the entry.
+    """
+    fallback = None
+    for link in _get(entry, "links") or ():
+        href = _get(link, "href")
+        if not href or not _is_audio(link, href):
+            continue
+        if _get(link, "rel") == "enclosure":
+            return href
+        if fallback is None:
+            fallback = href
+    return fallback
+
+
+def parse_published_date(entry: dict) -> Optional[datetime]:
+    """Publication date as a naive datetime holding the UTC wall clock.
+
+    feedparser already normalizes dates to UTC struct_time, so the fields
+    can be used directly instead of a round trip through local time.
+    """
+    parsed: Optional[struct_time] = _get(entry, "published_parsed") or _get(
+        entry, "updated_parsed"
+    )
+    if parsed is None:
+        return None
+    return datetime(
+        parsed[0], parsed[1], parsed[2], parsed[3], parsed[4], min(parsed[5], 59)
+    )
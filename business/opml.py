@@ -0,0 +1,65 @@
+from dataclasses import dataclass
+from typing import Iterable, Iterator, Optional
+from uuid import uuid4
+from xml.etree import ElementTree
+from xml.sax.saxutils import quoteattr
+
+from pydantic import BaseModel, Field, computed_field
+
+from business.podcast import Feed
+
+MAX_OPML_BYTES = 2 * 1024 * 1024
+
+
+class InvalidOpml(Exception): ...
+
+
+@dataclass
+class OpmlOutline:
+    feed_url: str
+    title: Optional[str]
+
+
+class ImportProgress(BaseModel):
+    user_id: str
+    total: int
+    fetched: int = 0
+    failed: int = 0
+    id: str = Field(default_factory=lambda: str(uuid4()))
+
+    @computed_field
+    @property
+    def done(self) -> bool:
+        return self.fetched + self.failed >= self.total
+
+
+def parse_opml(document: bytes) -> list[OpmlOutline]:
+    """Feed outlines of an OPML document, deduplicated in document order.
+
+    Outlines may be nested in categories, only the ones pointing to an http
+    feed are kept.
+    """
+    try:
+        root = ElementTree.fromstring(document)
+    except ElementTree.ParseError as error:
+        raise InvalidOpml(str(error)) from error
+    if root.tag != "opml":
+        raise InvalidOpml("document root is not an opml element")
+    outlines: dict[str, OpmlOutline] = {}
+    for outline in root.iter("outline"):
+        feed_url = (outline.get("xmlUrl") or "").strip()
+        if not feed_url.startswith(("http://", "https://")) or feed_url in outlines:
+            continue
+        outlines[feed_url] = OpmlOutline(
+            feed_url=feed_url, title=outline.get("title") or outline.get("text")
+        )
+    return list(outlines.values())
+
+
+def export_opml(feeds: Iterable[Feed]) -> Iterator[str]:
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n<opml version="2.0">\n'
+    yield "<head><title>podcasticot subscriptions</title></head>\n<body>\n"
+    for feed in feeds:
+        title = quoteattr(feed.title)
+        yield f'<outline type="rss" text={title} title={title} xmlUrl={quoteattr(feed.url)}/>\n'
+    yield "</body>\n</opml>\n"
@@ -1,20 +1,29 @@
 from __future__ import annotations
 
-import logging
 from dataclasses import dataclass
 from datetime import datetime, timedelta
-from time import mktime
 from typing import Optional
 
 from pydantic import BaseModel, ConfigDict
 
-logger = logging.getLogger(__name__)
+from business.feed_entry import find_audio_url, parse_duration, parse_published_date
 
 
-class NoAudio(Exception): ...
+class InvalidEntry(Exception): ...
 
 
-@dataclass
+class NoAudio(InvalidEntry): ...
+
+
+class NoPublishedDate(InvalidEntry): ...
+
+
+# plain slotted dataclasses rather than models: the datastore builds
+# thousands per page from rows that need no validation, and FastAPI still
+# serializes them like models
+
+
+@dataclass(slots=True)
 class EpisodeAssets:
     title: str
     description: Optional[str]
@@ -24,50 +33,23 @@ class EpisodeAssets:
 
     @staticmethod
     def from_feed_entry(entry: dict) -> EpisodeAssets:
-        audio_file = next(
-            (link for link in entry["links"] if link["type"] == "audio/mpeg"),
-            None,
-        )
-        # comes as <itunes:duration>03:11:22</itunes:duration>
-        # feedparser exposes it as itunes_duration which is a string representing a number of seconds OR a timecode :)
-        if itunes_duration := entry.get("itunes_duration"):
-            if ":" in itunes_duration:
-                values = itunes_duration.split(":")
-                match len(values):
-                    case 1:
-                        length = timedelta(seconds=int(values[0])).seconds
-                    case 2:
-                        length = timedelta(
-                            seconds=int(values[1]), minutes=int(values[0])
-                        ).seconds
-                    case 3:
-                        length = timedelta(
-                            seconds=int(values[2]),
-                            minutes=int(values[1]),
-                            hours=int(values[0]),
-                        ).seconds
-                    case _:
-                        logger.info(
-                            f"Unexpected value for itunes duration : {itunes_duration}"
-                        )
-                        length = None
-            else:
-                length = int(itunes_duration)
-
-        else:
-            length = None
-        if audio_file is None:
+        download_link = find_audio_url(entry)
+        if download_link is None:
             raise NoAudio
+        published_date = parse_published_date(entry)
+        if published_date is None:
+            raise NoPublishedDate
         return EpisodeAssets(
-            title=entry["title"],
-            description=entry.get("summary", None),
-            download_link=audio_file.get("href", None),
-            published_date=datetime.fromtimestamp(mktime(entry["published_parsed"])),
-            length=length,
+            title=dict.get(entry, "title", ""),
+            description=dict.get(entry, "summary"),
+            download_link=download_link,
+            published_date=published_date,
+            # comes as <itunes:duration>03:11:22</itunes:duration>
+            length=parse_duration(dict.get(entry, "itunes_duration")),
         )
 
 
-@dataclass
+@dataclass(slots=True)
 class Episode:
     id: str
     feed_id: str
@@ -75,7 +57,8 @@ class Episode:
     cover_art_url: str
 
 
-class PlayInfo(BaseModel):
+@dataclass(slots=True)
+class PlayInfo:
     episode: Episode
     previous_listen: Optional[PreviousListen]
 
@@ -85,13 +68,17 @@ class Feed(BaseModel):
     title: str
     url: str
     cover_art_url: str
+    unplayed_count: int = 0
+    in_progress_count: int = 0
+    latest_episode_date: Optional[datetime] = None
 
 
-class PreviousListen(BaseModel):
+@dataclass(slots=True)
+class PreviousListen:
     time_listened: timedelta
     time: datetime
 
     def play_time_string(self) -> str:
         return f"#t={str(self.time_listened)}"
 
-    model_config = ConfigDict(ser_json_timedelta="float")
+    __pydantic_config__ = ConfigDict(ser_json_timedelta="float")
@@ -1,21 +1,69 @@
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass
-from datetime import datetime
-from typing import Optional
+from datetime import date, datetime, timedelta
+from typing import Callable, Iterator, Optional
 from uuid import uuid4
 
+from business.cover_art import CoverArtCache
 from business.entities import User
+from business.events import (
+    NEW_EPISODES,
+    PROGRESS,
+    new_episodes_data,
+    progress_data,
+)
+from business.opml import ImportProgress, export_opml, parse_opml
 from business.podcast import Episode, Feed, PlayInfo
-from business.rss import RssParser
-from persistence.datastore import Datastore
+from business.rss import FeedNotModified, PodcastImport, RssParser
+from business.stats import ListeningStats, ShowTotal, group_by_week
+from persistence.datastore import (
+    Datastore,
+    EpisodeNotFound,
+    SubscriptionAlreadyExists,
+)
 
 logger = logging.getLogger(__name__)
 
+PENDING_COVER_ART_URL = "missing cover art url"
+EPISODES_PER_PAGE = 10
+# cover art that could not be fetched is tried again after this long
+COVER_ART_RETRY_SECONDS = 24 * 60 * 60
+
+
+@dataclass
+class RefreshSummary:
+    processed: int = 0
+    failed: int = 0
+
+
+@dataclass
+class RetentionPolicy:
+    """Which episodes the archive-episodes command moves to episode_archive.
+
+    Only episodes nobody has listened to are archived, and every feed keeps
+    its keep_latest newest episodes however old they are.
+    """
+
+    max_age_days: int = 365
+    keep_latest: int = 20
+
+    def __post_init__(self) -> None:
+        # refreshes only look for episodes newer than the latest one kept
+        if self.keep_latest < 1:
+            raise ValueError("keep_latest must be at least 1")
+
+    def published_before(self, now: datetime) -> datetime:
+        return now - timedelta(days=self.max_age_days)
+
 
 @dataclass
 class PodcastService:
     datastore: Datastore
     rss_parser: RssParser
+    # thumbnails are made on refresh when set
+    cover_art: Optional[CoverArtCache] = None
 
     def find_user_by_email(self, user_email: str) -> User:
         return self.datastore.get_user_by_email(email=user_email)
@@ -32,10 +80,48 @@ class PodcastService:
         chronological: bool = False,
         include_finished: Optional[bool] = False,
     ) -> list[PlayInfo]:
+        self.restore_home_feed(user_id, page, search, chronological)
+        return self.read_user_home_feed(
+            user_id, page, search, chronological, include_finished
+        )
+
+    def home_feed_needs_restore(
+        self,
+        user_id: str,
+        page: int,
+        search: Optional[str] = None,
+        chronological: bool = False,
+    ) -> bool:
+        # searches only look through the hot episodes
+        return not search and self.datastore.archived_subscriptions_needed(
+            user_id, rows=page * EPISODES_PER_PAGE, chronological=chronological
+        )
+
+    def restore_home_feed(
+        self,
+        user_id: str,
+        page: int,
+        search: Optional[str] = None,
+        chronological: bool = False,
+    ) -> None:
+        if not search:
+            self.datastore.restore_archived_subscriptions(
+                user_id, rows=page * EPISODES_PER_PAGE, chronological=chronological
+            )
+
+    def read_user_home_feed(
+        self,
+        user_id: str,
+        page: int,
+        search: Optional[str] = None,
+        chronological: bool = False,
+        include_finished: Optional[bool] = False,
+    ) -> list[PlayInfo]:
+        """The page as it is, without restoring archived episodes."""
         logger.info("fetching home feed")
         return self.datastore.get_user_home_feed(
             user_id=user_id,
-            number_of_episodes=10,
+            number_of_episodes=EPISODES_PER_PAGE,
             page=page,
             search=search,
             include_finished=include_finished,
@@ -45,32 +131,103 @@ class PodcastService:
     def get_single_feed(
         self, user_id: str, page: int, feed_id: str, chronological: bool = False
     ) -> list[PlayInfo]:
+        self.restore_single_feed(feed_id, page, chronological)
+        return self.read_single_feed(user_id, page, feed_id, chronological)
+
+    def single_feed_needs_restore(
+        self, feed_id: str, page: int, chronological: bool = False
+    ) -> bool:
+        return self.datastore.archived_feed_needed(
+            feed_id, rows=page * EPISODES_PER_PAGE, chronological=chronological
+        )
+
+    def restore_single_feed(
+        self, feed_id: str, page: int, chronological: bool = False
+    ) -> None:
+        self.datastore.restore_archived_feed(
+            feed_id, rows=page * EPISODES_PER_PAGE, chronological=chronological
+        )
+
+    def read_single_feed(
+        self, user_id: str, page: int, feed_id: str, chronological: bool = False
+    ) -> list[PlayInfo]:
+        """The page as it is, without restoring archived episodes."""
         return self.datastore.get_single_feed(
             user_id=user_id,
             feed_id=feed_id,
-            number_of_episodes=10,
+            number_of_episodes=EPISODES_PER_PAGE,
             page=page,
             chronological=chronological,
         )
 
     def subscribe_user_to_podcast(self, user_id: str, feed_url: str) -> None:
+        if self.subscribe_to_known_feed(user_id, feed_url):
+            return
         podcast = self.rss_parser.import_feed(feed_url)
-        feed_id = str(uuid4())
-        self.datastore.save_episodes(feed_id=feed_id, episodes=podcast.episode_assets)
-        self.datastore.save_podcast_feed(
-            feed_id=feed_id,
+        self.save_subscription(user_id, feed_url, podcast)
+
+    def subscribe_to_known_feed(self, user_id: str, feed_url: str) -> bool:
+        """Subscribes to the feed saved under feed_url, if there is one,
+        without fetching it, the refresh keeps it up to date."""
+        known_feeds = self.datastore.get_feeds_by_urls([feed_url])
+        if not known_feeds:
+            return False
+        self._subscribe(user_id, known_feeds[0].id)
+        return True
+
+    def save_subscription(
+        self, user_id: str, feed_url: str, podcast: PodcastImport
+    ) -> None:
+        new_feed_id = str(uuid4())
+        feed_id = self.datastore.save_podcast_feed(
+            feed_id=new_feed_id,
             feed_url=feed_url,
             cover_art_url=podcast.cover_art_url,
             title=podcast.title,
         )
-        self.datastore.subscribe(user_id=user_id, feed_id=feed_id)
+        # a concurrent subscription saved the feed and its episodes first
+        if feed_id == new_feed_id:
+            self.datastore.save_episodes(
+                feed_id=feed_id, episodes=podcast.episode_assets
+            )
+            self.datastore.save_feed_etag(feed_id, podcast.etag)
+        self._subscribe(user_id, feed_id)
+
+    def _subscribe(self, user_id: str, feed_id: str) -> None:
+        try:
+            self.datastore.subscribe(user_id=user_id, feed_id=feed_id)
+        except SubscriptionAlreadyExists:
+            # subscribing again, or a concurrent request did it first
+            pass
 
     def get_episode(self, episode_id: str, user_id: str) -> Episode:
-        episode = self.datastore.get_episode(episode_id=episode_id, user_id=user_id)
-        return episode
+        try:
+            return self.read_episode(episode_id, user_id)
+        except EpisodeNotFound:
+            if not self.datastore.restore_archived_episode(episode_id):
+                raise
+        return self.read_episode(episode_id, user_id)
+
+    def episode_needs_restore(self, episode_id: str) -> bool:
+        return self.datastore.is_episode_archived(episode_id)
+
+    def restore_episode(self, episode_id: str) -> None:
+        self.datastore.restore_archived_episode(episode_id)
+
+    def read_episode(self, episode_id: str, user_id: str) -> Episode:
+        """The episode if it is not archived."""
+        return self.datastore.get_episode(episode_id=episode_id, user_id=user_id)
 
     def get_play_information(self, episode_id: str, user_id: str) -> PlayInfo:
-        episode = self.datastore.get_episode(episode_id=episode_id, user_id=user_id)
+        episode = self.get_episode(episode_id=episode_id, user_id=user_id)
+        previous_listen = self.datastore.get_previous_listen(
+            user_id=user_id, episode_id=episode_id
+        )
+        return PlayInfo(episode=episode, previous_listen=previous_listen)
+
+    def read_play_information(self, episode_id: str, user_id: str) -> PlayInfo:
+        """The play information if the episode is not archived."""
+        episode = self.read_episode(episode_id, user_id)
         previous_listen = self.datastore.get_previous_listen(
             user_id=user_id, episode_id=episode_id
         )
@@ -82,42 +239,202 @@ class PodcastService:
         self.datastore.set_current_time(
             episode_id=episode_id, user_id=user_id, seconds=seconds, time=datetime.now()
         )
+        # for the user's other devices
+        self.datastore.publish_user_event(
+            user_id, PROGRESS, progress_data(episode_id, seconds)
+        )
 
-    def update_user_feeds(self, user_id: str) -> None:
+    def update_user_feeds(self, user_id: str) -> RefreshSummary:
         feeds = self.datastore.get_user_subscribed_feeds(user_id)
-        self._update_feeds(feeds)
+        return self._update_feeds(feeds)
 
-    def _update_feeds(self, feeds: list[Feed]) -> None:
+    def _update_feeds(self, feeds: list[Feed]) -> RefreshSummary:
+        """One broken feed must not stop the others from refreshing."""
+        summary = RefreshSummary()
         for feed in feeds:
-            podcast = self.rss_parser.import_feed(feed_url=feed.url)
+            try:
+                podcast = self.rss_parser.import_feed(
+                    feed_url=feed.url, etag=self.datastore.get_feed_etag(feed.id)
+                )
+                self.reconcile_feed(feed, podcast)
+                summary.processed += 1
+            except FeedNotModified:
+                summary.processed += 1
+            except Exception:
+                logger.exception(f"refresh of {feed.url} failed")
+                summary.failed += 1
+        return summary
+
+    def reconcile_feed(self, feed: Feed, podcast: PodcastImport) -> None:
+        try:
             feed_latest_episode = self.datastore.get_latest_episode(feed_id=feed.id)
             new_episode_assets = [
                 episode
                 for episode in podcast.episode_assets
                 if episode.published_date > feed_latest_episode.assets.published_date
             ]
-            self.datastore.save_episodes(feed_id=feed.id, episodes=new_episode_assets)
-
-            self.datastore.update_links(podcast.episode_assets, feed.id)
-            self.datastore.update_lengths(podcast.episode_assets, feed.id)
-
-            if (
-                feed.cover_art_url != podcast.cover_art_url
-                or feed.title != podcast.title
-            ):
-                self.datastore.update_podcast_feed(
-                    title=podcast.title,
-                    cover_art_url=podcast.cover_art_url,
-                    feed_url=feed.url,
-                    feed_id=feed.id,
-                )
+        except EpisodeNotFound:
+            new_episode_assets = podcast.episode_assets
+        self.datastore.save_episodes(feed_id=feed.id, episodes=new_episode_assets)
+        if new_episode_assets:
+            self.datastore.publish_feed_event(
+                feed.id,
+                NEW_EPISODES,
+                new_episodes_data(feed.id, len(new_episode_assets)),
+            )
+
+        self.datastore.update_links(podcast.episode_assets, feed.id)
+        self.datastore.update_lengths(podcast.episode_assets, feed.id)
+        # only a download tells which version the server has, a reparse of
+        # the archive keeps the ETag of the last one
+        if podcast.download is not None:
+            self.datastore.save_feed_etag(feed.id, podcast.etag)
 
-    def update_all_feeds(self) -> None:
+        if feed.cover_art_url != podcast.cover_art_url or feed.title != podcast.title:
+            self.datastore.update_podcast_feed(
+                title=podcast.title,
+                cover_art_url=podcast.cover_art_url,
+                feed_url=feed.url,
+                feed_id=feed.id,
+            )
+        self.cache_cover_art(podcast.cover_art_url)
+
+    def cache_cover_art(self, url: str) -> None:
+        """Makes thumbnails of cover art not seen before.
+
+        Fetching is the refresh's side job, a failure is recorded and
+        retried after COVER_ART_RETRY_SECONDS without failing the refresh.
+        """
+        if self.cover_art is None or not url.startswith(("http://", "https://")):
+            return
+        now = time.time()
+        if not self.datastore.cover_art_is_due(
+            url, retry_before=now - COVER_ART_RETRY_SECONDS
+        ):
+            return
+        try:
+            digest: Optional[str] = self.cover_art.fetch(url)
+        except Exception:
+            logger.exception(f"could not make thumbnails of {url}")
+            digest = None
+        self.datastore.save_cover_art(url, digest, now)
+
+    def update_all_feeds(self) -> RefreshSummary:
         feeds = self.datastore.get_all_feeds()
-        self._update_feeds(feeds)
+        return self._update_feeds(feeds)
+
+    def refresh_all_feeds_exclusively(
+        self,
+        job_id: str,
+        holder: str,
+        lease_seconds: float,
+        lag_seconds: Optional[float] = None,
+    ) -> Optional[RefreshSummary]:
+        """Refreshes every feed unless another process holds the job's lease.
+
+        The lease outlives a crashed holder by at most lease_seconds. The
+        outcome is saved for processes that did not run the cycle to report.
+        """
+        if not self.datastore.acquire_lease(job_id, holder, lease_seconds):
+            logger.info(f"skipping {job_id}, another process holds the lease")
+            self.datastore.count_skipped_refresh(job_id)
+            return None
+        try:
+            started_at = time.time()
+            summary = self.update_all_feeds()
+            self.datastore.save_refresh_run(
+                job_id=job_id,
+                holder=holder,
+                started_at=started_at,
+                finished_at=time.time(),
+                processed=summary.processed,
+                failed=summary.failed,
+                lag_seconds=lag_seconds,
+            )
+            return summary
+        finally:
+            self.datastore.release_lease(job_id, holder)
 
     def get_latest_listen_play_info(self, user_id: str) -> Optional[PlayInfo]:
         return self.datastore.get_latest_listen_play_info(user_id)
 
+    def get_continue_listening(self, user_id: str, limit: int) -> list[PlayInfo]:
+        return self.datastore.get_in_progress_play_infos(user_id=user_id, limit=limit)
+
+    def get_listening_stats(self, user_id: str, weeks: int) -> ListeningStats:
+        since = date.today() - timedelta(weeks=weeks - 1)
+        since -= timedelta(days=since.weekday())
+        days = self.datastore.get_listening_by_day(user_id=user_id, since=since)
+        shows = [
+            ShowTotal(feed_id=feed_id, title=title, seconds=seconds)
+            for feed_id, title, seconds in self.datastore.get_listening_by_feed(
+                user_id=user_id, since=since
+            )
+        ]
+        return ListeningStats(
+            since=since,
+            total_seconds=sum(seconds for _, seconds in days),
+            weeks=group_by_week(days, since),
+            shows=shows,
+        )
+
     def get_user_subscribed_feeds(self, user_id: str) -> list[Feed]:
         return self.datastore.get_user_subscribed_feeds(user_id)
+
+    def import_opml(self, user_id: str, document: bytes) -> list[Feed]:
+        """Subscribes the user to every feed of an OPML document.
+
+        Feeds already known by url are reused, the others are created with
+        placeholder metadata and returned so they can be fetched afterwards.
+        """
+        outlines = parse_opml(document)
+        known_feeds = self.datastore.get_feeds_by_urls(
+            [outline.feed_url for outline in outlines]
+        )
+        known_urls = {feed.url for feed in known_feeds}
+        new_feeds = [
+            Feed(
+                id=str(uuid4()),
+                url=outline.feed_url,
+                title=outline.title or outline.feed_url,
+                cover_art_url=PENDING_COVER_ART_URL,
+            )
+            for outline in outlines
+            if outline.feed_url not in known_urls
+        ]
+        return self.datastore.subscribe_to_feeds(
+            user_id=user_id,
+            existing_feed_ids=[feed.id for feed in known_feeds],
+            new_feeds=new_feeds,
+        )
+
+    def fetch_new_feeds(
+        self,
+        feeds: list[Feed],
+        progress: ImportProgress,
+        on_progress: Optional[Callable[[ImportProgress], None]] = None,
+        max_workers: int = 8,
+    ) -> None:
+        """Downloads and parses feeds concurrently, saving each as it completes.
+
+        Only the network and parsing work is spread across threads, every
+        write happens on the calling thread's connection.
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {
+                pool.submit(self.rss_parser.import_feed, feed.url): feed
+                for feed in feeds
+            }
+            for future in as_completed(futures):
+                feed = futures[future]
+                try:
+                    self.reconcile_feed(feed, future.result())
+                    progress.fetched += 1
+                except Exception:
+                    logger.exception(f"first fetch of {feed.url} failed")
+                    progress.failed += 1
+                if on_progress is not None:
+                    on_progress(progress)
+
+    def export_opml(self, user_id: str) -> Iterator[str]:
+        return export_opml(self.datastore.get_user_subscribed_feeds(user_id))
@@ -1,52 +1,262 @@
 import logging
+import time
 from abc import abstractmethod
-from dataclasses import dataclass
-from typing import Protocol
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import TYPE_CHECKING, Optional, Protocol
 
-import feedparser
+from business.podcast import EpisodeAssets, InvalidEntry
 
-from business.podcast import EpisodeAssets, NoAudio
+# requests and feedparser are imported where they are used, so that only the
+# processes fetching feeds pay for loading them
+if TYPE_CHECKING:
+    import requests
 
 logger = logging.getLogger(__name__)
 
+# pods are capped at 512Mi, a single feed must never come close to that
+DEFAULT_MAX_FEED_BYTES = 32 * 1024 * 1024
+USER_AGENT = "podcasticot/0.1 (+https://podcast.simisticot.com)"
+# with debug logging on, only one successfully loaded entry in this many is logged
+DEBUG_ENTRY_SAMPLE_RATE = 100
+
+
+class FeedFetchError(Exception): ...
+
+
+class FeedTooLarge(FeedFetchError): ...
+
+
+class FeedNotModified(Exception):
+    """The feed still has the ETag it was last imported with."""
+
+
+@dataclass
+class DownloadStats:
+    seconds: float
+    size: int
+
 
 @dataclass
 class PodcastImport:
     title: str
     cover_art_url: str
     episode_assets: list[EpisodeAssets]
+    download: Optional[DownloadStats] = None
+    etag: Optional[str] = None
+
+
+@dataclass
+class FetchedFeed:
+    url: str
+    body: bytes
+    content_type: Optional[str]
+    stats: DownloadStats
+    etag: Optional[str] = None
+
+
+@dataclass
+class FeedFetcher:
+    """Downloads feed documents over a pooled keep-alive session.
+
+    The size cap is enforced on the decoded body while streaming, so neither a
+    huge document nor a compression bomb is ever fully held in memory. Given
+    the ETag of the last import, the request is conditional and an unchanged
+    feed raises FeedNotModified without sending a body.
+    """
+
+    connect_timeout: float = 5.0
+    read_timeout: float = 30.0
+    max_seconds: float = 120.0
+    max_bytes: int = DEFAULT_MAX_FEED_BYTES
+    pool_size: int = 10
+    chunk_size: int = 64 * 1024
+    session: "requests.Session" = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.request import ACCEPT_ENCODING
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_size, pool_maxsize=self.pool_size
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # urllib3 only advertises br when a brotli decoder is installed
+        self.session.headers.update(
+            {"User-Agent": USER_AGENT, "Accept-Encoding": ACCEPT_ENCODING}
+        )
+
+    def fetch(self, feed_url: str, etag: Optional[str] = None) -> FetchedFeed:
+        import requests
+
+        start = time.perf_counter()
+        chunks: list[bytes] = []
+        size = 0
+        headers = {"If-None-Match": etag} if etag is not None else None
+        try:
+            with self.session.get(
+                feed_url,
+                headers=headers,
+                timeout=(self.connect_timeout, self.read_timeout),
+                stream=True,
+            ) as response:
+                if response.status_code == 304:
+                    raise FeedNotModified(feed_url)
+                response.raise_for_status()
+                # with a Content-Encoding the length is the encoded size,
+                # only the streamed, decoded size can be held to max_bytes
+                declared_size = response.headers.get("Content-Length", "")
+                if (
+                    "Content-Encoding" not in response.headers
+                    and declared_size.isdigit()
+                    and int(declared_size) > self.max_bytes
+                ):
+                    raise FeedTooLarge(
+                        f"{feed_url} announces {declared_size} bytes, limit is {self.max_bytes}"
+                    )
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise FeedTooLarge(
+                            f"{feed_url} exceeded {self.max_bytes} bytes"
+                        )
+                    if time.perf_counter() - start > self.max_seconds:
+                        raise FeedFetchError(
+                            f"{feed_url} took more than {self.max_seconds}s to download"
+                        )
+                    chunks.append(chunk)
+                final_url = response.url
+                content_type = response.headers.get("Content-Type")
+                response_etag = response.headers.get("ETag")
+        except requests.RequestException as error:
+            raise FeedFetchError(f"could not download {feed_url}: {error}") from error
+
+        stats = DownloadStats(seconds=time.perf_counter() - start, size=size)
+        logger.debug(
+            "downloaded %s (%d bytes in %.3fs)", feed_url, stats.size, stats.seconds
+        )
+        return FetchedFeed(
+            url=final_url,
+            body=b"".join(chunks),
+            content_type=content_type,
+            stats=stats,
+            etag=response_etag,
+        )
+
+
+@lru_cache
+def shared_fetcher() -> FeedFetcher:
+    return FeedFetcher()
+
+
+def parse_feed(fetched: FetchedFeed) -> PodcastImport:
+    import feedparser
+
+    start = time.perf_counter()
+    response_headers = {"content-location": fetched.url}
+    if fetched.content_type is not None:
+        response_headers["content-type"] = fetched.content_type
+    feed = feedparser.parse(fetched.body, response_headers=response_headers)
+    parse_seconds = time.perf_counter() - start
+
+    assets: list[EpisodeAssets] = []
+    entries = feed["entries"]
+    skipped = 0
+    # checked once, a feed can have thousands of entries
+    debug = logger.isEnabledFor(logging.DEBUG)
+    for i, entry in enumerate(entries):
+        try:
+            assets.append(EpisodeAssets.from_feed_entry(entry))
+        except InvalidEntry as error:
+            skipped += 1
+            if debug:
+                logger.debug(
+                    "skipped entry %d of %s: %s", i, fetched.url, type(error).__name__
+                )
+            continue
+        if debug and i % DEBUG_ENTRY_SAMPLE_RATE == 0:
+            logger.debug("loaded entry %d out of %d", i, len(entries))
+    normalize_seconds = time.perf_counter() - start - parse_seconds
+
+    logger.info(
+        "imported %s: %d episodes, %d skipped, %d bytes downloaded in %.3fs, parsed in %.3fs, normalized in %.3fs",
+        fetched.url,
+        len(assets),
+        skipped,
+        fetched.stats.size,
+        fetched.stats.seconds,
+        parse_seconds,
+        normalize_seconds,
+        extra={
+            "feed_url": fetched.url,
+            "episodes": len(assets),
+            "skipped_entries": skipped,
+            "download_bytes": fetched.stats.size,
+            "download_seconds": fetched.stats.seconds,
+            "parse_seconds": parse_seconds,
+            "normalize_seconds": normalize_seconds,
+        },
+    )
+    return PodcastImport(
+        title=feed.feed.title or "missing podcast title",  # type: ignore
+        cover_art_url=feed.feed.image["href"] or "missing cover art url",  # type: ignore
+        episode_assets=assets,
+    )
 
 
 class RssParser(Protocol):
     @abstractmethod
-    def import_feed(self, feed_url: str) -> PodcastImport: ...
+    def import_feed(
+        self, feed_url: str, etag: Optional[str] = None
+    ) -> PodcastImport: ...
 
 
+class RawFeedStore(Protocol):
+    def put(self, feed_url: str, fetched: FetchedFeed) -> str: ...
+
+    def get(self, feed_url: str) -> Optional[FetchedFeed]: ...
+
+
+@dataclass
 class FeedParserRssParser(RssParser):
-    def import_feed(self, feed_url: str) -> PodcastImport:
-        feed = feedparser.parse(feed_url)
-        assets: list[EpisodeAssets] = []
-        number_of_eps = len(feed["entries"])
-        logger.info("started feed import")
-        for i, entry in enumerate(feed["entries"]):
+    fetcher: FeedFetcher = field(default_factory=shared_fetcher)
+    archive: Optional[RawFeedStore] = None
+
+    def import_feed(self, feed_url: str, etag: Optional[str] = None) -> PodcastImport:
+        fetched = self.fetcher.fetch(feed_url, etag=etag)
+        if self.archive is not None:
             try:
-                assets.append(EpisodeAssets.from_feed_entry(entry))
-            except NoAudio:
-                continue
-            logger.info(f"finished loading episode {i} out of {number_of_eps}")
-
-        return PodcastImport(
-            title=feed.feed.title or "missing podcast title",  # type: ignore
-            cover_art_url=feed.feed.image["href"] or "missing cover art url",  # type: ignore
-            episode_assets=assets,
-        )
+                self.archive.put(feed_url, fetched)
+            except Exception:
+                # the archive is a convenience, a full disk must not break refreshes
+                logger.exception(f"could not archive {feed_url}")
+        podcast = parse_feed(fetched)
+        podcast.download = fetched.stats
+        podcast.etag = fetched.etag
+        return podcast
+
+
+@dataclass
+class ArchivedRssParser(RssParser):
+    """Parses the archived body of a feed instead of downloading it."""
+
+    archive: RawFeedStore
+
+    def import_feed(self, feed_url: str, etag: Optional[str] = None) -> PodcastImport:
+        fetched = self.archive.get(feed_url)
+        if fetched is None:
+            raise FeedFetchError(f"{feed_url} is not in the archive")
+        return parse_feed(fetched)
 
 
 @dataclass
 class FakeRssParser(RssParser):
     imports: dict[str, PodcastImport]
 
-    def import_feed(self, feed_url: str) -> PodcastImport:
+    def import_feed(self, feed_url: str, etag: Optional[str] = None) -> PodcastImport:
         podcast_import = self.imports.get(feed_url)
         if podcast_import is None:
             raise RuntimeError("No assets for this url")
@@ -0,0 +1,40 @@
+from datetime import date, timedelta
+
+from pydantic import BaseModel
+
+
+class WeekTotal(BaseModel):
+    week_start: date
+    seconds: int
+
+
+class ShowTotal(BaseModel):
+    feed_id: str
+    title: str
+    seconds: int
+
+
+class ListeningStats(BaseModel):
+    since: date
+    total_seconds: int
+    weeks: list[WeekTotal]
+    shows: list[ShowTotal]
+
+
+def week_start(day: date) -> date:
+    return day - timedelta(days=day.weekday())
+
+
+def group_by_week(days: list[tuple[date, int]], since: date) -> list[WeekTotal]:
+    """Weekly totals from the first week of since onwards, including empty weeks."""
+    totals: dict[date, int] = {}
+    week = week_start(since)
+    today = date.today()
+    while week <= today:
+        totals[week] = 0
+        week += timedelta(weeks=1)
+    for day, seconds in days:
+        totals[week_start(day)] = totals.get(week_start(day), 0) + seconds
+    return [
+        WeekTotal(week_start=week, seconds=seconds) for week, seconds in totals.items()
+    ]
@@ -1,10 +1,93 @@
 import argparse
-import sqlite3
+import os
+from pathlib import Path
+from typing import Optional
 
-import uvicorn
+from persistence.connection import DATABASE_PATH, connect
+
+# commands import what they need when they run, so that e.g. migrate does not
+# load the web stack or the feed parser
+
+
+def reparse_archive(archive_dir: Path, workers: Optional[int]) -> None:
+    from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+
+    from business.podcast import Feed
+    from business.podcast_service import PodcastService
+    from business.rss import ArchivedRssParser, PodcastImport, parse_feed
+    from persistence.datastore import Datastore
+    from persistence.feed_archive import FeedArchive
+
+    archive = FeedArchive(archive_dir)
+    connection = connect()
+    service = PodcastService(
+        datastore=Datastore(connection=connection),
+        rss_parser=ArchivedRssParser(archive=archive),
+    )
+    feeds = service.datastore.get_all_feeds()
+    workers = workers or os.cpu_count() or 1
+    reparsed, missing, failed = 0, 0, 0
+    pending: dict[Future[PodcastImport], Feed] = {}
+
+    def reconcile_finished(finished: set[Future[PodcastImport]]) -> None:
+        nonlocal reparsed, failed
+        for future in finished:
+            feed = pending.pop(future)
+            try:
+                service.reconcile_feed(feed, future.result())
+                reparsed += 1
+            except Exception as error:
+                failed += 1
+                print(f"could not reparse {feed.url}: {error}")
+
+    # parsing is CPU bound so it goes to worker processes, while writes stay
+    # on this process' single connection. Only a bounded number of bodies
+    # are in flight to keep memory flat.
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for feed in feeds:
+            fetched = archive.get(feed.url)
+            if fetched is None:
+                missing += 1
+                continue
+            pending[pool.submit(parse_feed, fetched)] = feed
+            if len(pending) >= workers * 2:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                reconcile_finished(finished)
+        reconcile_finished(set(pending))
+
+    connection.close()
+    archive.close()
+    print(
+        f"Reparsed {reparsed} feeds from the archive, {missing} not archived, {failed} failed"
+    )
+
+
+def import_opml(opml_path: Path, user_email: str) -> None:
+    from business.opml import ImportProgress
+    from business.podcast_service import PodcastService
+    from business.rss import FeedParserRssParser
+    from persistence.datastore import Datastore, UnknownUser
+
+    connection = connect(check_same_thread=False)
+    service = PodcastService(
+        datastore=Datastore(connection=connection), rss_parser=FeedParserRssParser()
+    )
+    try:
+        user = service.find_user_by_email(user_email)
+    except UnknownUser:
+        user = service.save_user(user_email)
+    new_feeds = service.import_opml(user.id, opml_path.read_bytes())
+    progress = ImportProgress(user_id=user.id, total=len(new_feeds))
+    print(f"Subscribed {user_email}, fetching {progress.total} new feeds")
+
+    def report(progress: ImportProgress) -> None:
+        print(
+            f"{progress.fetched + progress.failed}/{progress.total} fetched, {progress.failed} failed"
+        )
+
+    service.fetch_new_feeds(new_feeds, progress, on_progress=report)
+    connection.close()
 
-from endpoints import refresh_all_feeds, scheduler
-from persistence.migration import migrate
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -15,18 +98,168 @@ if __name__ == "__main__":
     parser.add_argument("--reload", action="store_true")
     parser.add_argument("--host", default="127.0.0.1")
     parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--archive-dir", default="./db/feed_archive")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="worker processes, for serve see services.api_workers",
+    )
+    parser.add_argument(
+        "--no-refresh",
+        action="store_true",
+        help="serve without starting a refresher, e.g. when one runs elsewhere",
+    )
+    parser.add_argument("--older-than-days", type=int, default=365)
+    parser.add_argument("--keep-latest", type=int, default=20)
+    parser.add_argument(
+        "--vacuum",
+        action="store_true",
+        help="after archiving, give the space freed in the database file back",
+    )
+    parser.add_argument("--backup-dir", default="./db/backups")
+    parser.add_argument("--keep", type=int, default=7, help="backups to keep")
+    parser.add_argument("--file")
+    parser.add_argument("--email")
     args = parser.parse_args()
 
     match args.command:
         case "serve":
-            scheduler.add_job(func=refresh_all_feeds, trigger="interval", minutes=10)
-            uvicorn.run(
-                "endpoints:app", host=args.host, port=args.port, reload=args.reload
-            )
+            import multiprocessing
+
+            import uvicorn
+
+            from refresher import run_refresher
+            from services import API_WORKERS_VARIABLE
+
+            # inherited by the workers uvicorn starts
+            os.environ[API_WORKERS_VARIABLE] = str(args.workers or 1)
+            refresher = None
+            if not args.no_refresh:
+                # spawned so it doesn't inherit the state of this process
+                refresher = multiprocessing.get_context("spawn").Process(
+                    target=run_refresher, name="refresher", daemon=True
+                )
+                refresher.start()
+            try:
+                uvicorn.run(
+                    "endpoints:app",
+                    host=args.host,
+                    port=args.port,
+                    reload=args.reload,
+                    workers=args.workers,
+                )
+            finally:
+                if refresher is not None:
+                    refresher.terminate()
+                    refresher.join()
+        case "refresh":
+            from refresher import run_refresher
+
+            run_refresher()
         case "migrate":
-            connection = sqlite3.connect("./db/poddb.db")
+            from persistence.migration import migrate
+
+            connection = connect()
             migrate(connection)
             connection.close()
             print("Applied migrations")
+        case "schema":
+            from persistence.migration import SCHEMA_PATH, build_schema_snapshot
+
+            SCHEMA_PATH.write_text(build_schema_snapshot())
+            print(f"Wrote {SCHEMA_PATH}")
+        case "check-schema":
+            from persistence.migration import SCHEMA_PATH, schema_snapshot_is_current
+
+            if not schema_snapshot_is_current():
+                print(f"{SCHEMA_PATH} is out of date, run `cli.py schema`")
+                raise SystemExit(1)
+            print(f"{SCHEMA_PATH} matches the migrations")
+        case "reparse":
+            reparse_archive(Path(args.archive_dir), args.workers)
+        case "rebuild-timeline":
+            from persistence.datastore import Datastore
+
+            connection = connect()
+            rows = Datastore(connection=connection).rebuild_timeline()
+            connection.close()
+            print(f"Rebuilt timeline with {rows} rows")
+        case "check-timeline":
+            from persistence.datastore import Datastore
+
+            connection = connect()
+            report = Datastore(connection=connection).check_timeline()
+            connection.close()
+            print(
+                f"{report.missing} missing and {report.unexpected} unexpected timeline rows"
+            )
+            if not report.consistent:
+                raise SystemExit(1)
+        case "recount-subscriptions":
+            from persistence.datastore import Datastore
+
+            connection = connect()
+            Datastore(connection=connection).recount_subscriptions()
+            connection.close()
+            print("Recounted unplayed and in progress episodes")
+        case "backfill-stats":
+            from persistence.datastore import Datastore
+
+            connection = connect()
+            rows = Datastore(connection=connection).backfill_listening_stats()
+            connection.close()
+            print(f"Backfilled {rows} daily listening rollups")
+        case "archive-episodes":
+            from datetime import datetime
+
+            from business.podcast_service import RetentionPolicy
+            from persistence.datastore import Datastore
+
+            policy = RetentionPolicy(
+                max_age_days=args.older_than_days, keep_latest=args.keep_latest
+            )
+            connection = connect()
+            datastore = Datastore(connection=connection)
+            report = datastore.archive_episodes(
+                published_before=policy.published_before(datetime.now()),
+                keep_latest=policy.keep_latest,
+            )
+            print(f"Archived {report.archived} episodes")
+            if (
+                report.hot_bytes_before is not None
+                and report.hot_bytes_after is not None
+            ):
+                print(
+                    f"Episode and timeline tables went from {report.hot_bytes_before / 1e6:.1f}MB to {report.hot_bytes_after / 1e6:.1f}MB, {(report.hot_bytes_before - report.hot_bytes_after) / 1e6:.1f}MB reclaimed"
+                )
+            if args.vacuum:
+                size_before = os.path.getsize(DATABASE_PATH)
+                connection.execute("vacuum;")
+                size_after = os.path.getsize(DATABASE_PATH)
+                print(
+                    f"Vacuumed the database from {size_before / 1e6:.1f}MB to {size_after / 1e6:.1f}MB"
+                )
+            connection.close()
+        case "backup":
+            from datetime import datetime
+
+            from persistence.backup import backup_database
+
+            connection = connect()
+            report = backup_database(
+                connection,
+                Path(args.backup_dir),
+                now=datetime.now(),
+                keep=args.keep,
+            )
+            connection.close()
+            print(
+                f"Wrote {report.path} ({report.compressed_bytes / 1e6:.1f}MB from {report.database_bytes / 1e6:.1f}MB) in {report.seconds:.1f}s, {report.megabytes_per_second:.1f}MB/s"
+            )
+        case "import-opml":
+            if args.file is None or args.email is None:
+                parser.error("import-opml needs --file and --email")
+            import_opml(Path(args.file), args.email)
         case _:
             parser.print_help()
@@ -1,56 +1,142 @@
-import logging
-import sqlite3
+import os
+import re
+import time
 from contextlib import asynccontextmanager
+from datetime import datetime
 from functools import lru_cache
-from typing import AsyncGenerator
-
-import jwt
-from apscheduler.schedulers.background import BackgroundScheduler
-from fastapi import Depends, FastAPI, HTTPException, status
+from typing import TYPE_CHECKING, AsyncGenerator, AsyncIterator, Callable, Optional
+
+from anyio import to_thread
+from fastapi import (
+    BackgroundTasks,
+    Depends,
+    FastAPI,
+    Header,
+    HTTPException,
+    Query,
+    UploadFile,
+    status,
+)
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import (
+    FileResponse,
+    PlainTextResponse,
+    RedirectResponse,
+    StreamingResponse,
+)
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-from jwt.jwks_client import PyJWKClient
 from pydantic import BaseModel
-from pydantic_settings import BaseSettings, SettingsConfigDict
 
+from admission import Admission, RateLimit, RequestShed
+from business.async_podcast_service import AsyncPodcastService, Reader
+from business.cover_art import FORMATS, MEDIA_TYPES, THUMBNAIL_SIZES
 from business.entities import User
+from business.events import EVENT_TOKEN_SECONDS, sign_event_token, verify_event_token
+from business.opml import MAX_OPML_BYTES, ImportProgress, InvalidOpml
 from business.podcast import Feed, PlayInfo
 from business.podcast_service import PodcastService
-from business.rss import FeedParserRssParser
-from persistence.datastore import Datastore, EpisodeNotFound, UnknownUser
-
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
+from business.stats import ListeningStats
+from compression import CompressionMiddleware
+from observability.metrics import REGISTRY
+from observability.middleware import MetricsMiddleware, TimedJSONResponse
+from observability.profiling import (
+    Profile,
+    ProfileStore,
+    ProfileSummary,
+    ProfilingMiddleware,
+    profile_worker,
+    sign_profile_token,
+)
+from observability.queries import QueryLogSettings, QueryPlan
+from observability.timing import TimedConnection, phase
+from persistence.connection import connect
+from persistence.cover_art import CoverArtStore
+from persistence.database_thread import DatabaseThread
+from persistence.datastore import (
+    CoverArtNotFound,
+    Datastore,
+    EpisodeNotFound,
+    RefreshStatus,
+    UnknownUser,
+)
+from refresher import REFRESH_JOB_ID
+from services import (
+    SQLITE_CONNECTIONS_OPEN,
+    SQLITE_CONNECTIONS_OPENED,
+    Settings,
+    api_workers,
+    cover_art_store,
+    get_settings,
+    open_podcast_service,
+    query_instrumentation,
+    rss_parser,
 )
 
+if TYPE_CHECKING:
+    from jwt import PyJWKClient
+
+# how long EventSource waits before reconnecting a dropped stream
+EVENT_RETRY_MILLISECONDS = 5000
+# a thumbnail url names the content of the original, it never changes
+THUMBNAIL_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# the feed may move to new cover art
+COVER_ART_REDIRECT_CACHE_CONTROL = "public, max-age=3600"
+DIGEST_PATTERN = re.compile(r"[0-9a-f]{64}")
+# connections serving reads next to the one writing, per API process
+READ_CONNECTIONS = 4
+
+
+def threaded_podcast_service(name: str) -> Reader:
+    """A PodcastService on a connection used only from its database thread."""
+    connection = connect(check_same_thread=False, factory=TimedConnection)
+    SQLITE_CONNECTIONS_OPENED.inc()
+    SQLITE_CONNECTIONS_OPEN.inc()
+    return Reader(
+        service=PodcastService(
+            datastore=Datastore(
+                connection=connection, query_hook=query_instrumentation
+            ),
+            rss_parser=rss_parser(),
+        ),
+        database=DatabaseThread(connection, name=name),
+    )
 
-class Settings(BaseSettings):
-    auth0_domain: str
-    auth0_audience: str
-    auth0_issuer: str
-    auth0_algorithms: str
 
-    model_config = SettingsConfigDict(env_file=".env", frozen=True, extra="ignore")
+@lru_cache
+def shared_podcast_service() -> AsyncPodcastService:
+    """The API's writer connection and its READ_CONNECTIONS readers."""
+    writer = threaded_podcast_service("database")
+    return AsyncPodcastService(
+        service=writer.service,
+        database=writer.database,
+        readers=[
+            threaded_podcast_service(f"database-reader-{number}")
+            for number in range(READ_CONNECTIONS)
+        ],
+    )
 
 
-def podcast_service() -> PodcastService:
-    connection = sqlite3.connect("./db/poddb.db", check_same_thread=False)
-    return PodcastService(
-        datastore=Datastore(connection=connection), rss_parser=FeedParserRssParser()
-    )
+def close_shared_podcast_service() -> None:
+    if shared_podcast_service.cache_info().currsize:
+        service = shared_podcast_service()
+        service.events.close()
+        for database in [service.database, *(r.database for r in service.readers)]:
+            database.close()
+            SQLITE_CONNECTIONS_OPEN.dec()
+        shared_podcast_service.cache_clear()
 
 
-@lru_cache
-def get_settings() -> Settings:
-    return Settings()
+async def podcast_service() -> AsyncPodcastService:
+    return shared_podcast_service()
 
 
 @lru_cache
-def get_jwks_client(settings=Depends(get_settings)) -> PyJWKClient:
+def get_jwks_client(settings=Depends(get_settings)) -> "PyJWKClient":
+    # PyJWT and cryptography are only loaded once a request needs them
+    from jwt import PyJWKClient
+
     jwks_url = f"https://{settings.auth0_domain}/.well-known/jwks.json"
-    return jwt.PyJWKClient(jwks_url)
+    return PyJWKClient(jwks_url)
 
 
 class UnauthorizedException(HTTPException):
@@ -58,21 +144,47 @@ class UnauthorizedException(HTTPException):
         super().__init__(status.HTTP_401_UNAUTHORIZED, detail=detail)
 
 
-def refresh_all_feeds() -> None:
-    podcast_service().update_all_feeds()
+REFRESH_DURATION = REGISTRY.gauge(
+    "refresh_last_duration_seconds", "Duration of the last feed refresh cycle."
+)
+REFRESH_PROCESSED = REGISTRY.gauge(
+    "refresh_last_processed_feeds", "Feeds refreshed by the last cycle."
+)
+REFRESH_FAILED = REGISTRY.gauge(
+    "refresh_last_failed_feeds", "Feeds that failed to refresh in the last cycle."
+)
+REFRESH_COMPLETED = REGISTRY.gauge(
+    "refresh_last_completed_timestamp_seconds",
+    "Unix time at which the last refresh cycle finished.",
+)
+REFRESH_LAG = REGISTRY.gauge(
+    "refresh_schedule_lag_seconds",
+    "How late the last refresh cycle started compared to its schedule.",
+)
+REFRESH_SKIPPED = REGISTRY.counter(
+    "refresh_skipped_total",
+    "Scheduled refresh cycles skipped because they were missed, the previous one was still running or another process held the lease.",
+)
 
 
-scheduler = BackgroundScheduler()
+def record_refresh_status(status: RefreshStatus) -> None:
+    if status.started_at is not None and status.finished_at is not None:
+        REFRESH_DURATION.set(status.finished_at - status.started_at)
+        REFRESH_COMPLETED.set(status.finished_at)
+    REFRESH_PROCESSED.set(status.processed)
+    REFRESH_FAILED.set(status.failed)
+    if status.lag_seconds is not None:
+        REFRESH_LAG.set(status.lag_seconds)
+    REFRESH_SKIPPED.set_total(status.skipped)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI) -> AsyncGenerator[None, FastAPI]:
-    scheduler.start()
     yield
-    scheduler.shutdown()
+    close_shared_podcast_service()
 
 
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=TimedJSONResponse)
 origins = ["http://localhost:5173", "https://podcast.simisticot.com"]
 
 app.add_middleware(
@@ -82,112 +194,219 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware)
+
+
+def profiling_secret() -> Optional[str]:
+    return get_settings().profiling_secret
+
+
+profiles = ProfileStore()
+app.add_middleware(ProfilingMiddleware, secret=profiling_secret, store=profiles)
+app.add_middleware(MetricsMiddleware)
 
 token_auth = HTTPBearer(auto_error=False)
 
 
 def authenticated_user_email(
     creds: HTTPAuthorizationCredentials | None = Depends(token_auth),
-    jwks_client: PyJWKClient = Depends(get_jwks_client),
+    # left unannotated, FastAPI would import PyJWT to inspect the type
+    jwks_client=Depends(get_jwks_client),
     settings: Settings = Depends(get_settings),
 ) -> str:
     if creds is None:
         raise UnauthorizedException(detail="Missing auth header")
     assert isinstance(creds.credentials, str)
-    signing_key = jwks_client.get_signing_key_from_jwt(creds.credentials).key
-    try:
-        payload = jwt.decode(
-            creds.credentials,
-            signing_key,
-            algorithms=[settings.auth0_algorithms],
-            audience=settings.auth0_audience,
-            issuer=settings.auth0_issuer,
-        )
-    except Exception as error:
-        raise UnauthorizedException(detail=str(error))
+    import jwt
+
+    with phase("auth"):
+        signing_key = jwks_client.get_signing_key_from_jwt(creds.credentials).key
+        try:
+            payload = jwt.decode(
+                creds.credentials,
+                signing_key,
+                algorithms=[settings.auth0_algorithms],
+                audience=settings.auth0_audience,
+                issuer=settings.auth0_issuer,
+            )
+        except Exception as error:
+            raise UnauthorizedException(detail=str(error))
 
     return payload["podcasticot/email"]
 
 
-def authenticated_user(
+async def authenticated_user(
     user_email: str = Depends(authenticated_user_email),
-    service: PodcastService = Depends(podcast_service),
+    service: AsyncPodcastService = Depends(podcast_service),
 ) -> User:
-    try:
-        return service.find_user_by_email(user_email)
-    except UnknownUser:
-        return service.save_user(user_email)
+    with phase("user_lookup"):
+        try:
+            return await service.find_user_by_email(user_email)
+        except UnknownUser:
+            return await service.save_user(user_email)
+
+
+async def admin_user(
+    user: User = Depends(authenticated_user),
+    settings: Settings = Depends(get_settings),
+) -> User:
+    if user.email not in settings.admin_emails:
+        raise HTTPException(status_code=403, detail="Admins only")
+    return user
+
+
+admission = Admission(
+    limits={
+        "/refresh": RateLimit(per_minute=2, burst=3, expensive=True),
+        "/subscribe": RateLimit(per_minute=10, burst=10, expensive=True),
+        # the feeds are fetched after the response, by a background task
+        # holding its place until done
+        "/opml": RateLimit(per_minute=1, burst=2, expensive=True),
+    },
+    workers=api_workers(),
+)
+REGISTRY.gauge(
+    "expensive_requests_in_flight",
+    "Requests to expensive routes and their background work running on this worker.",
+    function=lambda: admission.in_flight,
+)
+
+
+def admitted_user(route: str) -> Callable[..., AsyncIterator[User]]:
+    """The authenticated user, once admission lets their request run."""
+
+    async def admit(user: User = Depends(authenticated_user)) -> AsyncIterator[User]:
+        try:
+            admission.enter(route, user.id)
+        except RequestShed as shed:
+            raise HTTPException(
+                status_code=shed.status_code,
+                detail=str(shed),
+                headers={"Retry-After": shed.retry_after_header},
+            )
+        try:
+            yield user
+        finally:
+            admission.leave(route)
+
+    return admit
 
 
 @app.get("/health")
-def health() -> str:
+async def health() -> str:
     return "I'm good :)"
 
 
+# token checks, streamed responses and background tasks run on anyio's default
+# thread limiter, read at scrape time from the event loop
+REGISTRY.gauge(
+    "threadpool_busy_threads",
+    "Worker threads running sync endpoints and dependencies.",
+    function=lambda: to_thread.current_default_thread_limiter().borrowed_tokens,
+)
+REGISTRY.gauge(
+    "threadpool_max_threads",
+    "Size of the worker thread pool.",
+    function=lambda: to_thread.current_default_thread_limiter().total_tokens,
+)
+REGISTRY.gauge(
+    "threadpool_waiting_tasks",
+    "Calls waiting for a free worker thread.",
+    function=lambda: (
+        to_thread.current_default_thread_limiter().statistics().tasks_waiting
+    ),
+)
+
+
+REGISTRY.gauge(
+    "database_calls_waiting",
+    "Calls queued for the database threads, readers included.",
+    function=lambda: (
+        shared_podcast_service().database.pending
+        + sum(r.database.pending for r in shared_podcast_service().readers)
+        if shared_podcast_service.cache_info().currsize
+        else 0
+    ),
+)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics(
+    service: AsyncPodcastService = Depends(podcast_service),
+) -> PlainTextResponse:
+    # refreshes run in another process, which records them in the database
+    status = await service.get_refresh_status(REFRESH_JOB_ID)
+    if status is not None:
+        record_refresh_status(status)
+    return PlainTextResponse(
+        REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 class PodcastFeed(BaseModel):
     feed_entries: list[PlayInfo]
     next_page: int
 
 
 @app.get("/my_feed")
-def my_feed(
+async def my_feed(
     page: int = 1,
     search: str = "",
     chronological: bool = False,
     user: User = Depends(authenticated_user),
-    service: PodcastService = Depends(podcast_service),
+    service: AsyncPodcastService = Depends(podcast_service),
 ) -> PodcastFeed:
-    entries = service.get_user_home_feed(
+    entries = await service.get_user_home_feed(
         user_id=user.id, page=page, search=search, chronological=chronological
     )
     return PodcastFeed(feed_entries=entries, next_page=page + 1)
 
 
 @app.get("/feed/{feed_id}")
-def single_feed(
+async def single_feed(
     feed_id: str,
     page: int = 1,
     user: User = Depends(authenticated_user),
     chronological: bool = False,
-    service: PodcastService = Depends(podcast_service),
+    service: AsyncPodcastService = Depends(podcast_service),
 ) -> PodcastFeed:
-    entries = service.get_single_feed(
+    entries = await service.get_single_feed(
         user_id=user.id, page=page, chronological=chronological, feed_id=feed_id
     )
     return PodcastFeed(feed_entries=entries, next_page=page + 1)
 
 
 @app.post("/listened/{episode_id}")
-def listened(
+async def listened(
     episode_id: str,
     seconds_listened: int,
     user: User = Depends(authenticated_user),
-    service: PodcastService = Depends(podcast_service),
+    service: AsyncPodcastService = Depends(podcast_service),
 ) -> str:
     try:
-        service.get_episode(episode_id, user.id)
+        await service.get_episode(episode_id, user.id)
     except EpisodeNotFound:
         raise HTTPException(status_code=404, detail="Episode not found")
-    service.update_current_play_time(episode_id, user.id, seconds_listened)
+    await service.update_current_play_time(episode_id, user.id, seconds_listened)
     return f"updated playtime to {seconds_listened}"
 
 
 @app.post("/refresh")
-def refresh(
-    user: User = Depends(authenticated_user),
-    service: PodcastService = Depends(podcast_service),
+async def refresh(
+    user: User = Depends(admitted_user("/refresh")),
+    service: AsyncPodcastService = Depends(podcast_service),
 ) -> str:
-    service.update_user_feeds(user.id)
+    await service.update_user_feeds(user.id)
     return "Refreshed all your feeds"
 
 
 @app.post("/subscribe")
-def subscribe(
+async def subscribe(
     feed_url: str,
-    user: User = Depends(authenticated_user),
-    service: PodcastService = Depends(podcast_service),
+    user: User = Depends(admitted_user("/subscribe")),
+    service: AsyncPodcastService = Depends(podcast_service),
 ) -> str:
-    service.subscribe_user_to_podcast(user.id, feed_url)
+    await service.subscribe_user_to_podcast(user.id, feed_url)
     return "Subscribed Successfully"
 
 
@@ -196,17 +415,312 @@ class LatestListen(BaseModel):
 
 
 @app.get("/latest")
-def latest(
+async def latest(
     user: User = Depends(authenticated_user),
-    service: PodcastService = Depends(podcast_service),
+    service: AsyncPodcastService = Depends(podcast_service),
 ) -> LatestListen:
-    info = service.get_latest_listen_play_info(user.id)
+    info = await service.get_latest_listen_play_info(user.id)
     return LatestListen(play_info=info)
 
 
+@app.get("/continue_listening")
+async def continue_listening(
+    limit: int = Query(default=10, ge=1, le=50),
+    user: User = Depends(authenticated_user),
+    service: AsyncPodcastService = Depends(podcast_service),
+) -> list[PlayInfo]:
+    return await service.get_continue_listening(user.id, limit)
+
+
+@app.get("/stats")
+async def stats(
+    weeks: int = Query(default=12, ge=1, le=104),
+    user: User = Depends(authenticated_user),
+    service: AsyncPodcastService = Depends(podcast_service),
+) -> ListeningStats:
+    return await service.get_listening_stats(user.id, weeks)
+
+
+REGISTRY.gauge(
+    "event_streams_open",
+    "Event streams currently open on this worker.",
+    function=lambda: (
+        shared_podcast_service().events.streams
+        if shared_podcast_service.cache_info().currsize
+        else 0
+    ),
+)
+
+
+def event_stream(
+    service: AsyncPodcastService, user_id: str, last_event_id: Optional[str]
+) -> StreamingResponse:
+    after_id = int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+
+    async def stream() -> AsyncIterator[str]:
+        yield f"retry: {EVENT_RETRY_MILLISECONDS}\n\n"
+        async for event in service.events.stream(user_id, after_id):
+            yield ": keepalive\n\n" if event is None else event.encode()
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        # proxies must pass events through as they come
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/events")
+async def events(
+    last_event_id: Optional[str] = Header(default=None),
+    user: User = Depends(authenticated_user),
+    service: AsyncPodcastService = Depends(podcast_service),
+) -> StreamingResponse:
+    """Server-sent new_episodes and progress events for the user, for
+    clients sending the Authorization header, browsers use /events/signed.
+
+    Sending the id of the last event received when reconnecting, as the
+    Last-Event-ID header, starts the stream with the events missed since.
+    """
+    return event_stream(service, user.id, last_event_id)
+
+
+class EventToken(BaseModel):
+    token: str
+    expires_at: datetime
+
+
+@app.post("/events/token")
+async def event_token(
+    user: User = Depends(authenticated_user),
+    settings: Settings = Depends(get_settings),
+) -> EventToken:
+    """A token opening the user's stream at /events/signed, for browsers."""
+    if settings.event_token_secret is None:
+        raise HTTPException(status_code=404, detail="Event tokens are not configured")
+    expires_at = int(time.time()) + EVENT_TOKEN_SECONDS
+    return EventToken(
+        token=sign_event_token(settings.event_token_secret, user.id, expires_at),
+        expires_at=datetime.fromtimestamp(expires_at),
+    )
+
+
+# authenticated by the token in the url, EventSource cannot send headers
+@app.get("/events/signed")
+async def signed_events(
+    token: str,
+    last_event_id: Optional[str] = Header(default=None),
+    settings: Settings = Depends(get_settings),
+    service: AsyncPodcastService = Depends(podcast_service),
+) -> StreamingResponse:
+    """The events of /events for a browser's EventSource, opened with a token
+    from /events/token.
+
+    EventSource sends the id of the last event it received when it
+    reconnects, the stream then starts with the events it missed. Once the
+    token expires reconnecting fails, the page then opens a new EventSource
+    with a new token.
+    """
+    secret = settings.event_token_secret
+    user_id = None if secret is None else verify_event_token(secret, token)
+    if user_id is None:
+        raise UnauthorizedException(detail="Invalid or expired event token")
+    return event_stream(service, user_id, last_event_id)
+
+
+# no authentication, these are loaded by <img> tags, which cannot send a token
+@app.get("/cover_art")
+async def cover_art(
+    url: str,
+    size: int = THUMBNAIL_SIZES[0],
+    service: AsyncPodcastService = Depends(podcast_service),
+) -> RedirectResponse:
+    """Redirects to the thumbnail of a cover art url.
+
+    Covers that could not be resized are not found, clients show the
+    original url they have. Redirecting there would let anyone send
+    visitors off to any url, by subscribing to a feed naming it as cover.
+    """
+    if size not in THUMBNAIL_SIZES:
+        raise HTTPException(status_code=404, detail="Unknown thumbnail size")
+    try:
+        digest = await service.get_cover_art_digest(url)
+    except CoverArtNotFound:
+        raise HTTPException(status_code=404, detail="Cover art not fetched yet")
+    if digest is None:
+        raise HTTPException(status_code=404, detail="Cover art could not be resized")
+    return RedirectResponse(
+        f"/cover_art/{digest}/{size}",
+        headers={"Cache-Control": COVER_ART_REDIRECT_CACHE_CONTROL},
+    )
+
+
+@app.get("/cover_art/{digest}/{size}")
+async def cover_art_thumbnail(
+    digest: str,
+    size: int,
+    accept: str = Header(""),
+    store: Optional[CoverArtStore] = Depends(cover_art_store),
+) -> FileResponse:
+    if (
+        store is None
+        or size not in THUMBNAIL_SIZES
+        or not DIGEST_PATTERN.fullmatch(digest)
+    ):
+        raise HTTPException(status_code=404, detail="Unknown thumbnail")
+    for format in FORMATS:
+        if format == "webp" and "image/webp" not in accept:
+            continue
+        path = store.path(digest, size, format)
+        if path.exists():
+            return FileResponse(
+                path,
+                media_type=MEDIA_TYPES[format],
+                headers={"Cache-Control": THUMBNAIL_CACHE_CONTROL, "Vary": "Accept"},
+            )
+    raise HTTPException(status_code=404, detail="Unknown thumbnail")
+
+
 @app.get("/subscribed_feeds")
-def subscribed_feeds(
+async def subscribed_feeds(
     user: User = Depends(authenticated_user),
-    service: PodcastService = Depends(podcast_service),
+    service: AsyncPodcastService = Depends(podcast_service),
 ) -> list[Feed]:
-    return service.get_user_subscribed_feeds(user.id)
+    return await service.get_user_subscribed_feeds(user.id)
+
+
+def fetch_imported_feeds(feeds: list[Feed], progress: ImportProgress) -> None:
+    # runs after the response is sent, so it gets its own connection
+    try:
+        with open_podcast_service() as service:
+            service.fetch_new_feeds(
+                feeds, progress, on_progress=service.datastore.update_opml_import
+            )
+    finally:
+        admission.leave("/opml")
+
+
+@app.post("/opml", status_code=status.HTTP_202_ACCEPTED)
+async def import_opml(
+    file: UploadFile,
+    background_tasks: BackgroundTasks,
+    user: User = Depends(admitted_user("/opml")),
+    service: AsyncPodcastService = Depends(podcast_service),
+) -> ImportProgress:
+    document = await file.read(MAX_OPML_BYTES + 1)
+    if len(document) > MAX_OPML_BYTES:
+        raise HTTPException(status_code=413, detail="OPML document too large")
+    try:
+        new_feeds = await service.import_opml(user.id, document)
+    except InvalidOpml as error:
+        raise HTTPException(status_code=400, detail=f"Invalid OPML: {error}")
+    progress = ImportProgress(user_id=user.id, total=len(new_feeds))
+    await service.save_opml_import(progress)
+    admission.hold("/opml")
+    background_tasks.add_task(fetch_imported_feeds, new_feeds, progress)
+    return progress
+
+
+@app.get("/opml/{import_id}")
+async def opml_import_progress(
+    import_id: str,
+    user: User = Depends(authenticated_user),
+    service: AsyncPodcastService = Depends(podcast_service),
+) -> ImportProgress:
+    progress = await service.get_opml_import(import_id)
+    if progress is None or progress.user_id != user.id:
+        raise HTTPException(status_code=404, detail="Import not found")
+    return progress
+
+
+@app.get("/opml")
+async def export_opml(
+    user: User = Depends(authenticated_user),
+    service: AsyncPodcastService = Depends(podcast_service),
+) -> StreamingResponse:
+    return StreamingResponse(
+        await service.export_opml(user.id),
+        media_type="text/x-opml",
+        headers={"Content-Disposition": 'attachment; filename="subscriptions.opml"'},
+    )
+
+
+class QueryLog(BaseModel):
+    # the process id of the API worker, the log only covers its queries
+    worker: int
+    settings: QueryLogSettings
+    plans: list[QueryPlan]
+
+
+@app.get("/admin/query_log")
+async def query_log(admin: User = Depends(admin_user)) -> QueryLog:
+    return QueryLog(
+        worker=os.getpid(),
+        settings=query_instrumentation.settings,
+        plans=query_instrumentation.plans(),
+    )
+
+
+@app.put("/admin/query_log")
+async def configure_query_log(
+    settings: QueryLogSettings, admin: User = Depends(admin_user)
+) -> QueryLogSettings:
+    # only the worker taking the request would apply them
+    if api_workers() > 1:
+        raise HTTPException(
+            status_code=409,
+            detail="Query log settings are kept per API worker, change them while serving with a single worker",
+        )
+    query_instrumentation.configure(settings)
+    return query_instrumentation.settings
+
+
+class ProfileToken(BaseModel):
+    token: str
+    expires_at: datetime
+
+
+@app.post("/admin/profile_token")
+async def profile_token(
+    minutes: int = Query(default=10, ge=1, le=24 * 60),
+    admin: User = Depends(admin_user),
+    settings: Settings = Depends(get_settings),
+) -> ProfileToken:
+    """Requests sent with this token in an X-Profile header are profiled."""
+    if settings.profiling_secret is None:
+        raise HTTPException(status_code=404, detail="Profiling is not configured")
+    expires_at = int(time.time()) + minutes * 60
+    return ProfileToken(
+        token=sign_profile_token(settings.profiling_secret, expires_at),
+        expires_at=datetime.fromtimestamp(expires_at),
+    )
+
+
+@app.get("/admin/profiles")
+async def list_profiles(admin: User = Depends(admin_user)) -> list[ProfileSummary]:
+    return [profile for profile in profiles.all()]
+
+
+def stored_profile(profile_id: str) -> Profile:
+    profile = profiles.get(profile_id)
+    if profile is not None:
+        return profile
+    worker = profile_worker(profile_id)
+    if worker is not None and worker != os.getpid():
+        raise HTTPException(
+            status_code=421,
+            detail=f"Profile taken by API worker {worker}, this request reached worker {os.getpid()}",
+        )
+    raise HTTPException(status_code=404, detail="Profile not found")
+
+
+@app.get("/admin/profiles/{profile_id}")
+async def get_profile(profile_id: str, admin: User = Depends(admin_user)) -> Profile:
+    return stored_profile(profile_id)
+
+
+@app.get("/admin/profiles/{profile_id}/collapsed", response_class=PlainTextResponse)
+async def get_collapsed_profile(
+    profile_id: str, admin: User = Depends(admin_user)
+) -> PlainTextResponse:
+    return PlainTextResponse(stored_profile(profile_id).collapsed())
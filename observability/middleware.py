@@ -0,0 +1,85 @@
+"""Request latency, phase and concurrency metrics for the API."""
+
+import time
+from typing import Any
+
+from fastapi.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from observability.metrics import REGISTRY
+from observability.timing import phase, request_phases
+
+REQUEST_DURATION = REGISTRY.histogram(
+    "http_request_duration_seconds",
+    "Time until the last byte of the response body was sent.",
+    ("method", "route", "status"),
+)
+PHASE_DURATION = REGISTRY.histogram(
+    "http_request_phase_seconds",
+    "Time spent in each phase of a request, phases can overlap.",
+    ("route", "phase"),
+)
+IN_FLIGHT = REGISTRY.gauge(
+    "http_requests_in_flight", "Requests currently being handled."
+)
+
+UNMATCHED_ROUTE = "unmatched"
+
+
+class TimedJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        with phase("render"):
+            return super().render(content)
+
+
+class MetricsMiddleware:
+    """Labels requests by route template so path parameters don't explode
+    the number of series.
+
+    Background tasks run after the response is complete and are not
+    counted in the request's latency.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        phases: dict[str, float] = {}
+        token = request_phases.set(phases)
+        start = time.perf_counter()
+        status = 500
+        recorded = False
+
+        def record() -> None:
+            nonlocal recorded
+            recorded = True
+            elapsed = time.perf_counter() - start
+            IN_FLIGHT.dec()
+            route = getattr(scope.get("route"), "path", UNMATCHED_ROUTE)
+            REQUEST_DURATION.observe(elapsed, scope["method"], route, str(status))
+            for name, seconds in list(phases.items()):
+                PHASE_DURATION.observe(seconds, route, name)
+
+        async def send_and_record(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+            if (
+                message["type"] == "http.response.body"
+                and not message.get("more_body", False)
+                and not recorded
+            ):
+                record()
+
+        IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_and_record)
+        finally:
+            if not recorded:
+                record()
+            request_phases.reset(token)
@@ -0,0 +1,232 @@
+"""Profiles of single requests, triggered by a signed X-Profile header.
+
+Tokens are minted by admins and expire. While at least one profiled request
+is in flight a profile function is installed on every thread. It only
+records events running in the profiled request's context, which follows
+the request into the worker threads of its sync dependencies and endpoint.
+Time between samples is attributed to the stack at the next sample, which
+makes time blocked in C calls such as sqlite show up under that call.
+Without a valid header nothing is installed and requests are untouched.
+"""
+
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from datetime import datetime
+from types import FrameType
+from typing import Any, Callable, Optional
+from uuid import uuid4
+
+from pydantic import BaseModel
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+PROFILE_HEADER = b"x-profile"
+PROFILE_ID_HEADER = b"x-profile-id"
+SAMPLE_INTERVAL_SECONDS = 0.0005
+MAX_STACK_DEPTH = 128
+MAX_STORED_PROFILES = 50
+MAX_SQL_STATEMENTS = 1_000
+
+
+def sign_profile_token(secret: str, expires_at: int) -> str:
+    signature = hmac.new(secret.encode(), str(expires_at).encode(), hashlib.sha256)
+    return f"{expires_at}.{signature.hexdigest()}"
+
+
+def verify_profile_token(secret: str, token: str, now: Optional[float] = None) -> bool:
+    expires_at, _, _ = token.partition(".")
+    if not expires_at.isdigit():
+        return False
+    if int(expires_at) < (time.time() if now is None else now):
+        return False
+    return hmac.compare_digest(token, sign_profile_token(secret, int(expires_at)))
+
+
+class SqlTiming(BaseModel):
+    statement: str
+    seconds: float
+
+
+class ProfileSummary(BaseModel):
+    id: str
+    method: str
+    path: str
+    status: int
+    started_at: datetime
+    seconds: float
+
+
+class Profile(ProfileSummary):
+    # collapsed stacks, root first and separated by ";", to microseconds
+    stacks: dict[str, int]
+    sql: list[SqlTiming]
+
+    def collapsed(self) -> str:
+        """The format flamegraph.pl, inferno and speedscope read."""
+        return "".join(f"{stack} {weight}\n" for stack, weight in self.stacks.items())
+
+
+def profile_worker(profile_id: str) -> Optional[int]:
+    """The process id of the API worker that took the profile."""
+    worker, _, _ = profile_id.partition("-")
+    return int(worker) if worker.isdigit() else None
+
+
+class ProfileSession:
+    def __init__(self, method: str, path: str) -> None:
+        # profiles stay in the worker that took them
+        self.id = f"{os.getpid()}-{uuid4().hex}"
+        self.method = method
+        self.path = path
+        self.status = 500
+        self.started_at = datetime.now()
+        self.start = time.perf_counter()
+        self.last_sample = self.start
+        self.stacks: dict[str, float] = {}
+        self.sql: list[SqlTiming] = []
+        # reentrant, the profile function also runs for code holding the lock
+        self.lock = threading.RLock()
+
+    def sample(self, frame: Optional[FrameType], leaf: Optional[str]) -> None:
+        now = time.perf_counter()
+        elapsed = now - self.last_sample
+        if elapsed < SAMPLE_INTERVAL_SECONDS:
+            return
+        self.last_sample = now
+        names = [] if leaf is None else [leaf]
+        while frame is not None and len(names) < MAX_STACK_DEPTH:
+            code = frame.f_code
+            names.append(f"{frame.f_globals.get('__name__', '?')}:{code.co_qualname}")
+            frame = frame.f_back
+        stack = ";".join(reversed(names))
+        with self.lock:
+            self.stacks[stack] = self.stacks.get(stack, 0.0) + elapsed
+
+    def add_sql(self, statement: str, seconds: float) -> None:
+        timing = SqlTiming(statement=" ".join(statement.split()), seconds=seconds)
+        with self.lock:
+            if len(self.sql) < MAX_SQL_STATEMENTS:
+                self.sql.append(timing)
+
+    def finish(self) -> Profile:
+        return Profile(
+            id=self.id,
+            method=self.method,
+            path=self.path,
+            status=self.status,
+            started_at=self.started_at,
+            seconds=time.perf_counter() - self.start,
+            stacks={
+                stack: round(seconds * 1_000_000)
+                for stack, seconds in self.stacks.items()
+            },
+            sql=self.sql,
+        )
+
+
+active_profile: ContextVar[Optional[ProfileSession]] = ContextVar(
+    "active_profile", default=None
+)
+
+
+def _profile_event(frame: FrameType, event: str, arg: Any) -> None:
+    session = active_profile.get()
+    if session is None:
+        return
+    leaf = None
+    if event.startswith("c_"):
+        leaf = f"{getattr(arg, '__module__', None) or 'builtins'}:{getattr(arg, '__qualname__', repr(arg))}"
+    session.sample(frame, leaf)
+
+
+_installed_lock = threading.Lock()
+_installed_sessions = 0
+
+
+def _install() -> None:
+    global _installed_sessions
+    with _installed_lock:
+        _installed_sessions += 1
+        if _installed_sessions == 1:
+            threading.setprofile_all_threads(_profile_event)
+
+
+def _uninstall() -> None:
+    global _installed_sessions
+    with _installed_lock:
+        _installed_sessions -= 1
+        if _installed_sessions == 0:
+            threading.setprofile_all_threads(None)
+
+
+class ProfileStore:
+    """The most recent profiles of this process."""
+
+    def __init__(self, capacity: int = MAX_STORED_PROFILES) -> None:
+        self.capacity = capacity
+        self._profiles: OrderedDict[str, Profile] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, profile: Profile) -> None:
+        with self._lock:
+            self._profiles[profile.id] = profile
+            while len(self._profiles) > self.capacity:
+                self._profiles.popitem(last=False)
+
+    def get(self, profile_id: str) -> Optional[Profile]:
+        return self._profiles.get(profile_id)
+
+    def all(self) -> list[Profile]:
+        with self._lock:
+            return list(self._profiles.values())
+
+
+class ProfilingMiddleware:
+    def __init__(
+        self,
+        app: ASGIApp,
+        secret: Callable[[], Optional[str]],
+        store: ProfileStore,
+    ) -> None:
+        self.app = app
+        self.secret = secret
+        self.store = store
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        token = None
+        if scope["type"] == "http":
+            for name, value in scope["headers"]:
+                if name == PROFILE_HEADER:
+                    token = value.decode("latin-1")
+                    break
+        if token is None:
+            await self.app(scope, receive, send)
+            return
+        secret = self.secret()
+        if secret is None or not verify_profile_token(secret, token):
+            await self.app(scope, receive, send)
+            return
+
+        session = ProfileSession(scope["method"], scope["path"])
+
+        async def send_with_profile_id(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                session.status = message["status"]
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (PROFILE_ID_HEADER, session.id.encode()),
+                ]
+            await send(message)
+
+        context_token = active_profile.set(session)
+        _install()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            _uninstall()
+            active_profile.reset(context_token)
+            self.store.add(session.finish())
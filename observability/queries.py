@@ -0,0 +1,133 @@
+"""Per-statement timings, slow query log and query plan capture.
+
+Plugged into Datastore as its query hook. It is off until switched on
+through the admin endpoints, and while off Datastore skips it entirely.
+"""
+
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+from typing import Any, Optional
+
+from pydantic import BaseModel
+
+from observability.metrics import REGISTRY
+from persistence.datastore import Parameters, QueryEvent
+
+logger = logging.getLogger(__name__)
+
+QUERY_DURATION = REGISTRY.histogram(
+    "sqlite_query_duration_seconds",
+    "Time to run a statement and fetch its rows.",
+    ("method", "statement"),
+)
+QUERY_ROWS = REGISTRY.histogram(
+    "sqlite_query_rows",
+    "Rows returned by a statement, or affected for writes.",
+    ("method", "statement"),
+    buckets=(0, 1, 10, 100, 1_000, 10_000, 100_000),
+)
+SLOW_QUERIES = REGISTRY.counter(
+    "sqlite_slow_queries_total", "Statements slower than the threshold.", ("method",)
+)
+
+MAX_CAPTURED_PLANS = 500
+_whitespace = re.compile(r"\s+")
+_placeholder_list = re.compile(r"\bin\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+
+
+def statement_shape(statement: str) -> str:
+    """Statements differing only by whitespace or IN list length share a shape."""
+    return _placeholder_list.sub("in (?, ...)", _whitespace.sub(" ", statement).strip())
+
+
+def statement_id(shape: str) -> str:
+    return hashlib.sha1(shape.encode()).hexdigest()[:8]
+
+
+def redact(parameters: Parameters) -> list[str]:
+    """Keeps the type of each parameter, never its value."""
+    return [type(value).__name__ for value in parameters]
+
+
+class QueryLogSettings(BaseModel):
+    enabled: bool = False
+    slow_query_seconds: float = 0.1
+    explain: bool = False
+
+
+class QueryPlan(BaseModel):
+    statement_id: str
+    method: str
+    statement: str
+    plan: list[str]
+
+
+class QueryInstrumentation:
+    def __init__(self, settings: Optional[QueryLogSettings] = None) -> None:
+        self.configure(settings or QueryLogSettings())
+        self._plans: dict[str, QueryPlan] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def settings(self) -> QueryLogSettings:
+        return QueryLogSettings(
+            enabled=self.enabled,
+            slow_query_seconds=self.slow_query_seconds,
+            explain=self.explain,
+        )
+
+    def configure(self, settings: QueryLogSettings) -> None:
+        self.slow_query_seconds = settings.slow_query_seconds
+        self.explain = settings.explain
+        # flipped last so that the hook never runs half configured
+        self.enabled = settings.enabled
+
+    def plans(self) -> list[QueryPlan]:
+        with self._lock:
+            return list(self._plans.values())
+
+    def __call__(self, event: QueryEvent, connection: sqlite3.Connection) -> None:
+        shape = statement_shape(event.statement)
+        shape_id = statement_id(shape)
+        QUERY_DURATION.observe(event.seconds, event.method, shape_id)
+        QUERY_ROWS.observe(event.rows, event.method, shape_id)
+        if event.seconds >= self.slow_query_seconds:
+            SLOW_QUERIES.inc(event.method)
+            logger.warning(
+                f"slow query {shape_id} in {event.method} took {event.seconds * 1000:.1f}ms for {event.rows} rows: {shape} parameters {redact(event.parameters)}"
+            )
+        if self.explain and shape_id not in self._plans:
+            self._capture_plan(shape_id, shape, event, connection)
+
+    def _capture_plan(
+        self,
+        shape_id: str,
+        shape: str,
+        event: QueryEvent,
+        connection: sqlite3.Connection,
+    ) -> None:
+        try:
+            rows: list[Any] = connection.execute(
+                f"explain query plan {event.statement}", event.parameters
+            ).fetchall()
+            depths: dict[int, int] = {}
+            plan = []
+            for node_id, parent_id, _, detail in rows:
+                depths[node_id] = depths.get(parent_id, -1) + 1
+                plan.append("  " * depths[node_id] + detail)
+        except sqlite3.Error as error:
+            plan = [f"could not explain: {error}"]
+        with self._lock:
+            if len(self._plans) < MAX_CAPTURED_PLANS:
+                self._plans.setdefault(
+                    shape_id,
+                    QueryPlan(
+                        statement_id=shape_id,
+                        method=event.method,
+                        statement=shape,
+                        plan=plan,
+                    ),
+                )
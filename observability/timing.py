@@ -0,0 +1,87 @@
+"""Per-request phase timings.
+
+The middleware opens a phase table for each request and code on the request
+path adds the time it spends in named phases to it. Outside of a request,
+for example during the scheduled refresh, phase() does nothing.
+"""
+
+import sqlite3
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+from observability.profiling import active_profile
+
+# the dict is shared with the threads sync endpoints run in, since they get a
+# copy of the context pointing to the same object
+request_phases: ContextVar[Optional[dict[str, float]]] = ContextVar(
+    "request_phases", default=None
+)
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    phases = request_phases.get()
+    if phases is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases[name] = phases.get(name, 0.0) + time.perf_counter() - start
+
+
+def _profile_statement(statement: str, start: float) -> None:
+    profile = active_profile.get()
+    if profile is not None:
+        profile.add_sql(statement, time.perf_counter() - start)
+
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, statement, *args, **kwargs):
+        start = time.perf_counter()
+        with phase("sql"):
+            cursor = super().execute(statement, *args, **kwargs)
+        _profile_statement(statement, start)
+        return cursor
+
+    def executemany(self, statement, *args, **kwargs):
+        start = time.perf_counter()
+        with phase("sql"):
+            cursor = super().executemany(statement, *args, **kwargs)
+        _profile_statement(statement, start)
+        return cursor
+
+    def fetchone(self):
+        with phase("sql"):
+            return super().fetchone()
+
+    def fetchmany(self, *args, **kwargs):
+        with phase("sql"):
+            return super().fetchmany(*args, **kwargs)
+
+    def fetchall(self):
+        with phase("sql"):
+            return super().fetchall()
+
+
+class TimedConnection(sqlite3.Connection):
+    """Attributes statement execution and fetching to the sql phase.
+
+    Use with sqlite3.connect(..., factory=TimedConnection).
+    """
+
+    def cursor(self, factory=TimedCursor):  # type: ignore[override]
+        return super().cursor(factory)
+
+    def execute(self, *args, **kwargs):
+        return self.cursor().execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        return self.cursor().executemany(*args, **kwargs)
+
+    def commit(self) -> None:
+        with phase("sql"):
+            super().commit()
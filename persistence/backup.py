@@ -0,0 +1,106 @@
+import gzip
+import hashlib
+import os
+import shutil
+import sqlite3
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+
+DEFAULT_BACKUPS_KEPT = 7
+# most of the ratio of level 9 in a fraction of its time on database pages
+GZIP_LEVEL = 6
+SNAPSHOT_PREFIX = "poddb-"
+SNAPSHOT_SUFFIX = ".db.gz"
+
+
+@dataclass
+class BackupReport:
+    path: Path
+    sha256: str
+    database_bytes: int
+    compressed_bytes: int
+    seconds: float
+
+    @property
+    def megabytes_per_second(self) -> float:
+        return self.database_bytes / 1e6 / self.seconds
+
+
+def backup_database(
+    source: sqlite3.Connection,
+    directory: Path,
+    now: datetime,
+    keep: int = DEFAULT_BACKUPS_KEPT,
+) -> BackupReport:
+    """Writes a gzipped, checksummed snapshot and keeps the newest keep.
+
+    The copy is made in a single step, inside one read transaction. In WAL
+    mode that never blocks writers, and it sees the database as of its start.
+    A copy made in several steps would restart whenever another connection
+    writes between two of them, and never finish while writes keep coming.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    name = f"{SNAPSHOT_PREFIX}{now:%Y%m%dT%H%M%S}{SNAPSHOT_SUFFIX}"
+    path = directory / name
+    copy_path = directory / f".{name}.db"
+    start = time.perf_counter()
+    copy = sqlite3.connect(copy_path)
+    try:
+        source.backup(copy, pages=-1)
+    finally:
+        copy.close()
+    database_bytes = copy_path.stat().st_size
+    partial_path = directory / f".{name}.partial"
+    with (
+        open(copy_path, "rb") as database,
+        gzip.open(partial_path, "wb", compresslevel=GZIP_LEVEL) as output,
+    ):
+        shutil.copyfileobj(database, output, length=1024 * 1024)
+    copy_path.unlink()
+    sha256 = file_sha256(partial_path)
+    checksum_path(path).write_text(f"{sha256}  {name}\n")
+    # only complete snapshots with their checksum ever carry the final name
+    os.replace(partial_path, path)
+    seconds = time.perf_counter() - start
+    rotate_snapshots(directory, keep)
+    return BackupReport(
+        path=path,
+        sha256=sha256,
+        database_bytes=database_bytes,
+        compressed_bytes=path.stat().st_size,
+        seconds=seconds,
+    )
+
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def checksum_path(snapshot: Path) -> Path:
+    """The sha256sum style checksum file of a snapshot, for `sha256sum -c`."""
+    return snapshot.with_name(f"{snapshot.name}.sha256")
+
+
+def list_snapshots(directory: Path) -> list[Path]:
+    """Snapshots oldest first, their names sort by time."""
+    return sorted(directory.glob(f"{SNAPSHOT_PREFIX}*{SNAPSHOT_SUFFIX}"))
+
+
+def rotate_snapshots(directory: Path, keep: int) -> list[Path]:
+    snapshots = list_snapshots(directory)
+    removed = snapshots[: max(len(snapshots) - keep, 0)]
+    for snapshot in removed:
+        snapshot.unlink()
+        checksum_path(snapshot).unlink(missing_ok=True)
+    return removed
+
+
+def verify_snapshot(snapshot: Path) -> bool:
+    expected = checksum_path(snapshot).read_text().split()[0]
+    return file_sha256(snapshot) == expected
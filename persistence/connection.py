@@ -0,0 +1,19 @@
+import sqlite3
+from typing import Any
+
+DATABASE_PATH = "./db/poddb.db"
+BUSY_TIMEOUT_SECONDS = 5.0
+
+
+def connect(path: str = DATABASE_PATH, **kwargs: Any) -> sqlite3.Connection:
+    """Opens the database to be shared by the API workers and the refresher.
+
+    In WAL mode readers never wait for the writer, and a writer waits up to
+    BUSY_TIMEOUT_SECONDS for another process' write instead of failing with
+    "database is locked". With synchronous normal a power cut can lose the
+    last commits but never corrupts a WAL database.
+    """
+    connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT_SECONDS, **kwargs)
+    connection.execute("pragma journal_mode = wal;")
+    connection.execute("pragma synchronous = normal;")
+    return connection
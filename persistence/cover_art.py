@@ -0,0 +1,32 @@
+import os
+from pathlib import Path
+
+# file extension of each thumbnail format
+EXTENSIONS = {"webp": "webp", "jpeg": "jpg"}
+
+
+class CoverArtStore:
+    """Thumbnails of cover art on local disk, named after the digest of the
+    original image.
+
+    Feeds sharing an image share its thumbnails, and a file never changes
+    once written, which lets clients cache it for good.
+    """
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+        self.objects_dir = directory / "objects"
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+
+    def path(self, digest: str, size: int, format: str) -> Path:
+        return self.objects_dir / digest[:2] / f"{digest}-{size}.{EXTENSIONS[format]}"
+
+    def has(self, digest: str, size: int, format: str) -> bool:
+        return self.path(digest, size, format).exists()
+
+    def put(self, digest: str, size: int, format: str, body: bytes) -> None:
+        path = self.path(digest, size, format)
+        path.parent.mkdir(exist_ok=True)
+        temporary_path = path.with_suffix(".tmp")
+        temporary_path.write_bytes(body)
+        os.replace(temporary_path, path)
@@ -0,0 +1,103 @@
+import asyncio
+import contextvars
+import logging
+import queue
+import sqlite3
+import threading
+from dataclasses import dataclass
+from functools import partial
+from typing import Any, Callable, Optional, ParamSpec, TypeVar
+
+logger = logging.getLogger(__name__)
+
+P = ParamSpec("P")
+T = TypeVar("T")
+
+
+class DatabaseThreadClosed(Exception): ...
+
+
+@dataclass
+class _Call:
+    function: Callable[[], Any]
+    context: contextvars.Context
+    loop: asyncio.AbstractEventLoop
+    future: asyncio.Future
+
+
+class DatabaseThread:
+    """Owns a SQLite connection and runs every call against it on one thread.
+
+    Coroutines queue their work with run() and await the result, so the event
+    loop never blocks on SQLite and no worker thread is held while waiting for
+    the database. Calls run one at a time in submission order, with the
+    caller's context variables so request timing and profiling still apply.
+    Nothing slow that isn't SQLite, like fetching a feed, belongs here.
+    """
+
+    def __init__(self, connection: sqlite3.Connection, name: str = "database") -> None:
+        self.connection = connection
+        self._calls: queue.SimpleQueue[Optional[_Call]] = queue.SimpleQueue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._serve, name=name, daemon=True)
+        self._thread.start()
+
+    @property
+    def pending(self) -> int:
+        return self._calls.qsize()
+
+    async def run(
+        self, function: Callable[P, T], *args: P.args, **kwargs: P.kwargs
+    ) -> T:
+        if self._closed:
+            raise DatabaseThreadClosed()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._calls.put(
+            _Call(
+                function=partial(function, *args, **kwargs),
+                context=contextvars.copy_context(),
+                loop=loop,
+                future=future,
+            )
+        )
+        return await future
+
+    def close(self) -> None:
+        """Finishes the queued calls, then closes the connection."""
+        if self._closed:
+            return
+        self._closed = True
+        self._calls.put(None)
+        self._thread.join()
+        self.connection.close()
+
+    def _serve(self) -> None:
+        while (call := self._calls.get()) is not None:
+            # the awaiting request went away, e.g. the client disconnected
+            if call.future.cancelled():
+                continue
+            try:
+                result = call.context.run(call.function)
+            except Exception as error:
+                self._resolve(call, _set_exception, error)
+            else:
+                self._resolve(call, _set_result, result)
+
+    def _resolve(
+        self, call: _Call, outcome: Callable[[asyncio.Future, Any], None], value: Any
+    ) -> None:
+        try:
+            call.loop.call_soon_threadsafe(outcome, call.future, value)
+        except RuntimeError:
+            logger.warning("event loop closed before a database call returned")
+
+
+def _set_result(future: asyncio.Future, result: Any) -> None:
+    if not future.cancelled():
+        future.set_result(result)
+
+
+def _set_exception(future: asyncio.Future, error: Any) -> None:
+    if not future.cancelled():
+        future.set_exception(error)
@@ -1,10 +1,77 @@
 import sqlite3
-from datetime import datetime
-from typing import Optional
+import sys
+import time
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Any, Iterable, Optional, Protocol, Sequence
 from uuid import uuid4
 
 from business.entities import Subscription, User
+from business.events import EVENTS_PER_POLL, Event
+from business.opml import ImportProgress
 from business.podcast import Episode, EpisodeAssets, Feed, PlayInfo, PreviousListen
+from persistence.rows import (
+    EPISODE_COLUMNS,
+    LISTEN_COLUMNS,
+    episode,
+    play_info,
+    previous_listen,
+)
+
+# finished OPML imports can still be polled for this long
+OPML_IMPORT_RETENTION_SECONDS = 7 * 24 * 60 * 60
+
+# episodes listened to up to this close to their end count as finished
+FINISHED_MARGIN_SECONDS = 20
+
+RECOUNT_SUBSCRIPTIONS = f"""
+update subscription set
+    unplayed_count = (
+        select count(*) from episode
+        where episode.feed_id = subscription.feed_id
+        and not exists (
+            select 1 from previous_listen
+            where previous_listen.episode_id = episode.episode_id
+            and previous_listen.user_id = subscription.user_id
+        )
+    ) + (
+        -- archived episodes are never listened to
+        select count(*) from episode_archive
+        where episode_archive.feed_id = subscription.feed_id
+    ),
+    in_progress_count = (
+        select count(*) from episode
+        join previous_listen on previous_listen.episode_id = episode.episode_id
+        where episode.feed_id = subscription.feed_id
+        and previous_listen.user_id = subscription.user_id
+        and episode.length is not null
+        and episode.length - previous_listen.seconds >= {FINISHED_MARGIN_SECONDS}
+    ),
+    latest_episode_date = (
+        select max(published_date) from episode where episode.feed_id = subscription.feed_id
+    )
+"""
+
+FLAG_FINISHED_LISTENS = f"""
+update previous_listen set finished = case when exists (
+    select 1 from episode
+    where episode.episode_id = previous_listen.episode_id
+    and episode.length is not null
+    and episode.length - previous_listen.seconds >= {FINISHED_MARGIN_SECONDS}
+) then 0 else 1 end
+"""
+
+# deltas larger than this many times the wall clock time since the previous
+# update of a listen are seeks rather than listening
+MAX_PLAYBACK_RATE = 3
+
+
+def listen_state(length: Optional[int], seconds: Optional[int]) -> str:
+    if seconds is None:
+        return "unplayed"
+    if length is not None and length - seconds >= FINISHED_MARGIN_SECONDS:
+        return "in_progress"
+    return "finished"
 
 
 class UserAlreadyExists(Exception): ...
@@ -19,52 +86,243 @@ class EpisodeNotFound(Exception): ...
 class UnknownUser(Exception): ...
 
 
+class CoverArtNotFound(Exception): ...
+
+
+@dataclass
+class TimelineReport:
+    """Rows the timeline lacks and rows it should not have.
+
+    A row whose denormalized values went stale counts in both.
+    """
+
+    missing: int
+    unexpected: int
+
+    @property
+    def consistent(self) -> bool:
+        return self.missing == 0 and self.unexpected == 0
+
+
+@dataclass
+class RefreshStatus:
+    """The last completed cycle of a refresh job and how many were skipped."""
+
+    job_id: str
+    holder: Optional[str]
+    started_at: Optional[float]
+    finished_at: Optional[float]
+    processed: int
+    failed: int
+    lag_seconds: Optional[float]
+    skipped: int
+
+
+@dataclass
+class ArchiveReport:
+    """Episodes moved to the archive, and the bytes in use by the hot tables.
+
+    The sizes cover episode, timeline and their indexes. They are None when
+    sqlite is built without the dbstat table.
+    """
+
+    archived: int
+    hot_bytes_before: Optional[int]
+    hot_bytes_after: Optional[int]
+
+
+# the tables the home and single feed queries join, shrunk by archiving
+HOT_TABLES = ("episode", "timeline")
+# the hot and archived episodes of a feed, and of a user's subscriptions
+FEED_EPISODES = (
+    "select published_date from episode where feed_id = ?",
+    "select episode_id, published_date from episode_archive where feed_id = ?",
+)
+SUBSCRIBED_EPISODES = (
+    "select published_date from timeline where user_id = ?",
+    "select episode_id, published_date from episode_archive where feed_id in (select feed_id from subscription where user_id = ?)",
+)
+
+Parameters = Sequence[Any]
+
+
+@dataclass
+class QueryEvent:
+    """One statement run by a Datastore method, including fetching its rows.
+
+    rows is the number of rows returned, or affected for writes.
+    """
+
+    method: str
+    statement: str
+    parameters: Parameters
+    seconds: float
+    rows: int
+
+
+class QueryHook(Protocol):
+    enabled: bool
+
+    def __call__(self, event: QueryEvent, connection: sqlite3.Connection) -> None: ...
+
+
 class Datastore:
-    def __init__(self, connection: sqlite3.Connection) -> None:
+    def __init__(
+        self, connection: sqlite3.Connection, query_hook: Optional[QueryHook] = None
+    ) -> None:
         self.connection = connection
+        self.query_hook = query_hook
+
+    # every statement goes through these so that the hook sees all of them,
+    # when it is missing or disabled they add nothing but a check
+
+    def _execute(self, statement: str, parameters: Parameters = ()) -> sqlite3.Cursor:
+        if self.query_hook is None or not self.query_hook.enabled:
+            return self.connection.execute(statement, parameters)
+        start = time.perf_counter()
+        cursor = self.connection.execute(statement, parameters)
+        self._observe(statement, parameters, start, cursor.rowcount)
+        return cursor
+
+    def _executemany(
+        self, statement: str, parameters: Iterable[Parameters]
+    ) -> sqlite3.Cursor:
+        if self.query_hook is None or not self.query_hook.enabled:
+            return self.connection.executemany(statement, parameters)
+        parameters = list(parameters)
+        start = time.perf_counter()
+        cursor = self.connection.executemany(statement, parameters)
+        self._observe(
+            statement, parameters[0] if parameters else (), start, cursor.rowcount
+        )
+        return cursor
+
+    def _fetchone(self, statement: str, parameters: Parameters = ()) -> Optional[Any]:
+        if self.query_hook is None or not self.query_hook.enabled:
+            return self.connection.execute(statement, parameters).fetchone()
+        start = time.perf_counter()
+        row = self.connection.execute(statement, parameters).fetchone()
+        self._observe(statement, parameters, start, 0 if row is None else 1)
+        return row
+
+    def _fetchscalar(self, statement: str, parameters: Parameters = ()) -> Any:
+        """The single value of a statement always returning one row."""
+        row = self._fetchone(statement, parameters)
+        assert row is not None, statement
+        return row[0]
+
+    def _fetchall(self, statement: str, parameters: Parameters = ()) -> list[Any]:
+        if self.query_hook is None or not self.query_hook.enabled:
+            return self.connection.execute(statement, parameters).fetchall()
+        start = time.perf_counter()
+        rows = self.connection.execute(statement, parameters).fetchall()
+        self._observe(statement, parameters, start, len(rows))
+        return rows
+
+    def _observe(
+        self, statement: str, parameters: Parameters, start: float, rows: int
+    ) -> None:
+        seconds = time.perf_counter() - start
+        assert self.query_hook is not None
+        # the statement is labelled with the public method that issued it,
+        # not with the private helpers in between
+        frame = sys._getframe(2)
+        while frame.f_code.co_name.startswith("_") and frame.f_back is not None:
+            frame = frame.f_back
+        method = frame.f_code.co_name
+        event = QueryEvent(
+            method=method,
+            statement=statement,
+            parameters=parameters,
+            seconds=seconds,
+            rows=max(rows, 0),
+        )
+        self.query_hook(event, self.connection)
 
     def save_user(self, id: str, email: str) -> User:
-        cursor = self.connection.cursor()
         try:
-            cursor.execute("INSERT INTO user (id, email) VALUES (?, ?);", (id, email))
+            self._execute("INSERT INTO user (id, email) VALUES (?, ?);", (id, email))
         except sqlite3.IntegrityError:
             raise UserAlreadyExists
         self.connection.commit()
         return User(id=id, email=email)
 
     def get_user_by_email(self, email: str) -> User:
-        cursor = self.connection.cursor()
-        cursor.execute("SELECT * FROM user WHERE email = ?;", (email,))
-        result = cursor.fetchone()
+        result = self._fetchone("SELECT * FROM user WHERE email = ?;", (email,))
         if result is None:
             raise UnknownUser
         return User(id=result[0], email=result[1])
 
     def subscribe(self, user_id: str, feed_id: str) -> None:
-        cursor = self.connection.cursor()
         try:
-            cursor.execute(
+            self._execute(
                 "INSERT INTO subscription (user_id, feed_id) VALUES (?,?);",
                 (user_id, feed_id),
             )
         except sqlite3.IntegrityError:
+            self.connection.rollback()
             raise SubscriptionAlreadyExists
+        self._add_feed_to_timeline(user_id=user_id, feed_id=feed_id)
         self.connection.commit()
 
+    def _add_feed_to_timeline(self, user_id: str, feed_id: str) -> None:
+        self._execute(
+            "insert or ignore into timeline (user_id, episode_id, feed_id, published_date, cover_art_url) select ?, episode.episode_id, episode.feed_id, episode.published_date, podcast_feed.cover_art_url from episode join podcast_feed on podcast_feed.id = episode.feed_id where episode.feed_id = ?;",
+            (user_id, feed_id),
+        )
+        self._execute(
+            f"{RECOUNT_SUBSCRIPTIONS} where user_id = ? and feed_id = ?;",
+            (user_id, feed_id),
+        )
+
+    def recount_subscriptions(self) -> None:
+        with self.connection:
+            self._execute(f"{FLAG_FINISHED_LISTENS};")
+            self._execute(f"{RECOUNT_SUBSCRIPTIONS};")
+
+    def subscribe_to_feeds(
+        self, user_id: str, existing_feed_ids: list[str], new_feeds: list[Feed]
+    ) -> list[Feed]:
+        """Creates the new feeds and every subscription in a single transaction.
+
+        Returns the new feeds actually created, a concurrent import may have
+        created some of them first, they are subscribed to like known feeds.
+        """
+        with self.connection:
+            self._executemany(
+                "insert into podcast_feed (id, feed_url, cover_art_url, title) values (?,?,?,?) on conflict(feed_url) do nothing;",
+                [(f.id, f.url, f.cover_art_url, f.title) for f in new_feeds],
+            )
+            saved_ids = {
+                feed.url: feed.id
+                for feed in self.get_feeds_by_urls([f.url for f in new_feeds])
+            }
+            created = [f for f in new_feeds if saved_ids[f.url] == f.id]
+            known_feed_ids = existing_feed_ids + [
+                saved_ids[f.url] for f in new_feeds if saved_ids[f.url] != f.id
+            ]
+            self._executemany(
+                "insert or ignore into subscription (user_id, feed_id) values (?,?);",
+                [(user_id, feed_id) for feed_id in known_feed_ids]
+                + [(user_id, feed.id) for feed in created],
+            )
+            for feed_id in known_feed_ids:
+                self._add_feed_to_timeline(user_id=user_id, feed_id=feed_id)
+        return created
+
     def find_subscriptions(self, user_id: str) -> list[Subscription]:
-        cursor = self.connection.cursor()
-        cursor.execute(
+        result = self._fetchall(
             "SELECT feed_id FROM subscription WHERE user_id = ?;", (user_id,)
         )
-        result = cursor.fetchall()
         return [Subscription(user_id=user_id, feed_id=row[0]) for row in result]
 
     def save_podcast_feed(
         self, feed_id: str, feed_url: str, cover_art_url: str, title: str
-    ) -> None:
-        cursor = self.connection.cursor()
-        cursor.execute(
-            "insert into podcast_feed (id, feed_url, cover_art_url, title) values (?,?,?,?);",
+    ) -> str:
+        """The id of the feed saved under feed_url, feed_id unless another
+        subscription saved it first."""
+        self._execute(
+            "insert into podcast_feed (id, feed_url, cover_art_url, title) values (?,?,?,?) on conflict(feed_url) do nothing;",
             (
                 feed_id,
                 feed_url,
@@ -73,12 +331,27 @@ class Datastore:
             ),
         )
         self.connection.commit()
+        row = self._fetchone(
+            "select id from podcast_feed where feed_url = ?;", (feed_url,)
+        )
+        assert row is not None
+        return row[0]
+
+    def get_feed_etag(self, feed_id: str) -> Optional[str]:
+        row = self._fetchone("select etag from podcast_feed where id = ?;", (feed_id,))
+        return row[0] if row is not None else None
+
+    def save_feed_etag(self, feed_id: str, etag: Optional[str]) -> None:
+        with self.connection:
+            self._execute(
+                "update podcast_feed set etag = ? where id = ? and etag is not ?;",
+                (etag, feed_id, etag),
+            )
 
     def update_podcast_feed(
         self, feed_id: str, feed_url: str, cover_art_url: str, title: str
     ) -> None:
-        cursor = self.connection.cursor()
-        cursor.execute(
+        self._execute(
             "update podcast_feed set feed_url = ?, cover_art_url = ?, title = ? where id = ?;",
             (
                 feed_url,
@@ -87,10 +360,13 @@ class Datastore:
                 feed_id,
             ),
         )
+        self._execute(
+            "update timeline set cover_art_url = ? where feed_id = ? and cover_art_url is not ?;",
+            (cover_art_url, feed_id, cover_art_url),
+        )
         self.connection.commit()
 
     def save_episodes(self, feed_id: str, episodes: list[EpisodeAssets]) -> str:
-        cursor = self.connection.cursor()
         episodes_data = [
             (
                 str(uuid4()),
@@ -103,10 +379,32 @@ class Datastore:
             )
             for ep in episodes
         ]
-        cursor.executemany(
+        self._executemany(
             "INSERT INTO episode (episode_id, title, description, download_link, published_date, feed_id, length) values (?,?,?,?,?,?,?)",
             episodes_data,
         )
+        # fan out to the timeline of every current subscriber
+        subscribers = self._fetchall(
+            "select subscription.user_id, podcast_feed.cover_art_url from subscription join podcast_feed on podcast_feed.id = subscription.feed_id where subscription.feed_id = ?;",
+            (feed_id,),
+        )
+        self._executemany(
+            "insert or ignore into timeline (user_id, episode_id, feed_id, published_date, cover_art_url) values (?,?,?,?,?);",
+            [
+                (user_id, episode[0], feed_id, episode[4], cover_art_url)
+                for user_id, cover_art_url in subscribers
+                for episode in episodes_data
+            ],
+        )
+        if episodes_data:
+            self._execute(
+                "update subscription set unplayed_count = unplayed_count + ?, latest_episode_date = max(coalesce(latest_episode_date, 0), ?) where feed_id = ?;",
+                (
+                    len(episodes_data),
+                    max(episode[4] for episode in episodes_data),
+                    feed_id,
+                ),
+            )
         self.connection.commit()
         return feed_id
 
@@ -119,9 +417,8 @@ class Datastore:
         chronological: bool,
     ) -> list[PlayInfo]:
         order = "asc" if chronological else "desc"
-        cursor = self.connection.cursor()
-        cursor.execute(
-            f"SELECT episode.episode_id, episode.feed_id, episode.title, episode.description, episode.download_link, episode.published_date, episode.length, podcast_feed.cover_art_url, previous_listen.seconds, previous_listen.time FROM episode JOIN subscription ON episode.feed_id = subscription.feed_id join podcast_feed on podcast_feed.id = subscription.feed_id LEFT JOIN previous_listen on episode.episode_id = previous_listen.episode_id AND previous_listen.user_id = ? WHERE subscription.user_id = ? AND episode.feed_id = ? ORDER BY episode.published_date {order} LIMIT ? OFFSET ?;",
+        rows = self._fetchall(
+            f"SELECT {EPISODE_COLUMNS}, podcast_feed.cover_art_url, {LISTEN_COLUMNS} FROM episode JOIN subscription ON episode.feed_id = subscription.feed_id join podcast_feed on podcast_feed.id = subscription.feed_id LEFT JOIN previous_listen on episode.episode_id = previous_listen.episode_id AND previous_listen.user_id = ? WHERE subscription.user_id = ? AND episode.feed_id = ? ORDER BY episode.published_date {order} LIMIT ? OFFSET ?;",
             (
                 user_id,
                 user_id,
@@ -130,34 +427,7 @@ class Datastore:
                 number_of_episodes * (page - 1),
             ),
         )
-        result = cursor.fetchall()
-        episodes: list[PlayInfo] = []
-        for row in result:
-            if row[7] is None or row[8] is None:
-                previous_listen = None
-            else:
-                previous_listen = PreviousListen(
-                    time_listened=row[8],
-                    time=datetime.fromtimestamp(row[9]),
-                )
-            episodes.append(
-                PlayInfo(
-                    previous_listen=previous_listen,
-                    episode=Episode(
-                        id=row[0],
-                        feed_id=row[1],
-                        assets=EpisodeAssets(
-                            title=row[2],
-                            description=row[3],
-                            download_link=row[4],
-                            published_date=datetime.fromtimestamp(row[5]),
-                            length=row[6],
-                        ),
-                        cover_art_url=row[7],
-                    ),
-                )
-            )
-        return episodes
+        return [play_info(row) for row in rows]
 
     def get_user_home_feed(
         self,
@@ -169,18 +439,16 @@ class Datastore:
         chronological: bool,
     ) -> list[PlayInfo]:
         order = "asc" if chronological else "desc"
-        cursor = self.connection.cursor()
         if not search:
-            cursor.execute(
-                f"SELECT episode.episode_id, episode.feed_id, episode.title, episode.description, episode.download_link, episode.published_date, episode.length, podcast_feed.cover_art_url, previous_listen.seconds, previous_listen.time FROM episode JOIN subscription ON episode.feed_id = subscription.feed_id join podcast_feed on podcast_feed.id = subscription.feed_id LEFT JOIN previous_listen on episode.episode_id = previous_listen.episode_id AND previous_listen.user_id = ? WHERE subscription.user_id = ? ORDER BY episode.published_date {order} LIMIT ? OFFSET ?;",
-                (user_id, user_id, number_of_episodes, number_of_episodes * (page - 1)),
+            rows = self._fetchall(
+                f"SELECT {EPISODE_COLUMNS}, timeline.cover_art_url, {LISTEN_COLUMNS} FROM timeline JOIN episode ON episode.episode_id = timeline.episode_id LEFT JOIN previous_listen on previous_listen.episode_id = timeline.episode_id AND previous_listen.user_id = timeline.user_id WHERE timeline.user_id = ? ORDER BY timeline.published_date {order} LIMIT ? OFFSET ?;",
+                (user_id, number_of_episodes, number_of_episodes * (page - 1)),
             )
         else:
             formatted_search = f"%{search}%"
-            cursor.execute(
-                f"SELECT episode.episode_id, episode.feed_id, episode.title, episode.description, episode.download_link, episode.published_date, episode.length, podcast_feed.cover_art_url, previous_listen.seconds, previous_listen.time FROM episode JOIN subscription ON episode.feed_id = subscription.feed_id join podcast_feed on podcast_feed.id = subscription.feed_id LEFT JOIN previous_listen on episode.episode_id = previous_listen.episode_id AND previous_listen.user_id = ? WHERE subscription.user_id = ? AND (episode.description LIKE ? OR episode.title LIKE ?) ORDER BY episode.published_date {order} LIMIT ? OFFSET ?;",
+            rows = self._fetchall(
+                f"SELECT {EPISODE_COLUMNS}, timeline.cover_art_url, {LISTEN_COLUMNS} FROM timeline JOIN episode ON episode.episode_id = timeline.episode_id LEFT JOIN previous_listen on previous_listen.episode_id = timeline.episode_id AND previous_listen.user_id = timeline.user_id WHERE timeline.user_id = ? AND (episode.description LIKE ? OR episode.title LIKE ?) ORDER BY timeline.published_date {order} LIMIT ? OFFSET ?;",
                 (
-                    user_id,
                     user_id,
                     formatted_search,
                     formatted_search,
@@ -188,33 +456,7 @@ class Datastore:
                     number_of_episodes * (page - 1),
                 ),
             )
-        result = cursor.fetchall()
-        episodes: list[PlayInfo] = []
-        for row in result:
-            if row[8] is None or row[9] is None:
-                previous_listen = None
-            else:
-                previous_listen = PreviousListen(
-                    time_listened=row[8],
-                    time=datetime.fromtimestamp(row[9]),
-                )
-            episodes.append(
-                PlayInfo(
-                    previous_listen=previous_listen,
-                    episode=Episode(
-                        id=row[0],
-                        feed_id=row[1],
-                        assets=EpisodeAssets(
-                            title=row[2],
-                            description=row[3],
-                            download_link=row[4],
-                            published_date=datetime.fromtimestamp(row[5]),
-                            length=row[6],
-                        ),
-                        cover_art_url=row[7],
-                    ),
-                )
-            )
+        episodes = [play_info(row) for row in rows]
         if not include_finished:
             episodes = [
                 ep
@@ -224,159 +466,526 @@ class Datastore:
                     ep.episode.assets.length is not None
                     and ep.episode.assets.length
                     - ep.previous_listen.time_listened.seconds
-                    >= 20
+                    >= FINISHED_MARGIN_SECONDS
                 )
             ]
         return episodes
 
     def get_episode(self, episode_id: str, user_id: str) -> Episode:
-        cursor = self.connection.cursor()
-        cursor.execute(
-            "select episode.title, episode.feed_id, description, download_link, published_date, length, podcast_feed.cover_art_url from episode join podcast_feed on podcast_feed.id = episode.feed_id join subscription on subscription.feed_id = podcast_feed.id where episode_id = ? and subscription.user_id = ?;",
+        row = self._fetchone(
+            f"select {EPISODE_COLUMNS}, podcast_feed.cover_art_url from episode join podcast_feed on podcast_feed.id = episode.feed_id join subscription on subscription.feed_id = podcast_feed.id where episode.episode_id = ? and subscription.user_id = ?;",
             (
                 episode_id,
                 user_id,
             ),
         )
-        result = cursor.fetchone()
-        if result is None:
+        if row is None:
             raise EpisodeNotFound
-
-        assets = EpisodeAssets(
-            title=result[0],
-            description=result[2],
-            download_link=result[3],
-            published_date=datetime.fromtimestamp(result[4]),
-            length=result[5],
-        )
-        return Episode(
-            id=episode_id, feed_id=result[1], assets=assets, cover_art_url=result[6]
-        )
+        return episode(row)
 
     def set_current_time(
         self, episode_id: str, user_id: str, seconds: int, time: datetime
     ) -> None:
-        cursor = self.connection.cursor()
         time_timestamp = time.timestamp()
-        cursor.execute(
-            "insert into previous_listen (episode_id, user_id, seconds, time) values (?,?,?,?) on conflict(episode_id, user_id) do update set seconds=?, time=?",
-            (episode_id, user_id, seconds, time_timestamp, seconds, time_timestamp),
+        current = self._fetchone(
+            "select episode.feed_id, episode.length, previous_listen.seconds, previous_listen.time from episode left join previous_listen on previous_listen.episode_id = episode.episode_id and previous_listen.user_id = ? where episode.episode_id = ?;",
+            (user_id, episode_id),
+        )
+        if current is None and self.restore_archived_episode(episode_id):
+            current = self._fetchone(
+                "select episode.feed_id, episode.length, previous_listen.seconds, previous_listen.time from episode left join previous_listen on previous_listen.episode_id = episode.episode_id and previous_listen.user_id = ? where episode.episode_id = ?;",
+                (user_id, episode_id),
+            )
+        length = None if current is None else current[1]
+        new_state = listen_state(length, seconds)
+        self._execute(
+            "insert into previous_listen (episode_id, user_id, seconds, time, finished) values (?,?,?,?,?) on conflict(episode_id, user_id) do update set seconds=excluded.seconds, time=excluded.time, finished=excluded.finished",
+            (episode_id, user_id, seconds, time_timestamp, new_state == "finished"),
         )
+        if current is not None:
+            feed_id, length, previous_seconds, previous_time = current
+            listened = seconds - (previous_seconds or 0)
+            if previous_time is not None:
+                listened = min(
+                    listened, int((time_timestamp - previous_time) * MAX_PLAYBACK_RATE)
+                )
+            if listened > 0:
+                self._execute(
+                    "insert into listening_day (user_id, day, feed_id, seconds) values (?,?,?,?) on conflict(user_id, day, feed_id) do update set seconds = seconds + excluded.seconds;",
+                    (user_id, time.date().isoformat(), feed_id, listened),
+                )
+            previous_state = listen_state(length, previous_seconds)
+            if previous_state != new_state:
+                counter_changes = {"unplayed": 0, "in_progress": 0, "finished": 0}
+                counter_changes[previous_state] -= 1
+                counter_changes[new_state] += 1
+                self._execute(
+                    "update subscription set unplayed_count = unplayed_count + ?, in_progress_count = in_progress_count + ? where user_id = ? and feed_id = ?;",
+                    (
+                        counter_changes["unplayed"],
+                        counter_changes["in_progress"],
+                        user_id,
+                        feed_id,
+                    ),
+                )
         self.connection.commit()
 
     def get_previous_listen(
         self, user_id: str, episode_id: str
     ) -> Optional[PreviousListen]:
-        cursor = self.connection.cursor()
-        cursor.execute(
-            "select seconds, time from previous_listen where user_id = ? and episode_id = ?;",
+        row = self._fetchone(
+            f"select {LISTEN_COLUMNS} from previous_listen where user_id = ? and episode_id = ?;",
             (user_id, episode_id),
         )
-        result = cursor.fetchone()
-        if result is None:
+        if row is None:
             return None
-        return PreviousListen(
-            time_listened=result[0],
-            time=datetime.fromtimestamp(result[1]),
-        )
+        return previous_listen(*row)
 
     def get_latest_listen_play_info(self, user_id: str) -> Optional[PlayInfo]:
-        cursor = self.connection.cursor()
-        cursor.execute(
-            "select episode.episode_id, episode.feed_id, episode.title, episode.description, episode.download_link, episode.published_date, episode.length, previous_listen.seconds, previous_listen.time, podcast_feed.cover_art_url from previous_listen join episode on previous_listen.episode_id = episode.episode_id join podcast_feed on podcast_feed.id = episode.feed_id where previous_listen.user_id = ? order by previous_listen.time desc limit 1;",
+        row = self._fetchone(
+            f"select {EPISODE_COLUMNS}, podcast_feed.cover_art_url, {LISTEN_COLUMNS} from previous_listen join episode on previous_listen.episode_id = episode.episode_id join podcast_feed on podcast_feed.id = episode.feed_id where previous_listen.user_id = ? order by previous_listen.time desc limit 1;",
             (user_id,),
         )
-        result = cursor.fetchone()
-        if result is None:
-            return None
+        return None if row is None else play_info(row)
 
-        play_info = PlayInfo(
-            episode=Episode(
-                id=result[0],
-                feed_id=result[1],
-                assets=EpisodeAssets(
-                    title=result[2],
-                    description=result[3],
-                    download_link=result[4],
-                    published_date=datetime.fromtimestamp(result[5]),
-                    length=result[6],
-                ),
-                cover_art_url=result[9],
-            ),
-            previous_listen=PreviousListen(
-                time_listened=result[7],
-                time=datetime.fromtimestamp(result[8]),
-            ),
+    def get_in_progress_play_infos(self, user_id: str, limit: int) -> list[PlayInfo]:
+        # the planner cannot tell the partial index is the smaller one
+        rows = self._fetchall(
+            f"select {EPISODE_COLUMNS}, podcast_feed.cover_art_url, {LISTEN_COLUMNS} from previous_listen indexed by previous_listen_in_progress join episode on previous_listen.episode_id = episode.episode_id join podcast_feed on podcast_feed.id = episode.feed_id where previous_listen.user_id = ? and previous_listen.finished = 0 order by previous_listen.time desc limit ?;",
+            (user_id, limit),
         )
-        return play_info
+        return [play_info(row) for row in rows]
 
     def get_user_subscribed_feeds(self, user_id) -> list[Feed]:
-        cursor = self.connection.cursor()
-        cursor.execute(
-            "select podcast_feed.id, podcast_feed.feed_url, podcast_feed.cover_art_url, podcast_feed.title from subscription join podcast_feed on subscription.feed_id = podcast_feed.id where user_id = ?;",
+        result = self._fetchall(
+            "select podcast_feed.id, podcast_feed.feed_url, podcast_feed.cover_art_url, podcast_feed.title, subscription.unplayed_count, subscription.in_progress_count, subscription.latest_episode_date from subscription join podcast_feed on subscription.feed_id = podcast_feed.id where user_id = ?;",
             (user_id,),
         )
-        result = cursor.fetchall()
         feeds = [
-            Feed(id=row[0], url=row[1], cover_art_url=row[2], title=row[3])
+            Feed(
+                id=row[0],
+                url=row[1],
+                cover_art_url=row[2],
+                title=row[3],
+                unplayed_count=row[4],
+                in_progress_count=row[5],
+                latest_episode_date=None
+                if row[6] is None
+                else datetime.fromtimestamp(row[6]),
+            )
             for row in result
         ]
         return feeds
 
     def get_all_feeds(self) -> list[Feed]:
-        cursor = self.connection.cursor()
-        cursor.execute("select id, feed_url, cover_art_url, title from podcast_feed; ")
-        result = cursor.fetchall()
+        result = self._fetchall(
+            "select id, feed_url, cover_art_url, title from podcast_feed; "
+        )
         feeds = [
             Feed(id=row[0], url=row[1], cover_art_url=row[2], title=row[3])
             for row in result
         ]
         return feeds
 
+    def get_feeds_by_urls(self, feed_urls: list[str]) -> list[Feed]:
+        feeds: list[Feed] = []
+        # stays well under the default limit of bound parameters
+        for start in range(0, len(feed_urls), 500):
+            batch = feed_urls[start : start + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = self._fetchall(
+                f"select id, feed_url, cover_art_url, title from podcast_feed where feed_url in ({placeholders});",
+                batch,
+            )
+            feeds.extend(
+                Feed(id=row[0], url=row[1], cover_art_url=row[2], title=row[3])
+                for row in rows
+            )
+        return feeds
+
     def get_latest_episode(self, feed_id: str) -> Episode:
-        cursor = self.connection.cursor()
-        cursor.execute(
-            "select episode_id, episode.feed_id, episode.title, description ,download_link, published_date, length, podcast_feed.cover_art_url from episode join podcast_feed on episode.feed_id = podcast_feed.id where feed_id = ? order by published_date desc limit 1;",
+        row = self._fetchone(
+            f"select {EPISODE_COLUMNS}, podcast_feed.cover_art_url from episode join podcast_feed on episode.feed_id = podcast_feed.id where feed_id = ? order by published_date desc limit 1;",
             (feed_id,),
         )
-        result = cursor.fetchone()
-        if result is None:
+        if row is None:
             raise EpisodeNotFound
-        episode = Episode(
-            id=result[0],
-            feed_id=result[1],
-            assets=EpisodeAssets(
-                title=result[2],
-                description=result[3],
-                download_link=result[4],
-                published_date=datetime.fromtimestamp(result[5]),
-                length=result[6],
-            ),
-            cover_art_url=result[7],
-        )
-        return episode
+        return episode(row)
 
     def update_lengths(self, updated_assets: list[EpisodeAssets], feed_id: str) -> None:
-        cursor = self.connection.cursor()
-        updates = [(asset.length, asset.title, feed_id) for asset in updated_assets]
-        cursor.executemany(
-            "update episode set length = ? where title = ? and feed_id = ?;",
+        updates = [
+            (asset.length, asset.title, feed_id, asset.length)
+            for asset in updated_assets
+        ]
+        cursor = self._executemany(
+            "update episode set length = ? where title = ? and feed_id = ? and length is not ?;",
             updates,
         )
+        if cursor.rowcount > 0:
+            # a new length can move listened episodes between in progress and finished
+            self._execute(
+                f"{FLAG_FINISHED_LISTENS} where episode_id in (select episode_id from episode where feed_id = ?);",
+                (feed_id,),
+            )
+            self._execute(f"{RECOUNT_SUBSCRIPTIONS} where feed_id = ?;", (feed_id,))
         self.connection.commit()
 
     def update_links(self, updated_assets: list[EpisodeAssets], feed_id: str) -> None:
-        cursor = self.connection.cursor()
         updates = [
             (
                 asset.download_link,
                 asset.title,
                 feed_id,
+                asset.download_link,
             )
             for asset in updated_assets
         ]
-        cursor.executemany(
-            "update episode set download_link = ? where title = ? and feed_id = ?;",
+        self._executemany(
+            "update episode set download_link = ? where title = ? and feed_id = ? and download_link is not ?;",
             updates,
         )
         self.connection.commit()
+
+    def rebuild_timeline(self) -> int:
+        with self.connection:
+            self._execute("delete from timeline;")
+            cursor = self._execute(
+                "insert into timeline (user_id, episode_id, feed_id, published_date, cover_art_url) select subscription.user_id, episode.episode_id, episode.feed_id, episode.published_date, podcast_feed.cover_art_url from subscription join episode on episode.feed_id = subscription.feed_id join podcast_feed on podcast_feed.id = subscription.feed_id;"
+            )
+        return cursor.rowcount
+
+    def check_timeline(self) -> TimelineReport:
+        expected = "select subscription.user_id, episode.episode_id, episode.feed_id, episode.published_date, podcast_feed.cover_art_url from subscription join episode on episode.feed_id = subscription.feed_id join podcast_feed on podcast_feed.id = subscription.feed_id"
+        actual = "select user_id, episode_id, feed_id, published_date, cover_art_url from timeline"
+        missing = self._fetchscalar(
+            f"select count(*) from ({expected} except {actual});"
+        )
+        unexpected = self._fetchscalar(
+            f"select count(*) from ({actual} except {expected});"
+        )
+        return TimelineReport(missing=missing, unexpected=unexpected)
+
+    def get_listening_by_day(self, user_id: str, since: date) -> list[tuple[date, int]]:
+        rows = self._fetchall(
+            "select day, sum(seconds) from listening_day where user_id = ? and day >= ? group by day order by day;",
+            (user_id, since.isoformat()),
+        )
+        return [(date.fromisoformat(row[0]), row[1]) for row in rows]
+
+    def get_listening_by_feed(
+        self, user_id: str, since: date
+    ) -> list[tuple[str, str, int]]:
+        rows = self._fetchall(
+            "select listening_day.feed_id, podcast_feed.title, sum(listening_day.seconds) as total from listening_day join podcast_feed on podcast_feed.id = listening_day.feed_id where listening_day.user_id = ? and listening_day.day >= ? group by listening_day.feed_id order by total desc;",
+            (user_id, since.isoformat()),
+        )
+        return [(row[0], row[1], row[2]) for row in rows]
+
+    def backfill_listening_stats(self) -> int:
+        """Seeds the rollups of users who have none from their listen history.
+
+        Only the last position of each listen is known, so all of it is
+        attributed to the day of the last update.
+        """
+        with self.connection:
+            cursor = self._execute(
+                "insert into listening_day (user_id, day, feed_id, seconds) select previous_listen.user_id, date(previous_listen.time, 'unixepoch', 'localtime'), episode.feed_id, sum(previous_listen.seconds) from previous_listen join episode on episode.episode_id = previous_listen.episode_id where previous_listen.time is not null and previous_listen.user_id not in (select distinct user_id from listening_day) group by 1, 2, 3;"
+            )
+        return cursor.rowcount
+
+    def acquire_lease(self, name: str, holder: str, seconds: float) -> bool:
+        """Takes or extends the named lease unless another holder's is still valid."""
+        now = time.time()
+        with self.connection:
+            cursor = self._execute(
+                "insert into lease (name, holder, expires_at) values (?, ?, ?) on conflict (name) do update set holder = excluded.holder, expires_at = excluded.expires_at where lease.holder = excluded.holder or lease.expires_at < ?;",
+                (name, holder, now + seconds, now),
+            )
+        return cursor.rowcount == 1
+
+    def release_lease(self, name: str, holder: str) -> None:
+        with self.connection:
+            self._execute(
+                "delete from lease where name = ? and holder = ?;", (name, holder)
+            )
+
+    def save_refresh_run(
+        self,
+        job_id: str,
+        holder: str,
+        started_at: float,
+        finished_at: float,
+        processed: int,
+        failed: int,
+        lag_seconds: Optional[float],
+    ) -> None:
+        with self.connection:
+            self._execute(
+                "insert into refresh_status (job_id, holder, started_at, finished_at, processed, failed, lag_seconds) values (?, ?, ?, ?, ?, ?, ?) on conflict (job_id) do update set holder = excluded.holder, started_at = excluded.started_at, finished_at = excluded.finished_at, processed = excluded.processed, failed = excluded.failed, lag_seconds = excluded.lag_seconds;",
+                (
+                    job_id,
+                    holder,
+                    started_at,
+                    finished_at,
+                    processed,
+                    failed,
+                    lag_seconds,
+                ),
+            )
+
+    def count_skipped_refresh(self, job_id: str) -> None:
+        with self.connection:
+            self._execute(
+                "insert into refresh_status (job_id, skipped) values (?, 1) on conflict (job_id) do update set skipped = skipped + 1;",
+                (job_id,),
+            )
+
+    def get_refresh_status(self, job_id: str) -> Optional[RefreshStatus]:
+        row = self._fetchone(
+            "select job_id, holder, started_at, finished_at, processed, failed, lag_seconds, skipped from refresh_status where job_id = ?;",
+            (job_id,),
+        )
+        return None if row is None else RefreshStatus(*row)
+
+    def archive_episodes(
+        self, published_before: datetime, keep_latest: int
+    ) -> ArchiveReport:
+        """Moves episodes nobody listened to out of episode and timeline.
+
+        The keep_latest newest episodes of each feed stay whatever their age.
+        """
+        hot_bytes_before = self.hot_bytes()
+        archived_at = time.time()
+        with self.connection:
+            cursor = self._execute(
+                "insert into episode_archive (episode_id, title, description, download_link, published_date, feed_id, length, archived_at) select episode_id, title, description, download_link, published_date, feed_id, length, ? from (select *, row_number() over (partition by feed_id order by published_date desc) as newest from episode) as ranked where newest > ? and published_date < ? and not exists (select 1 from previous_listen where previous_listen.episode_id = ranked.episode_id);",
+                (archived_at, keep_latest, published_before.timestamp()),
+            )
+            archived = cursor.rowcount
+            self._execute(
+                "delete from timeline where episode_id in (select episode_id from episode_archive where archived_at = ?);",
+                (archived_at,),
+            )
+            self._execute(
+                "delete from episode where episode_id in (select episode_id from episode_archive where archived_at = ?);",
+                (archived_at,),
+            )
+        return ArchiveReport(
+            archived=archived,
+            hot_bytes_before=hot_bytes_before,
+            hot_bytes_after=self.hot_bytes(),
+        )
+
+    def is_episode_archived(self, episode_id: str) -> bool:
+        return (
+            self._fetchone(
+                "select 1 from episode_archive where episode_id = ?;", (episode_id,)
+            )
+            is not None
+        )
+
+    def restore_archived_episode(self, episode_id: str) -> bool:
+        return (
+            self._restore_archived("episode_archive.episode_id = ?", (episode_id,)) > 0
+        )
+
+    def archived_feed_needed(
+        self, feed_id: str, rows: int, chronological: bool
+    ) -> bool:
+        """Whether restore_archived_feed has episodes to restore."""
+        needed = self._archived_needed(*FEED_EPISODES, (feed_id,), rows, chronological)
+        return needed is not None
+
+    def restore_archived_feed(
+        self, feed_id: str, rows: int, chronological: bool
+    ) -> int:
+        """Restores the archived episodes belonging in the first rows of the
+        feed, see _archived_needed."""
+        return self._restore_needed(
+            self._archived_needed(*FEED_EPISODES, (feed_id,), rows, chronological)
+        )
+
+    def archived_subscriptions_needed(
+        self, user_id: str, rows: int, chronological: bool
+    ) -> bool:
+        """Whether restore_archived_subscriptions has episodes to restore."""
+        needed = self._archived_needed(
+            *SUBSCRIBED_EPISODES, (user_id,), rows, chronological
+        )
+        return needed is not None
+
+    def restore_archived_subscriptions(
+        self, user_id: str, rows: int, chronological: bool
+    ) -> int:
+        """Restores the archived episodes belonging in the first rows of the
+        user's timeline, see _archived_needed."""
+        return self._restore_needed(
+            self._archived_needed(*SUBSCRIBED_EPISODES, (user_id,), rows, chronological)
+        )
+
+    def _archived_needed(
+        self,
+        hot: str,
+        archived: str,
+        parameters: Parameters,
+        rows: int,
+        chronological: bool,
+    ) -> Optional[tuple[str, Parameters]]:
+        """The query of the archived episodes that would sort among the first
+        rows, None when there are none.
+
+        Those are the ones past the last of the first rows still hot, or any
+        while fewer rows are hot. At most rows episodes are restored, and
+        nothing is written while the hot rows cover the page.
+        """
+        order, past = ("asc", "<") if chronological else ("desc", ">")
+        boundary = self._fetchone(
+            f"select published_date from ({hot}) order by published_date {order} limit 1 offset ?;",
+            (*parameters, rows - 1),
+        )
+        if boundary is None:
+            needed = f"select episode_id from ({archived}) order by published_date {order}, episode_id limit ?"
+            needed_parameters = (*parameters, rows)
+        else:
+            needed = f"select episode_id from ({archived}) where published_date {past} ? order by published_date {order}, episode_id limit ?"
+            needed_parameters = (*parameters, boundary[0], rows)
+        if self._fetchone(f"{needed};", needed_parameters) is None:
+            return None
+        return needed, needed_parameters
+
+    def _restore_needed(self, needed: Optional[tuple[str, Parameters]]) -> int:
+        if needed is None:
+            return 0
+        query, parameters = needed
+        return self._restore_archived(
+            f"episode_archive.episode_id in ({query})", parameters
+        )
+
+    def _restore_archived(self, condition: str, parameters: Parameters) -> int:
+        """Moves archived episodes back, into the timeline of every subscriber."""
+        with self.connection:
+            cursor = self._execute(
+                f"insert into episode (episode_id, title, description, download_link, published_date, feed_id, length) select episode_id, title, description, download_link, published_date, feed_id, length from episode_archive where {condition};",
+                parameters,
+            )
+            restored = cursor.rowcount
+            if restored > 0:
+                self._execute(
+                    f"insert or ignore into timeline (user_id, episode_id, feed_id, published_date, cover_art_url) select subscription.user_id, episode_archive.episode_id, episode_archive.feed_id, episode_archive.published_date, podcast_feed.cover_art_url from episode_archive join subscription on subscription.feed_id = episode_archive.feed_id join podcast_feed on podcast_feed.id = episode_archive.feed_id where {condition};",
+                    parameters,
+                )
+                self._execute(
+                    f"delete from episode_archive where {condition};", parameters
+                )
+        return restored
+
+    def hot_bytes(self) -> Optional[int]:
+        placeholders = ",".join("?" * len(HOT_TABLES))
+        try:
+            used = self._fetchscalar(
+                f"select sum(pgsize - unused) from dbstat where name in (select name from sqlite_master where tbl_name in ({placeholders}));",
+                HOT_TABLES,
+            )
+        except sqlite3.OperationalError:
+            # sqlite built without SQLITE_ENABLE_DBSTAT_VTAB
+            return None
+        return used or 0
+
+    def publish_user_event(self, user_id: str, kind: str, data: str) -> None:
+        with self.connection:
+            self._execute(
+                "insert into event (user_id, kind, data, created_at) values (?, ?, ?, ?);",
+                (user_id, kind, data, time.time()),
+            )
+
+    def publish_feed_event(self, feed_id: str, kind: str, data: str) -> None:
+        """Publishes the event to every subscriber of the feed."""
+        with self.connection:
+            self._execute(
+                "insert into event (user_id, kind, data, created_at) select user_id, ?, ?, ? from subscription where feed_id = ?;",
+                (kind, data, time.time(), feed_id),
+            )
+
+    def get_latest_event_id(self) -> int:
+        return self._fetchscalar("select coalesce(max(id), 0) from event;")
+
+    def get_events_after(self, event_id: int) -> list[Event]:
+        rows = self._fetchall(
+            "select id, user_id, kind, data from event where id > ? order by id limit ?;",
+            (event_id, EVENTS_PER_POLL),
+        )
+        return [Event(*row) for row in rows]
+
+    def get_user_events_after(self, user_id: str, event_id: int) -> list[Event]:
+        rows = self._fetchall(
+            "select id, user_id, kind, data from event where user_id = ? and id > ? order by id;",
+            (user_id, event_id),
+        )
+        return [Event(*row) for row in rows]
+
+    def prune_events(self, created_before: float) -> int:
+        with self.connection:
+            cursor = self._execute(
+                "delete from event where created_at < ?;", (created_before,)
+            )
+        return cursor.rowcount
+
+    def cover_art_is_due(self, url: str, retry_before: float) -> bool:
+        """Whether the url was never fetched, or failed before retry_before."""
+        row = self._fetchone(
+            "select digest, fetched_at from cover_art where url = ?;", (url,)
+        )
+        return row is None or (row[0] is None and row[1] < retry_before)
+
+    def save_cover_art(
+        self, url: str, digest: Optional[str], fetched_at: float
+    ) -> None:
+        with self.connection:
+            self._execute(
+                "insert into cover_art (url, digest, fetched_at) values (?,?,?) on conflict(url) do update set digest=excluded.digest, fetched_at=excluded.fetched_at;",
+                (url, digest, fetched_at),
+            )
+
+    def get_cover_art_digest(self, url: str) -> Optional[str]:
+        """None when the cover art could not be fetched."""
+        row = self._fetchone("select digest from cover_art where url = ?;", (url,))
+        if row is None:
+            raise CoverArtNotFound
+        return row[0]
+
+    def save_opml_import(self, progress: ImportProgress) -> None:
+        now = time.time()
+        with self.connection:
+            self._execute(
+                "delete from opml_import where created_at < ?;",
+                (now - OPML_IMPORT_RETENTION_SECONDS,),
+            )
+            self._execute(
+                "insert into opml_import (id, user_id, total, fetched, failed, created_at) values (?,?,?,?,?,?);",
+                (
+                    progress.id,
+                    progress.user_id,
+                    progress.total,
+                    progress.fetched,
+                    progress.failed,
+                    now,
+                ),
+            )
+
+    def update_opml_import(self, progress: ImportProgress) -> None:
+        with self.connection:
+            self._execute(
+                "update opml_import set fetched = ?, failed = ? where id = ?;",
+                (progress.fetched, progress.failed, progress.id),
+            )
+
+    def get_opml_import(self, import_id: str) -> Optional[ImportProgress]:
+        row = self._fetchone(
+            "select id, user_id, total, fetched, failed from opml_import where id = ?;",
+            (import_id,),
+        )
+        if row is None:
+            return None
+        return ImportProgress(
+            id=row[0], user_id=row[1], total=row[2], fetched=row[3], failed=row[4]
+        )
@@ -0,0 +1,151 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Optional
+
+from business.rss import DownloadStats, FetchedFeed
+
+DEFAULT_ARCHIVE_MAX_BYTES = 256 * 1024 * 1024
+
+
+class FeedArchive:
+    """Content-addressed store of the last raw body fetched for each feed.
+
+    Bodies are zlib-compressed and stored once per distinct content, so feeds
+    that did not change between refreshes cost nothing extra. When the
+    compressed total goes over max_bytes the least recently used bodies are
+    evicted along with the feeds pointing to them.
+    """
+
+    def __init__(
+        self, directory: Path, max_bytes: int = DEFAULT_ARCHIVE_MAX_BYTES
+    ) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.objects_dir = directory / "objects"
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            directory / "index.db", check_same_thread=False, timeout=30
+        )
+        with self.connection:
+            self.connection.executescript("""
+                create table if not exists blob (
+                    digest text not null primary key,
+                    size integer not null,
+                    last_used real not null
+                );
+                create index if not exists blob_last_used on blob(last_used);
+                create table if not exists feed (
+                    feed_url text not null primary key,
+                    final_url text not null,
+                    content_type text,
+                    digest text not null references blob(digest)
+                );
+                create index if not exists feed_digest on feed(digest);
+            """)
+
+    def _blob_path(self, digest: str) -> Path:
+        return self.objects_dir / digest[:2] / f"{digest}.z"
+
+    def put(self, feed_url: str, fetched: FetchedFeed) -> str:
+        digest = hashlib.sha256(fetched.body).hexdigest()
+        path = self._blob_path(digest)
+        with self.lock, self.connection:
+            known = self.connection.execute(
+                "select 1 from blob where digest = ?;", (digest,)
+            ).fetchone()
+            if known is None:
+                compressed = zlib.compress(fetched.body, 6)
+                path.parent.mkdir(exist_ok=True)
+                temporary_path = path.with_suffix(".tmp")
+                temporary_path.write_bytes(compressed)
+                os.replace(temporary_path, path)
+                self.connection.execute(
+                    "insert into blob (digest, size, last_used) values (?,?,?);",
+                    (digest, len(compressed), time.time()),
+                )
+            else:
+                self.connection.execute(
+                    "update blob set last_used = ? where digest = ?;",
+                    (time.time(), digest),
+                )
+            previous = self.connection.execute(
+                "select digest from feed where feed_url = ?;", (feed_url,)
+            ).fetchone()
+            self.connection.execute(
+                "insert into feed (feed_url, final_url, content_type, digest) values (?,?,?,?) on conflict(feed_url) do update set final_url=excluded.final_url, content_type=excluded.content_type, digest=excluded.digest;",
+                (feed_url, fetched.url, fetched.content_type, digest),
+            )
+            if previous is not None and previous[0] != digest:
+                self._drop_if_unreferenced(previous[0])
+            self._evict()
+        return digest
+
+    def get(self, feed_url: str) -> Optional[FetchedFeed]:
+        with self.lock, self.connection:
+            row = self.connection.execute(
+                "select final_url, content_type, digest from feed where feed_url = ?;",
+                (feed_url,),
+            ).fetchone()
+            if row is None:
+                return None
+            final_url, content_type, digest = row
+            self.connection.execute(
+                "update blob set last_used = ? where digest = ?;",
+                (time.time(), digest),
+            )
+        try:
+            body = zlib.decompress(self._blob_path(digest).read_bytes())
+        except FileNotFoundError:
+            return None
+        return FetchedFeed(
+            url=final_url,
+            body=body,
+            content_type=content_type,
+            stats=DownloadStats(seconds=0.0, size=len(body)),
+        )
+
+    def feed_urls(self) -> list[str]:
+        with self.lock:
+            rows = self.connection.execute("select feed_url from feed;").fetchall()
+        return [row[0] for row in rows]
+
+    def total_size(self) -> int:
+        with self.lock:
+            row = self.connection.execute(
+                "select coalesce(sum(size), 0) from blob;"
+            ).fetchone()
+        return row[0]
+
+    def _drop_if_unreferenced(self, digest: str) -> None:
+        referenced = self.connection.execute(
+            "select 1 from feed where digest = ? limit 1;", (digest,)
+        ).fetchone()
+        if referenced is None:
+            self._delete_blob(digest)
+
+    def _delete_blob(self, digest: str) -> None:
+        self.connection.execute("delete from feed where digest = ?;", (digest,))
+        self.connection.execute("delete from blob where digest = ?;", (digest,))
+        self._blob_path(digest).unlink(missing_ok=True)
+
+    def _evict(self) -> None:
+        total = self.connection.execute(
+            "select coalesce(sum(size), 0) from blob;"
+        ).fetchone()[0]
+        while total > self.max_bytes:
+            oldest = self.connection.execute(
+                "select digest, size from blob order by last_used asc limit 1;"
+            ).fetchone()
+            if oldest is None:
+                return
+            self._delete_blob(oldest[0])
+            total -= oldest[1]
+
+    def close(self) -> None:
+        self.connection.close()
@@ -2,9 +2,24 @@ import sqlite3
 from pathlib import Path
 
 MIGRATIONS_DIR = Path(__file__).resolve().parent / "migrations"
+# every migration applied to an empty database, regenerated by `cli.py schema`
+SCHEMA_PATH = Path(__file__).resolve().parent / "schema.sql"
+SCHEMA_HEADER = "-- Generated from the migrations by `cli.py schema`, do not edit.\n"
 
 
 def migrate(conn: sqlite3.Connection):
+    """Brings the database up to the latest migration.
+
+    A new database gets the schema snapshot in one script instead of
+    replaying every migration, migrations newer than the snapshot still
+    apply after it.
+    """
+    if SCHEMA_PATH.exists() and is_empty(conn):
+        conn.executescript(SCHEMA_PATH.read_text())
+    replay_migrations(conn)
+
+
+def replay_migrations(conn: sqlite3.Connection):
     conn.execute("""
         create table if not exists schema_version ( version text primary key)
                  """)
@@ -19,3 +34,24 @@ def migrate(conn: sqlite3.Connection):
         with conn:
             conn.executescript(sql)
             conn.execute("insert into schema_version (version) values (?)", (version,))
+
+
+def is_empty(conn: sqlite3.Connection) -> bool:
+    return conn.execute("select count(*) from sqlite_master").fetchone()[0] == 0
+
+
+def dump_schema(conn: sqlite3.Connection) -> str:
+    return SCHEMA_HEADER + "\n".join(conn.iterdump()) + "\n"
+
+
+def build_schema_snapshot() -> str:
+    """The schema, and schema_version rows, of every migration replayed."""
+    conn = sqlite3.connect(":memory:")
+    replay_migrations(conn)
+    snapshot = dump_schema(conn)
+    conn.close()
+    return snapshot
+
+
+def schema_snapshot_is_current() -> bool:
+    return SCHEMA_PATH.exists() and SCHEMA_PATH.read_text() == build_schema_snapshot()
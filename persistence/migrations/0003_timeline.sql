@@ -0,0 +1,20 @@
+-- Materialized home feed: one row per (subscriber, episode), kept up to date
+-- when episodes are saved and when users subscribe.
+
+create table if not exists timeline (
+	user_id text not null,
+	episode_id text not null,
+	feed_id text not null,
+	published_date integer not null,
+	cover_art_url text,
+	primary key (user_id, episode_id)
+);
+
+create index if not exists timeline_user_published on timeline (user_id, published_date);
+create index if not exists timeline_feed on timeline (feed_id);
+
+insert or ignore into timeline (user_id, episode_id, feed_id, published_date, cover_art_url)
+select subscription.user_id, episode.episode_id, episode.feed_id, episode.published_date, podcast_feed.cover_art_url
+from subscription
+join episode on episode.feed_id = subscription.feed_id
+join podcast_feed on podcast_feed.id = subscription.feed_id;
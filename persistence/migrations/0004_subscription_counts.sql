@@ -0,0 +1,29 @@
+-- Per subscription counters served inline by /subscribed_feeds. An episode is
+-- in progress when listened to and more than 20 seconds from its end,
+-- finished when listened to otherwise, unplayed when never listened to.
+
+alter table subscription add unplayed_count integer not null default 0;
+alter table subscription add in_progress_count integer not null default 0;
+alter table subscription add latest_episode_date integer;
+
+update subscription set
+	unplayed_count = (
+		select count(*) from episode
+		where episode.feed_id = subscription.feed_id
+		and not exists (
+			select 1 from previous_listen
+			where previous_listen.episode_id = episode.episode_id
+			and previous_listen.user_id = subscription.user_id
+		)
+	),
+	in_progress_count = (
+		select count(*) from episode
+		join previous_listen on previous_listen.episode_id = episode.episode_id
+		where episode.feed_id = subscription.feed_id
+		and previous_listen.user_id = subscription.user_id
+		and episode.length is not null
+		and episode.length - previous_listen.seconds >= 20
+	),
+	latest_episode_date = (
+		select max(published_date) from episode where episode.feed_id = subscription.feed_id
+	);
@@ -0,0 +1,13 @@
+-- Flags finished listens so unfinished ones can be served from a partial index.
+
+alter table previous_listen add finished integer not null default 0;
+
+update previous_listen set finished = case when exists (
+	select 1 from episode
+	where episode.episode_id = previous_listen.episode_id
+	and episode.length is not null
+	and episode.length - previous_listen.seconds >= 20
+) then 0 else 1 end;
+
+create index if not exists previous_listen_in_progress on previous_listen (user_id, time) where finished = 0;
+create index if not exists previous_listen_user_time on previous_listen (user_id, time);
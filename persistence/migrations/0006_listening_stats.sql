@@ -0,0 +1,9 @@
+-- Daily listening time per user and show, fed by set_current_time deltas.
+
+create table if not exists listening_day (
+	user_id text not null,
+	day text not null,
+	feed_id text not null,
+	seconds integer not null default 0,
+	primary key (user_id, day, feed_id)
+);
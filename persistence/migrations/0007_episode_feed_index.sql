@@ -0,0 +1,3 @@
+-- Subscribing, refreshing and recounting look episodes up by feed, newest first.
+
+create index if not exists episode_feed_published on episode (feed_id, published_date);
@@ -0,0 +1,19 @@
+-- The refresh process takes the lease before each cycle so only one process
+-- refreshes at a time, and records its outcome for the API workers to report.
+
+create table if not exists lease (
+	name text primary key,
+	holder text not null,
+	expires_at real not null
+);
+
+create table if not exists refresh_status (
+	job_id text primary key,
+	holder text,
+	started_at real,
+	finished_at real,
+	processed integer not null default 0,
+	failed integer not null default 0,
+	lag_seconds real,
+	skipped integer not null default 0
+);
@@ -0,0 +1,14 @@
+-- Old episodes nobody listened to, moved out of episode (and timeline) by the
+-- retention policy and moved back when someone pages that far or opens one.
+
+create table if not exists episode_archive (
+	episode_id text not null primary key,
+	title text,
+	description text,
+	download_link text,
+	published_date integer not null,
+	feed_id text not null,
+	length integer,
+	archived_at real not null
+);
+create index if not exists episode_archive_feed on episode_archive (feed_id);
@@ -0,0 +1,12 @@
+-- Changes pushed to each user's /events stream. They are kept for a while so
+-- that reconnecting clients can resume from the last event id they saw, which
+-- autoincrement guarantees is never reused.
+
+create table if not exists event (
+	id integer primary key autoincrement,
+	user_id text not null,
+	kind text not null,
+	data text not null,
+	created_at real not null
+);
+create index if not exists event_user on event (user_id, id);
@@ -0,0 +1,9 @@
+-- Cover art the refresher fetched and resized, by original url. The
+-- thumbnails are files named after the digest of the original image in the
+-- cover art directory. A null digest records a failed fetch, retried later.
+
+create table if not exists cover_art (
+	url text primary key,
+	digest text,
+	fetched_at real not null
+);
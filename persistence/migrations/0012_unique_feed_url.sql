@@ -0,0 +1,126 @@
+-- Subscribing used to create a feed per subscriber, and concurrent OPML
+-- imports could create the same feed twice. Feeds sharing a url are merged
+-- into the oldest before urls are made unique. Episodes of a merged feed
+-- matching one of the kept feed by date and title hand their listens over,
+-- the others move to the kept feed.
+
+create temporary table feed_merge as
+select podcast_feed.id as old_id, (
+	select kept.id from podcast_feed kept
+	where kept.feed_url = podcast_feed.feed_url
+	order by kept.rowid limit 1
+) as new_id
+from podcast_feed;
+delete from feed_merge where old_id = new_id;
+
+create temporary table episode_merge as
+select merged.episode_id as old_id, (
+	select kept.episode_id from episode kept
+	where kept.feed_id = feed_merge.new_id
+	and kept.published_date = merged.published_date
+	and kept.title is merged.title
+	limit 1
+) as new_id
+from episode merged join feed_merge on merged.feed_id = feed_merge.old_id;
+
+-- an archived copy must not come back next to a live one with listens
+delete from episode_archive where exists (
+	select 1 from episode_merge
+	join episode on episode.episode_id = episode_merge.old_id
+	join feed_merge on feed_merge.old_id = episode.feed_id
+	where episode_merge.new_id is null
+	and feed_merge.new_id = episode_archive.feed_id
+	and episode.published_date = episode_archive.published_date
+	and episode.title is episode_archive.title
+);
+update episode set feed_id = (
+	select new_id from feed_merge where old_id = episode.feed_id
+) where episode_id in (select old_id from episode_merge where new_id is null);
+delete from episode_merge where new_id is null;
+
+update or ignore previous_listen set episode_id = (
+	select new_id from episode_merge where old_id = previous_listen.episode_id
+) where episode_id in (select old_id from episode_merge);
+delete from previous_listen where episode_id in (select old_id from episode_merge);
+delete from episode where episode_id in (select old_id from episode_merge);
+
+delete from episode_archive where feed_id in (select old_id from feed_merge)
+and exists (
+	select 1 from feed_merge
+	join episode on episode.feed_id = feed_merge.new_id
+	where feed_merge.old_id = episode_archive.feed_id
+	and episode.published_date = episode_archive.published_date
+	and episode.title is episode_archive.title
+	union all
+	select 1 from feed_merge
+	join episode_archive kept on kept.feed_id = feed_merge.new_id
+	where feed_merge.old_id = episode_archive.feed_id
+	and kept.published_date = episode_archive.published_date
+	and kept.title is episode_archive.title
+);
+update episode_archive set feed_id = (
+	select new_id from feed_merge where old_id = episode_archive.feed_id
+) where feed_id in (select old_id from feed_merge);
+
+insert into listening_day (user_id, day, feed_id, seconds)
+select user_id, day, feed_merge.new_id, seconds from listening_day
+join feed_merge on feed_merge.old_id = listening_day.feed_id
+where true
+on conflict (user_id, day, feed_id) do update set seconds = seconds + excluded.seconds;
+delete from listening_day where feed_id in (select old_id from feed_merge);
+
+update or ignore subscription set feed_id = (
+	select new_id from feed_merge where old_id = subscription.feed_id
+) where feed_id in (select old_id from feed_merge);
+delete from subscription where feed_id in (select old_id from feed_merge);
+
+delete from timeline where feed_id in (select old_id from feed_merge)
+or feed_id in (select new_id from feed_merge);
+insert or ignore into timeline (user_id, episode_id, feed_id, published_date, cover_art_url)
+select subscription.user_id, episode.episode_id, episode.feed_id, episode.published_date, podcast_feed.cover_art_url
+from subscription
+join episode on episode.feed_id = subscription.feed_id
+join podcast_feed on podcast_feed.id = subscription.feed_id
+where subscription.feed_id in (select new_id from feed_merge);
+
+update previous_listen set finished = case when exists (
+	select 1 from episode
+	where episode.episode_id = previous_listen.episode_id
+	and episode.length is not null
+	and episode.length - previous_listen.seconds >= 20
+) then 0 else 1 end
+where episode_id in (
+	select episode_id from episode
+	where feed_id in (select new_id from feed_merge)
+);
+update subscription set
+	unplayed_count = (
+		select count(*) from episode
+		where episode.feed_id = subscription.feed_id
+		and not exists (
+			select 1 from previous_listen
+			where previous_listen.episode_id = episode.episode_id
+			and previous_listen.user_id = subscription.user_id
+		)
+	) + (
+		select count(*) from episode_archive
+		where episode_archive.feed_id = subscription.feed_id
+	),
+	in_progress_count = (
+		select count(*) from episode
+		join previous_listen on previous_listen.episode_id = episode.episode_id
+		where episode.feed_id = subscription.feed_id
+		and previous_listen.user_id = subscription.user_id
+		and episode.length is not null
+		and episode.length - previous_listen.seconds >= 20
+	),
+	latest_episode_date = (
+		select max(published_date) from episode where episode.feed_id = subscription.feed_id
+	)
+where feed_id in (select new_id from feed_merge);
+
+delete from podcast_feed where id in (select old_id from feed_merge);
+drop table feed_merge;
+drop table episode_merge;
+
+create unique index if not exists podcast_feed_url on podcast_feed (feed_url);
@@ -0,0 +1,11 @@
+-- Progress of OPML imports, fetched by a background task of whichever API
+-- worker took the upload and polled through any of them.
+
+create table if not exists opml_import (
+	id text primary key,
+	user_id text not null,
+	total integer not null,
+	fetched integer not null default 0,
+	failed integer not null default 0,
+	created_at real not null
+);
@@ -0,0 +1,4 @@
+-- ETag of the document each feed was last imported from, sent back as
+-- If-None-Match so unchanged feeds are neither downloaded nor parsed again.
+
+alter table podcast_feed add etag text;
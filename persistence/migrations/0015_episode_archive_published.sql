@@ -0,0 +1,4 @@
+-- Pages look for archived episodes of their feeds on either side of a date.
+
+drop index if exists episode_archive_feed;
+create index if not exists episode_archive_feed_published on episode_archive (feed_id, published_date);
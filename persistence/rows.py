@@ -0,0 +1,38 @@
+"""Builds domain objects from the rows of the episode queries.
+
+Every query that returns episodes selects EPISODE_COLUMNS, the cover art
+url and, for play infos, LISTEN_COLUMNS, in that order, so one mapper per
+shape serves all of them.
+"""
+
+from datetime import datetime, timedelta
+from typing import Any, Optional
+
+from business.podcast import Episode, EpisodeAssets, PlayInfo, PreviousListen
+
+EPISODE_COLUMNS = "episode.episode_id, episode.feed_id, episode.title, episode.description, episode.download_link, episode.published_date, episode.length"
+LISTEN_COLUMNS = "previous_listen.seconds, previous_listen.time"
+
+# bound once, they run for every row
+fromtimestamp = datetime.fromtimestamp
+
+
+def episode(row: Any) -> Episode:
+    return Episode(
+        row[0],
+        row[1],
+        EpisodeAssets(row[2], row[3], row[4], fromtimestamp(row[5]), row[6]),
+        row[7],
+    )
+
+
+def previous_listen(
+    seconds: Optional[int], time: Optional[float]
+) -> Optional[PreviousListen]:
+    if seconds is None or time is None:
+        return None
+    return PreviousListen(timedelta(seconds=seconds), fromtimestamp(time))
+
+
+def play_info(row: Any) -> PlayInfo:
+    return PlayInfo(episode(row), previous_listen(row[8], row[9]))
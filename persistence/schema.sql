@@ -0,0 +1,121 @@
+-- Generated from the migrations by `cli.py schema`, do not edit.
+BEGIN TRANSACTION;
+CREATE TABLE cover_art (
+	url text primary key,
+	digest text,
+	fetched_at real not null
+);
+CREATE TABLE episode (
+	episode_id text not null primary key,
+	title text,
+	description text,
+	download_link text,
+	published_date integer not null,
+	feed_id text not null,
+	length integer,
+	foreign key (feed_id) references subscription(feed_id)
+);
+CREATE TABLE episode_archive (
+	episode_id text not null primary key,
+	title text,
+	description text,
+	download_link text,
+	published_date integer not null,
+	feed_id text not null,
+	length integer,
+	archived_at real not null
+);
+CREATE TABLE event (
+	id integer primary key autoincrement,
+	user_id text not null,
+	kind text not null,
+	data text not null,
+	created_at real not null
+);
+CREATE TABLE lease (
+	name text primary key,
+	holder text not null,
+	expires_at real not null
+);
+CREATE TABLE listening_day (
+	user_id text not null,
+	day text not null,
+	feed_id text not null,
+	seconds integer not null default 0,
+	primary key (user_id, day, feed_id)
+);
+CREATE TABLE opml_import (
+	id text primary key,
+	user_id text not null,
+	total integer not null,
+	fetched integer not null default 0,
+	failed integer not null default 0,
+	created_at real not null
+);
+CREATE TABLE podcast_feed (
+	id text not null primary key,
+	feed_url text not null, cover_art_url text
+, title varchar(255) not null default 'missing title', etag text);
+CREATE TABLE previous_listen (
+	episode_id text not null,
+	user_id text not null,
+	seconds int not null,
+	time int, finished integer not null default 0,
+	primary key (episode_id, user_id),
+	foreign key (episode_id) references episode(episode_id),
+	foreign key (user_id) references user(id));
+CREATE TABLE refresh_status (
+	job_id text primary key,
+	holder text,
+	started_at real,
+	finished_at real,
+	processed integer not null default 0,
+	failed integer not null default 0,
+	lag_seconds real,
+	skipped integer not null default 0
+);
+CREATE TABLE schema_version ( version text primary key);
+INSERT INTO "schema_version" VALUES('0001_init');
+INSERT INTO "schema_version" VALUES('0002_feed_title');
+INSERT INTO "schema_version" VALUES('0003_timeline');
+INSERT INTO "schema_version" VALUES('0004_subscription_counts');
+INSERT INTO "schema_version" VALUES('0005_in_progress_listens');
+INSERT INTO "schema_version" VALUES('0006_listening_stats');
+INSERT INTO "schema_version" VALUES('0007_episode_feed_index');
+INSERT INTO "schema_version" VALUES('0008_refresh_coordination');
+INSERT INTO "schema_version" VALUES('0009_episode_archive');
+INSERT INTO "schema_version" VALUES('0010_event');
+INSERT INTO "schema_version" VALUES('0011_cover_art');
+INSERT INTO "schema_version" VALUES('0012_unique_feed_url');
+INSERT INTO "schema_version" VALUES('0013_opml_import');
+INSERT INTO "schema_version" VALUES('0014_feed_etag');
+INSERT INTO "schema_version" VALUES('0015_episode_archive_published');
+CREATE TABLE subscription (
+	user_id text not null,
+	feed_id text not null, unplayed_count integer not null default 0, in_progress_count integer not null default 0, latest_episode_date integer,
+	primary key (user_id, feed_id),
+	foreign key (user_id) references user(id),
+	foreign key (feed_id) references podcast_feed(id)
+);
+CREATE TABLE timeline (
+	user_id text not null,
+	episode_id text not null,
+	feed_id text not null,
+	published_date integer not null,
+	cover_art_url text,
+	primary key (user_id, episode_id)
+);
+CREATE TABLE user (
+	id text not null primary key,
+	email text not null unique
+);
+CREATE INDEX timeline_user_published on timeline (user_id, published_date);
+CREATE INDEX timeline_feed on timeline (feed_id);
+CREATE INDEX previous_listen_in_progress on previous_listen (user_id, time) where finished = 0;
+CREATE INDEX previous_listen_user_time on previous_listen (user_id, time);
+CREATE INDEX episode_feed_published on episode (feed_id, published_date);
+CREATE INDEX event_user on event (user_id, id);
+CREATE UNIQUE INDEX podcast_feed_url on podcast_feed (feed_url);
+CREATE INDEX episode_archive_feed_published on episode_archive (feed_id, published_date);
+DELETE FROM "sqlite_sequence";
+COMMIT;
@@ -0,0 +1,140 @@
+"""The feed refresh schedule, run in its own process next to the API workers.
+
+Parsing feeds is CPU heavy, so refreshing from an API worker slows down the
+requests it serves, and every worker would run its own schedule. Instead a
+single refresher process owns the scheduler. Refreshers on other hosts
+sharing the database take turns through a lease. They record each cycle in
+the database, where the API workers read it for /metrics.
+
+When a backup directory is configured the refresher also snapshots the
+database once a day.
+"""
+
+import logging
+import os
+import socket
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+
+from business.events import EVENT_RETENTION_SECONDS
+from persistence.backup import backup_database
+from services import get_settings, open_podcast_service
+
+if TYPE_CHECKING:
+    from apscheduler.events import JobEvent
+
+logger = logging.getLogger(__name__)
+
+REFRESH_JOB_ID = "refresh_all_feeds"
+REFRESH_INTERVAL_MINUTES = 10
+# a cycle taking longer than this could overlap with another refresher's
+REFRESH_LEASE_SECONDS = 60 * 60
+BACKUP_JOB_ID = "backup_database"
+BACKUP_INTERVAL_HOURS = 24
+# held until the next backup is due, so refreshers on other hosts skip theirs
+BACKUP_LEASE_SECONDS = BACKUP_INTERVAL_HOURS * 60 * 60 - 5 * 60
+
+
+class RefreshJob:
+    def __init__(self, holder: str) -> None:
+        self.holder = holder
+        self.lag_seconds: Optional[float] = None
+
+    def __call__(self) -> None:
+        with open_podcast_service() as service:
+            summary = service.refresh_all_feeds_exclusively(
+                job_id=REFRESH_JOB_ID,
+                holder=self.holder,
+                lease_seconds=REFRESH_LEASE_SECONDS,
+                lag_seconds=self.lag_seconds,
+            )
+            # streams resume from the last event id up to this far back
+            service.datastore.prune_events(
+                created_before=time.time() - EVENT_RETENTION_SECONDS
+            )
+        if summary is not None:
+            logger.info(f"refreshed {summary.processed} feeds, {summary.failed} failed")
+
+    def record_schedule(self, event: "JobEvent") -> None:
+        from apscheduler.events import JobSubmissionEvent
+
+        if event.job_id != REFRESH_JOB_ID:
+            return
+        if isinstance(event, JobSubmissionEvent):
+            scheduled = min(event.scheduled_run_times)
+            self.lag_seconds = (
+                datetime.now(scheduled.tzinfo) - scheduled
+            ).total_seconds()
+        else:
+            with open_podcast_service() as service:
+                service.datastore.count_skipped_refresh(REFRESH_JOB_ID)
+
+
+class BackupJob:
+    def __init__(self, holder: str, directory: Path, keep: int) -> None:
+        self.holder = holder
+        self.directory = directory
+        self.keep = keep
+
+    def __call__(self) -> None:
+        with open_podcast_service() as service:
+            datastore = service.datastore
+            if not datastore.acquire_lease(
+                BACKUP_JOB_ID, self.holder, BACKUP_LEASE_SECONDS
+            ):
+                logger.info("skipping backup, another process made it")
+                return
+            report = backup_database(
+                datastore.connection, self.directory, now=datetime.now(), keep=self.keep
+            )
+        logger.info(
+            f"backed up the database to {report.path} in {report.seconds:.1f}s, {report.megabytes_per_second:.1f}MB/s"
+        )
+
+
+def holder_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def run_refresher() -> None:
+    """Refreshes every feed every REFRESH_INTERVAL_MINUTES until interrupted."""
+    from apscheduler.events import (
+        EVENT_JOB_MAX_INSTANCES,
+        EVENT_JOB_MISSED,
+        EVENT_JOB_SUBMITTED,
+    )
+    from apscheduler.schedulers.blocking import BlockingScheduler
+
+    holder = holder_id()
+    job = RefreshJob(holder=holder)
+    scheduler = BlockingScheduler()
+    scheduler.add_listener(
+        job.record_schedule,
+        EVENT_JOB_SUBMITTED | EVENT_JOB_MAX_INSTANCES | EVENT_JOB_MISSED,
+    )
+    scheduler.add_job(
+        func=job,
+        trigger="interval",
+        minutes=REFRESH_INTERVAL_MINUTES,
+        id=REFRESH_JOB_ID,
+    )
+    logger.info(f"refreshing feeds every {REFRESH_INTERVAL_MINUTES} minutes")
+    settings = get_settings()
+    if settings.backup_dir is not None:
+        scheduler.add_job(
+            func=BackupJob(
+                holder=holder,
+                directory=Path(settings.backup_dir),
+                keep=settings.backups_kept,
+            ),
+            trigger="interval",
+            hours=BACKUP_INTERVAL_HOURS,
+            id=BACKUP_JOB_ID,
+        )
+        logger.info(f"backing up the database to {settings.backup_dir} daily")
+    try:
+        scheduler.start()
+    except (KeyboardInterrupt, SystemExit):
+        pass
@@ -0,0 +1,122 @@
+"""Configuration and service wiring shared by the API and the refresher."""
+
+import logging
+import os
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterator, Optional
+
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+from business.cover_art import CoverArtCache
+from business.podcast_service import PodcastService
+from business.rss import FeedParserRssParser
+from observability.metrics import REGISTRY
+from observability.queries import QueryInstrumentation
+from observability.timing import TimedConnection
+from persistence.backup import DEFAULT_BACKUPS_KEPT
+from persistence.connection import connect
+from persistence.cover_art import CoverArtStore
+from persistence.datastore import Datastore
+from persistence.feed_archive import DEFAULT_ARCHIVE_MAX_BYTES, FeedArchive
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+
+
+class Settings(BaseSettings):
+    auth0_domain: str
+    auth0_audience: str
+    auth0_issuer: str
+    auth0_algorithms: str
+    feed_archive_dir: Optional[str] = None
+    feed_archive_max_bytes: int = DEFAULT_ARCHIVE_MAX_BYTES
+    admin_emails: list[str] = []
+    profiling_secret: Optional[str] = None
+    # signs the tokens browsers open the event stream with, see /events/token
+    event_token_secret: Optional[str] = None
+    # the refresher snapshots the database there daily when set
+    backup_dir: Optional[str] = None
+    backups_kept: int = DEFAULT_BACKUPS_KEPT
+    # thumbnails of cover art are made and served from there when set
+    cover_art_dir: Optional[str] = None
+
+    model_config = SettingsConfigDict(env_file=".env", frozen=True, extra="ignore")
+
+
+@lru_cache
+def get_settings() -> Settings:
+    return Settings()
+
+
+# set by `cli.py serve --workers N` for the API processes it starts
+API_WORKERS_VARIABLE = "PODCASTICOT_API_WORKERS"
+
+
+def api_workers() -> int:
+    """API worker processes serving this deployment.
+
+    Each keeps its own profiles, query log settings and admission buckets,
+    everything else is shared through the database.
+    """
+    return int(os.environ.get(API_WORKERS_VARIABLE, "1"))
+
+
+@lru_cache
+def rss_parser() -> FeedParserRssParser:
+    settings = get_settings()
+    if settings.feed_archive_dir is None:
+        return FeedParserRssParser()
+    archive = FeedArchive(
+        Path(settings.feed_archive_dir), max_bytes=settings.feed_archive_max_bytes
+    )
+    return FeedParserRssParser(archive=archive)
+
+
+@lru_cache
+def cover_art_store() -> Optional[CoverArtStore]:
+    settings = get_settings()
+    if settings.cover_art_dir is None:
+        return None
+    return CoverArtStore(Path(settings.cover_art_dir))
+
+
+@lru_cache
+def cover_art_cache() -> Optional[CoverArtCache]:
+    store = cover_art_store()
+    if store is None:
+        return None
+    return CoverArtCache(store=store)
+
+
+SQLITE_CONNECTIONS_OPEN = REGISTRY.gauge(
+    "sqlite_connections_open", "SQLite connections currently open by the API."
+)
+SQLITE_CONNECTIONS_OPENED = REGISTRY.counter(
+    "sqlite_connections_opened_total", "SQLite connections opened by the API."
+)
+
+
+query_instrumentation = QueryInstrumentation()
+
+
+@contextmanager
+def open_podcast_service() -> Iterator[PodcastService]:
+    connection = connect(check_same_thread=False, factory=TimedConnection)
+    SQLITE_CONNECTIONS_OPENED.inc()
+    SQLITE_CONNECTIONS_OPEN.inc()
+    try:
+        yield PodcastService(
+            datastore=Datastore(
+                connection=connection, query_hook=query_instrumentation
+            ),
+            rss_parser=rss_parser(),
+            cover_art=cover_art_cache(),
+        )
+    finally:
+        connection.close()
+        SQLITE_CONNECTIONS_OPEN.dec()
@@ -0,0 +1,82 @@
+import json
+import sqlite3
+from dataclasses import dataclass
+from functools import cache
+from typing import Any, Iterator
+
+import pytest
+from fastapi.testclient import TestClient
+
+import endpoints
+from business.async_podcast_service import AsyncPodcastService
+from business.podcast_service import PodcastService
+from business.rss import FakeRssParser
+from observability.queries import QueryLogSettings
+from observability.timing import TimedConnection
+from persistence.database_thread import DatabaseThread
+from persistence.datastore import Datastore
+from persistence.migration import migrate
+
+ADMIN_EMAIL = "admin@example.com"
+PROFILING_SECRET = "profiling secret"
+
+
+@cache
+def migrated_template() -> sqlite3.Connection:
+    template = sqlite3.connect(":memory:", check_same_thread=False)
+    migrate(template)
+    return template
+
+
+def migrated_connection(**kwargs: Any) -> sqlite3.Connection:
+    """A new in-memory database, copied from one migrated once per session."""
+    connection = sqlite3.connect(":memory:", **kwargs)
+    migrated_template().backup(connection)
+    return connection
+
+
+@dataclass
+class Api:
+    client: TestClient
+    service: PodcastService
+    # the service's parser, to set what feeds return
+    parser: FakeRssParser
+    email: str = ADMIN_EMAIL
+
+
+@pytest.fixture
+def api(monkeypatch: pytest.MonkeyPatch) -> Iterator[Api]:
+    """The app with authentication stubbed and an in-memory database.
+
+    Requests are made as api.email, which starts as the only admin.
+    """
+    for name, value in {
+        "AUTH0_DOMAIN": "example.com",
+        "AUTH0_AUDIENCE": "audience",
+        "AUTH0_ISSUER": "issuer",
+        "AUTH0_ALGORITHMS": "RS256",
+        "ADMIN_EMAILS": json.dumps([ADMIN_EMAIL]),
+        "PROFILING_SECRET": PROFILING_SECRET,
+        "EVENT_TOKEN_SECRET": "event token secret",
+    }.items():
+        monkeypatch.setenv(name, value)
+    endpoints.get_settings.cache_clear()
+
+    connection = migrated_connection(check_same_thread=False, factory=TimedConnection)
+    parser = FakeRssParser(imports={})
+    service = PodcastService(
+        datastore=Datastore(connection=connection), rss_parser=parser
+    )
+    # the tests keep using the connection directly between requests
+    database = DatabaseThread(connection)
+    async_service = AsyncPodcastService(service=service, database=database)
+    api = Api(client=TestClient(endpoints.app), service=service, parser=parser)
+    overrides = endpoints.app.dependency_overrides
+    overrides[endpoints.authenticated_user_email] = lambda: api.email
+    overrides[endpoints.podcast_service] = lambda: async_service
+    yield api
+    overrides.clear()
+    endpoints.get_settings.cache_clear()
+    endpoints.admission.clear()
+    endpoints.query_instrumentation.configure(QueryLogSettings())
+    database.close()
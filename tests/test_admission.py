@@ -0,0 +1,130 @@
+from contextlib import contextmanager
+from typing import Iterator
+
+import pytest
+
+import endpoints
+from admission import (
+    SHED_REQUESTS,
+    Admission,
+    Overloaded,
+    RateLimit,
+    RateLimited,
+)
+from business.podcast_service import PodcastService
+from business.rss import PodcastImport
+from tests.conftest import Api
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def expensive_in_flight(api: Api) -> float:
+    for line in api.client.get("/metrics").text.splitlines():
+        if line.startswith("expensive_requests_in_flight "):
+            return float(line.split()[1])
+    raise AssertionError("expensive_requests_in_flight is not exported")
+
+
+def test_buckets_allow_a_burst_then_refill_per_user() -> None:
+    clock = Clock()
+    admission = Admission(
+        limits={"/refresh": RateLimit(per_minute=2, burst=2)}, clock=clock
+    )
+    admission.enter("/refresh", "alice")
+    admission.enter("/refresh", "alice")
+
+    with pytest.raises(RateLimited) as shed:
+        admission.enter("/refresh", "alice")
+    assert shed.value.retry_after == 30
+    admission.enter("/refresh", "bob")
+
+    clock.now = 30
+    admission.enter("/refresh", "alice")
+    with pytest.raises(RateLimited):
+        admission.enter("/refresh", "alice")
+
+
+def test_expensive_routes_are_shed_past_the_concurrency_cap() -> None:
+    admission = Admission(
+        limits={
+            "/refresh": RateLimit(per_minute=60, burst=1, expensive=True),
+            "/opml": RateLimit(per_minute=60, burst=1),
+        },
+        max_in_flight=1,
+    )
+    overloaded = SHED_REQUESTS.value("/refresh", "overloaded")
+    admission.enter("/refresh", "alice")
+
+    with pytest.raises(Overloaded):
+        admission.enter("/refresh", "bob")
+    admission.enter("/opml", "bob")
+    admission.leave("/opml")
+    assert SHED_REQUESTS.value("/refresh", "overloaded") == overloaded + 1
+
+    admission.leave("/refresh")
+    # bob kept the token of the request that was shed
+    admission.enter("/refresh", "bob")
+    assert admission.in_flight == 1
+
+
+def test_each_worker_enforces_its_share_of_the_limits() -> None:
+    admission = Admission(
+        limits={"/subscribe": RateLimit(per_minute=10, burst=10, expensive=True)},
+        max_in_flight=4,
+        workers=4,
+    )
+
+    assert admission.limits["/subscribe"] == RateLimit(
+        per_minute=2.5, burst=2, expensive=True
+    )
+    assert admission.max_in_flight == 1
+
+
+def test_refreshing_too_often_is_rejected_with_retry_after(api: Api) -> None:
+    for _ in range(3):
+        assert api.client.post("/refresh").status_code == 200
+
+    response = api.client.post("/refresh")
+
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) > 0
+    assert expensive_in_flight(api) == 0
+    metrics = api.client.get("/metrics").text
+    assert 'http_requests_shed_total{route="/refresh",reason="rate_limited"}' in metrics
+
+
+def test_opml_imports_hold_their_place_until_the_feeds_are_fetched(
+    api: Api, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    api.parser.imports["https://new.example/feed"] = PodcastImport(
+        title="new podcast", cover_art_url="cover", episode_assets=[]
+    )
+    in_flight_while_fetching = []
+
+    @contextmanager
+    def open_podcast_service() -> Iterator[PodcastService]:
+        in_flight_while_fetching.append(endpoints.admission.in_flight)
+        yield api.service
+
+    monkeypatch.setattr(endpoints, "open_podcast_service", open_podcast_service)
+    opml = b"""<opml version="2.0"><body>
+        <outline type="rss" text="new" xmlUrl="https://new.example/feed"/>
+        <outline type="rss" text="broken" xmlUrl="https://broken.example/feed"/>
+    </body></opml>"""
+
+    response = api.client.post("/opml", files={"file": ("feeds.opml", opml)})
+
+    assert response.status_code == 202
+    # whether or not the request itself has left by then, which depends on
+    # the FastAPI version, the fetch counts
+    assert len(in_flight_while_fetching) == 1
+    assert in_flight_while_fetching[0] >= 1
+    assert expensive_in_flight(api) == 0
+    progress = api.client.get(f"/opml/{response.json()['id']}").json()
+    assert (progress["fetched"], progress["failed"]) == (1, 1)
@@ -0,0 +1,89 @@
+import gzip
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from persistence.backup import (
+    backup_database,
+    checksum_path,
+    list_snapshots,
+    verify_snapshot,
+)
+from persistence.connection import connect
+from persistence.migration import migrate
+
+
+def test_snapshot_restores_the_database_while_others_keep_writing(
+    tmp_path: Path,
+) -> None:
+    path = str(tmp_path / "poddb.db")
+    source = connect(path)
+    migrate(source)
+    with source:
+        source.executemany(
+            "insert into user (id, email) values (?, ?);",
+            [(str(n), f"{n}@example.com" * 50) for n in range(20_000)],
+        )
+    errors: list[Exception] = []
+    written: list[int] = []
+    done = threading.Event()
+
+    def write() -> None:
+        # fails with "database is locked" instead of waiting if blocked
+        writer = sqlite3.connect(path, timeout=0)
+        while not done.is_set():
+            n = len(written)
+            try:
+                with writer:
+                    writer.execute(
+                        "insert into user (id, email) values (?, ?);",
+                        (f"late {n}", f"late{n}@example.com"),
+                    )
+                written.append(n)
+            except sqlite3.OperationalError as error:
+                errors.append(error)
+        writer.close()
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    # the copy starts while the writer is already going
+    while not written:
+        time.sleep(0.001)
+    try:
+        report = backup_database(source, tmp_path / "backups", now=datetime(2025, 1, 1))
+    finally:
+        done.set()
+        writer.join()
+    source.close()
+
+    assert errors == []
+    assert verify_snapshot(report.path)
+    assert report.database_bytes > report.compressed_bytes
+    assert report.megabytes_per_second > 0
+    restored_path = tmp_path / "restored.db"
+    restored_path.write_bytes(gzip.decompress(report.path.read_bytes()))
+    restored = sqlite3.connect(restored_path)
+    (users,) = restored.execute("select count(*) from user;").fetchone()
+    assert 20_000 < users <= 20_000 + len(written)
+    assert restored.execute("pragma integrity_check;").fetchone() == ("ok",)
+    restored.close()
+
+
+def test_old_snapshots_are_rotated_and_tampering_is_detected(tmp_path: Path) -> None:
+    source = sqlite3.connect(":memory:")
+    migrate(source)
+    directory = tmp_path / "backups"
+    start = datetime(2025, 1, 1)
+    reports = [
+        backup_database(source, directory, now=start + timedelta(days=day), keep=3)
+        for day in range(5)
+    ]
+
+    assert list_snapshots(directory) == [report.path for report in reports[2:]]
+    assert not checksum_path(reports[0].path).exists()
+    newest = reports[-1].path
+    assert verify_snapshot(newest)
+    newest.write_bytes(newest.read_bytes() + b"\0")
+    assert not verify_snapshot(newest)
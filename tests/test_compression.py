@@ -0,0 +1,107 @@
+import json
+from datetime import datetime
+
+import brotli
+import pytest
+
+from business.podcast import EpisodeAssets
+from business.rss import PodcastImport
+from compression import COMPRESSED_RESPONSES, CompressedBodyCache, negotiate
+from tests.conftest import Api
+
+FEED_URL = "https://example.com/feed.xml"
+
+
+def podcast() -> PodcastImport:
+    return PodcastImport(
+        title="title",
+        cover_art_url="cover",
+        episode_assets=[
+            EpisodeAssets(
+                title=f"episode {day}",
+                description="<p>a long html description</p>" * 20,
+                download_link=f"https://example.com/{day}.mp3",
+                published_date=datetime(2025, 1, day),
+                length=3600,
+            )
+            for day in range(1, 11)
+        ],
+    )
+
+
+@pytest.mark.parametrize(
+    "accept_encoding,expected",
+    [
+        ("gzip, deflate, br", "br"),
+        ("gzip;q=1.0, br;q=0.5", "gzip"),
+        ("br;q=0, gzip", "gzip"),
+        ("*", "br"),
+        ("gzip;q=0, *;q=0.1", "br"),
+        ("identity", None),
+        ("gzip;q=0", None),
+        ("", None),
+    ],
+)
+def test_negotiation_follows_quality_values(
+    accept_encoding: str, expected: str
+) -> None:
+    assert negotiate(accept_encoding, ("br", "gzip")) == expected
+
+
+def test_cache_evicts_least_recently_served_bodies() -> None:
+    cache = CompressedBodyCache(max_bytes=10)
+    cache.add("gzip", b"a", b"1234")
+    cache.add("gzip", b"b", b"1234")
+    assert cache.get("gzip", b"a") == b"1234"
+
+    cache.add("gzip", b"c", b"1234")
+
+    assert cache.get("gzip", b"b") is None
+    assert cache.get("gzip", b"a") == b"1234"
+    assert cache.bytes == 8
+
+
+def test_pages_are_compressed_once_while_unchanged(api: Api) -> None:
+    user = api.service.save_user(api.email)
+    api.parser.imports[FEED_URL] = podcast()
+    api.service.subscribe_user_to_podcast(user.id, FEED_URL)
+    plain = api.client.get("/my_feed", headers={"Accept-Encoding": "identity"})
+    misses = COMPRESSED_RESPONSES.value("gzip", "miss")
+    hits = COMPRESSED_RESPONSES.value("gzip", "hit")
+
+    first = api.client.get("/my_feed", headers={"Accept-Encoding": "gzip"})
+    second = api.client.get("/my_feed", headers={"Accept-Encoding": "gzip"})
+
+    assert "content-encoding" not in plain.headers
+    for response in (first, second):
+        assert response.headers["content-encoding"] == "gzip"
+        assert "Accept-Encoding" in response.headers["vary"]
+        assert int(response.headers["content-length"]) < len(plain.content) / 4
+        assert response.json() == plain.json()
+    assert COMPRESSED_RESPONSES.value("gzip", "miss") == misses + 1
+    assert COMPRESSED_RESPONSES.value("gzip", "hit") == hits + 1
+
+
+def test_brotli_pages_decompress_to_the_plain_page(api: Api) -> None:
+    user = api.service.save_user(api.email)
+    api.parser.imports[FEED_URL] = podcast()
+    api.service.subscribe_user_to_podcast(user.id, FEED_URL)
+    plain = api.client.get("/my_feed", headers={"Accept-Encoding": "identity"})
+
+    with api.client.stream(
+        "GET", "/my_feed", headers={"Accept-Encoding": "gzip, br"}
+    ) as response:
+        body = b"".join(response.iter_raw())
+
+    assert response.headers["content-encoding"] == "br"
+    assert len(body) < len(plain.content) / 4
+    assert json.loads(brotli.decompress(body)) == plain.json()
+
+
+def test_small_responses_are_sent_as_they_are(api: Api) -> None:
+    api.service.save_user(api.email)
+
+    response = api.client.get("/subscribed_feeds", headers={"Accept-Encoding": "gzip"})
+
+    assert response.status_code == 200
+    assert "content-encoding" not in response.headers
@@ -0,0 +1,159 @@
+import io
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Iterator
+
+import pytest
+from PIL import Image
+
+import endpoints
+from business.cover_art import (
+    MAX_COVER_ART_PIXELS,
+    THUMBNAIL_SIZES,
+    CoverArtCache,
+    CoverArtTooLarge,
+    make_thumbnails,
+)
+from business.podcast_service import PodcastService
+from business.rss import FakeRssParser, PodcastImport
+from persistence.cover_art import CoverArtStore
+from persistence.datastore import Datastore
+from tests.conftest import Api, migrated_connection
+
+FEED_URL = "https://example.com/feed.xml"
+
+
+def cover_png() -> bytes:
+    output = io.BytesIO()
+    Image.new("RGBA", (1200, 900), (200, 40, 40, 128)).save(output, "PNG")
+    return output.getvalue()
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    cover = b""
+    requests: list[str] = []
+
+    def do_GET(self) -> None:
+        self.requests.append(self.path)
+        if self.path != "/cover.png":
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(self.cover)))
+        self.end_headers()
+        self.wfile.write(self.cover)
+
+    def log_message(self, format, *args) -> None: ...
+
+
+@pytest.fixture
+def image_server() -> Iterator[str]:
+    ImageHandler.cover = cover_png()
+    ImageHandler.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ImageHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def subscribed_service(store: CoverArtStore, cover_art_url: str) -> PodcastService:
+    service = PodcastService(
+        datastore=Datastore(connection=migrated_connection()),
+        rss_parser=FakeRssParser(
+            imports={
+                FEED_URL: PodcastImport(
+                    title="title", cover_art_url=cover_art_url, episode_assets=[]
+                )
+            }
+        ),
+        cover_art=CoverArtCache(store=store),
+    )
+    user = service.save_user("alice@example.com")
+    service.subscribe_user_to_podcast(user.id, FEED_URL)
+    return service
+
+
+def test_refreshes_make_thumbnails_of_each_cover_once(
+    image_server: str, tmp_path: Path
+) -> None:
+    store = CoverArtStore(tmp_path)
+    url = f"{image_server}/cover.png"
+    service = subscribed_service(store, url)
+
+    service.update_all_feeds()
+    service.update_all_feeds()
+
+    assert ImageHandler.requests == ["/cover.png"]
+    digest = service.datastore.get_cover_art_digest(url)
+    assert digest is not None
+    for size in THUMBNAIL_SIZES:
+        thumbnail = Image.open(store.path(digest, size, "jpeg"))
+        assert thumbnail.format == "JPEG"
+        assert max(thumbnail.size) == size
+
+
+def test_covers_of_too_many_pixels_are_refused_before_decoding() -> None:
+    output = io.BytesIO()
+    # a bit per pixel, the file is a few kilobytes
+    Image.new("1", (MAX_COVER_ART_PIXELS // 4000 + 1, 4000)).save(output, "PNG")
+
+    with pytest.raises(CoverArtTooLarge):
+        make_thumbnails(output.getvalue())
+
+
+def test_failed_fetches_are_recorded_and_not_retried_at_once(
+    image_server: str, tmp_path: Path
+) -> None:
+    url = f"{image_server}/missing.png"
+    service = subscribed_service(CoverArtStore(tmp_path), url)
+
+    service.update_all_feeds()
+    service.update_all_feeds()
+
+    assert ImageHandler.requests == ["/missing.png"]
+    assert service.datastore.get_cover_art_digest(url) is None
+
+
+def test_cover_art_redirects_to_thumbnails_served_for_good(
+    api: Api, image_server: str, tmp_path: Path
+) -> None:
+    store = CoverArtStore(tmp_path)
+    url = f"{image_server}/cover.png"
+    digest = CoverArtCache(store=store).fetch(url)
+    api.service.datastore.save_cover_art(url, digest, fetched_at=0)
+    endpoints.app.dependency_overrides[endpoints.cover_art_store] = lambda: store
+
+    redirect = api.client.get(
+        "/cover_art", params={"url": url, "size": 256}, follow_redirects=False
+    )
+    assert redirect.headers["location"] == f"/cover_art/{digest}/256"
+
+    webp = api.client.get(
+        redirect.headers["location"], headers={"Accept": "image/webp"}
+    )
+    jpeg = api.client.get(redirect.headers["location"], headers={"Accept": "image/*"})
+
+    assert webp.headers["content-type"] == "image/webp"
+    assert jpeg.headers["content-type"] == "image/jpeg"
+    assert "immutable" in jpeg.headers["cache-control"]
+    assert api.client.get(f"/cover_art/{digest}/100").status_code == 404
+
+
+def test_cover_art_not_resized_is_not_found(api: Api) -> None:
+    url = "https://example.com/cover.jpg"
+    api.service.datastore.save_cover_art(url, None, fetched_at=0)
+
+    failed = api.client.get("/cover_art", params={"url": url}, follow_redirects=False)
+    unknown = api.client.get(
+        "/cover_art", params={"url": "https://example.com/other.jpg"}
+    )
+
+    # never a redirect off-site
+    assert failed.status_code == 404
+    assert "location" not in failed.headers
+    assert unknown.status_code == 404
@@ -0,0 +1,183 @@
+import asyncio
+import sqlite3
+import threading
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+from business.async_podcast_service import AsyncPodcastService, Reader
+from business.podcast import EpisodeAssets
+from business.podcast_service import PodcastService
+from business.rss import DownloadStats, FakeRssParser, PodcastImport
+from persistence.connection import connect
+from persistence.database_thread import DatabaseThread, DatabaseThreadClosed
+from persistence.datastore import Datastore
+from tests.conftest import migrated_connection
+
+request_name: ContextVar[str] = ContextVar("request_name", default="")
+
+
+def test_calls_run_in_order_on_one_thread() -> None:
+    database = DatabaseThread(sqlite3.connect(":memory:", check_same_thread=False))
+    seen: list[tuple[int, str]] = []
+
+    def record(number: int) -> int:
+        seen.append((number, threading.current_thread().name))
+        return number * 2
+
+    async def main() -> list[int]:
+        return await asyncio.gather(*(database.run(record, n) for n in range(20)))
+
+    assert asyncio.run(main()) == [n * 2 for n in range(20)]
+    database.close()
+    assert [number for number, _ in seen] == list(range(20))
+    assert {name for _, name in seen} == {"database"}
+
+
+def test_errors_and_context_reach_the_caller() -> None:
+    database = DatabaseThread(sqlite3.connect(":memory:", check_same_thread=False))
+
+    async def main() -> str:
+        request_name.set("my_feed")
+        with pytest.raises(sqlite3.OperationalError):
+            await database.run(database.connection.execute, "select * from nope;")
+        return await database.run(request_name.get)
+
+    assert asyncio.run(main()) == "my_feed"
+    database.close()
+    with pytest.raises(DatabaseThreadClosed):
+        asyncio.run(database.run(request_name.get))
+
+
+def test_async_service_subscribes_and_refreshes() -> None:
+    connection = migrated_connection(check_same_thread=False)
+    feed_url = "https://example.com/feed.xml"
+    service = AsyncPodcastService(
+        service=PodcastService(
+            datastore=Datastore(connection=connection),
+            rss_parser=FakeRssParser(
+                imports={
+                    feed_url: PodcastImport(
+                        title="title",
+                        cover_art_url="cover",
+                        episode_assets=[],
+                        download=DownloadStats(seconds=0.1, size=100),
+                        etag='"v1"',
+                    )
+                }
+            ),
+        ),
+        database=DatabaseThread(connection),
+    )
+
+    async def main() -> None:
+        user = await service.save_user("someone@example.com")
+        await service.subscribe_user_to_podcast(user.id, feed_url)
+        feeds = await service.get_user_subscribed_feeds(user.id)
+        assert [feed.url for feed in feeds] == [feed_url]
+        summary = await service.update_user_feeds(user.id)
+        assert (summary.processed, summary.failed) == (1, 0)
+        # the writer holds no lock between calls
+        assert not await service.database.run(lambda: connection.in_transaction)
+
+    asyncio.run(main())
+    service.database.close()
+
+
+def test_reads_do_not_wait_for_the_writer(tmp_path: Path) -> None:
+    path = tmp_path / "podcasts.db"
+    migrated_connection().backup(connect(str(path)))
+
+    def threaded(name: str) -> Reader:
+        connection = connect(str(path), check_same_thread=False)
+        return Reader(
+            service=PodcastService(
+                datastore=Datastore(connection=connection),
+                rss_parser=FakeRssParser(imports={}),
+            ),
+            database=DatabaseThread(connection, name=name),
+        )
+
+    writer = threaded("database")
+    service = AsyncPodcastService(
+        service=writer.service,
+        database=writer.database,
+        readers=[threaded("database-reader")],
+    )
+    release = threading.Event()
+
+    async def main() -> None:
+        user = await service.save_user("someone@example.com")
+        slow_write = asyncio.ensure_future(service.database.run(release.wait))
+        # the writer is busy until the read is done
+        assert await service.find_user_by_email(user.email) == user
+        assert await service.get_user_subscribed_feeds(user.id) == []
+        assert not slow_write.done()
+        release.set()
+        await slow_write
+
+    asyncio.run(main())
+    for database in [service.database, *(r.database for r in service.readers)]:
+        database.close()
+
+
+def test_readers_leave_restoring_archived_episodes_to_the_writer(
+    tmp_path: Path,
+) -> None:
+    path = tmp_path / "podcasts.db"
+    migrated_connection().backup(connect(str(path)))
+    feed_url = "https://example.com/feed.xml"
+    podcast = PodcastImport(
+        title="title",
+        cover_art_url="cover",
+        episode_assets=[
+            EpisodeAssets(
+                title=f"episode {day}",
+                description="",
+                download_link=f"https://example.com/{day}.mp3",
+                published_date=datetime(2025, 1, day),
+                length=3600,
+            )
+            for day in range(1, 31)
+        ],
+    )
+
+    def threaded(name: str) -> Reader:
+        connection = connect(str(path), check_same_thread=False)
+        return Reader(
+            service=PodcastService(
+                datastore=Datastore(connection=connection),
+                rss_parser=FakeRssParser(imports={feed_url: podcast}),
+            ),
+            database=DatabaseThread(connection, name=name),
+        )
+
+    writer = threaded("database")
+    reader = threaded("database-reader")
+    service = AsyncPodcastService(
+        service=writer.service, database=writer.database, readers=[reader]
+    )
+    user = writer.service.save_user("someone@example.com")
+    writer.service.subscribe_user_to_podcast(user.id, feed_url)
+    (feed,) = writer.service.get_user_subscribed_feeds(user.id)
+    oldest, *_ = writer.service.get_single_feed(
+        user.id, page=1, feed_id=feed.id, chronological=True
+    )
+    writer.service.datastore.archive_episodes(
+        published_before=datetime(2025, 1, 26), keep_latest=5
+    )
+
+    async def main() -> None:
+        play_info = await service.get_play_information(oldest.episode.id, user.id)
+        assert play_info.episode.id == oldest.episode.id
+        page = await service.get_user_home_feed(user.id, page=1, chronological=True)
+        assert page[0].episode.id == oldest.episode.id
+        single_feed = await service.get_single_feed(user.id, page=2, feed_id=feed.id)
+        assert len(single_feed) == 10
+
+    asyncio.run(main())
+    assert reader.service.datastore.connection.total_changes == 0
+    for database in [writer.database, reader.database]:
+        database.close()
@@ -0,0 +1,222 @@
+import asyncio
+import json
+from datetime import datetime
+
+import pytest
+from starlette.types import Message
+
+import endpoints
+from business.async_podcast_service import AsyncPodcastService
+from business.events import (
+    NEW_EPISODES,
+    PROGRESS,
+    EventHub,
+    sign_event_token,
+    verify_event_token,
+)
+from business.podcast import EpisodeAssets
+from business.podcast_service import PodcastService
+from business.rss import FakeRssParser, PodcastImport
+from persistence.database_thread import DatabaseThread
+from persistence.datastore import Datastore
+from tests.conftest import Api, migrated_connection
+
+FEED_URL = "https://example.com/feed.xml"
+
+
+def episode(day: int) -> EpisodeAssets:
+    return EpisodeAssets(
+        title=f"episode {day}",
+        description="description",
+        download_link=f"https://example.com/{day}.mp3",
+        published_date=datetime(2025, 1, day),
+        length=3600,
+    )
+
+
+def podcast(days: range) -> PodcastImport:
+    return PodcastImport(
+        title="title",
+        cover_art_url="cover",
+        episode_assets=[episode(day) for day in days],
+    )
+
+
+def test_new_episodes_and_progress_are_published_to_the_users_concerned() -> None:
+    parser = FakeRssParser(imports={FEED_URL: podcast(range(1, 3))})
+    service = PodcastService(
+        datastore=Datastore(connection=migrated_connection()), rss_parser=parser
+    )
+    alice = service.save_user("alice@example.com")
+    bob = service.save_user("bob@example.com")
+    service.subscribe_user_to_podcast(alice.id, FEED_URL)
+    (feed,) = service.get_user_subscribed_feeds(alice.id)
+    service.datastore.subscribe(bob.id, feed.id)
+    first = service.get_single_feed(alice.id, page=1, feed_id=feed.id)[0]
+
+    service.update_current_play_time(first.episode.id, alice.id, seconds=42)
+    parser.imports[FEED_URL] = podcast(range(1, 6))
+    service.update_all_feeds()
+
+    progress, new_episodes = service.datastore.get_user_events_after(alice.id, 0)
+    assert (progress.kind, json.loads(progress.data)) == (
+        PROGRESS,
+        {"episode_id": first.episode.id, "seconds": 42},
+    )
+    assert (new_episodes.kind, json.loads(new_episodes.data)) == (
+        NEW_EPISODES,
+        {"feed_id": feed.id, "count": 3},
+    )
+    (bobs,) = service.datastore.get_user_events_after(bob.id, 0)
+    assert bobs.data == new_episodes.data
+    assert service.datastore.prune_events(created_before=float("inf")) == 3
+    assert service.datastore.get_latest_event_id() == 0
+
+
+def test_streams_resume_after_the_last_event_id_then_follow_live() -> None:
+    connection = migrated_connection(check_same_thread=False)
+    service = AsyncPodcastService(
+        service=PodcastService(
+            datastore=Datastore(connection=connection),
+            rss_parser=FakeRssParser(imports={FEED_URL: podcast(range(1, 3))}),
+        ),
+        database=DatabaseThread(connection),
+    )
+
+    async def main() -> None:
+        alice = await service.save_user("alice@example.com")
+        await service.subscribe_user_to_podcast(alice.id, FEED_URL)
+        (first, second) = await service.get_user_home_feed(alice.id, page=1)
+        await service.update_current_play_time(first.episode.id, alice.id, 10)
+        missed = await service.database.run(
+            service.service.datastore.get_latest_event_id
+        )
+        await service.update_current_play_time(first.episode.id, alice.id, 20)
+
+        stream = service.events.stream(alice.id, missed - 1, keepalive_seconds=0.05)
+        resumed = await anext(stream)
+        assert resumed is not None and resumed.id == missed
+        latest = await anext(stream)
+        assert latest is not None and json.loads(latest.data)["seconds"] == 20
+        # nothing new
+        assert await anext(stream) is None
+
+        await service.update_current_play_time(second.episode.id, alice.id, 30)
+        live = await asyncio.wait_for(anext(stream), 1)
+        assert live is not None
+        assert json.loads(live.data) == {"episode_id": second.episode.id, "seconds": 30}
+        assert service.events.streams == 1
+        await stream.aclose()
+        assert service.events.streams == 0
+
+    asyncio.run(main())
+    service.events.close()
+    service.database.close()
+
+
+@pytest.mark.parametrize("signed", [False, True])
+def test_events_endpoint_streams_server_sent_events(api: Api, signed: bool) -> None:
+    service: AsyncPodcastService = endpoints.app.dependency_overrides[
+        endpoints.podcast_service
+    ]()
+    user = api.service.save_user(api.email)
+    api.parser.imports[FEED_URL] = podcast(range(1, 2))
+    api.service.subscribe_user_to_podcast(user.id, FEED_URL)
+    (entry,) = api.service.get_user_home_feed(user.id, page=1)
+    api.service.update_current_play_time(entry.episode.id, user.id, 5)
+    path, query_string = "/events", b""
+    if signed:
+        token = api.client.post("/events/token").json()["token"]
+        # the stream is opened as a browser would, with no authenticated user
+        endpoints.app.dependency_overrides.pop(endpoints.authenticated_user_email)
+        path, query_string = "/events/signed", f"token={token}".encode()
+
+    async def main() -> tuple[list[Message], str]:
+        messages: list[Message] = []
+        body = ""
+        disconnect = asyncio.Event()
+
+        async def receive() -> Message:
+            await disconnect.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message: Message) -> None:
+            nonlocal body
+            messages.append(message)
+            body += message.get("body", b"").decode()
+            if body.count("event: progress") == 2:
+                disconnect.set()
+            elif "event: progress" in body:
+                await service.update_current_play_time(entry.episode.id, user.id, 9)
+
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": query_string,
+            "headers": [(b"last-event-id", b"0")],
+            "scheme": "http",
+            "server": ("testserver", 80),
+            "client": ("testclient", 1),
+            "root_path": "",
+            "http_version": "1.1",
+        }
+        await asyncio.wait_for(endpoints.app(scope, receive, send), 5)
+        return messages, body
+
+    messages, body = asyncio.run(main())
+    start = messages[0]
+    assert start["status"] == 200
+    assert (b"content-type", b"text/event-stream; charset=utf-8") in start["headers"]
+    assert body.startswith("retry: 5000\n\n")
+    first, second = [block for block in body.split("\n\n") if "progress" in block]
+    assert first.startswith("id: 1\nevent: progress\ndata: ")
+    assert json.loads(second.split("data: ")[1])["seconds"] == 9
+    service.events.close()
+
+
+def test_event_tokens_open_the_stream_of_their_user_until_they_expire() -> None:
+    token = sign_event_token("secret", "alice", expires_at=1000)
+
+    assert verify_event_token("secret", token, now=999) == "alice"
+    assert verify_event_token("secret", token, now=1001) is None
+    assert verify_event_token("other secret", token, now=999) is None
+    assert verify_event_token("secret", "bob" + token[5:], now=999) is None
+    assert verify_event_token("secret", "alice", now=999) is None
+
+
+def test_signed_events_need_a_valid_token(api: Api) -> None:
+    endpoints.app.dependency_overrides.pop(endpoints.authenticated_user_email)
+
+    response = api.client.get("/events/signed", params={"token": "alice.1.abc"})
+
+    assert response.status_code == 401
+
+
+def test_hub_polls_only_while_streams_are_open() -> None:
+    polls: list[int] = []
+
+    async def latest() -> int:
+        return 7
+
+    async def after(event_id: int) -> list:
+        polls.append(event_id)
+        return []
+
+    async def user_after(user_id: str, event_id: int) -> list:
+        return []
+
+    hub = EventHub(latest, after, user_after, poll_seconds=0.01)
+
+    async def main() -> None:
+        stream = hub.stream("alice", None, keepalive_seconds=0.05)
+        assert await anext(stream) is None
+        await stream.aclose()
+        await asyncio.sleep(0.05)
+        polled = len(polls)
+        await asyncio.sleep(0.05)
+        assert len(polls) == polled
+
+    asyncio.run(main())
+    assert polls and set(polls) == {7}
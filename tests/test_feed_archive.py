@@ -0,0 +1,125 @@
+from pathlib import Path
+
+import pytest
+
+from business.podcast_service import PodcastService
+from business.rss import (
+    ArchivedRssParser,
+    DownloadStats,
+    FakeRssParser,
+    FeedFetchError,
+    FetchedFeed,
+    parse_feed,
+)
+from persistence.datastore import Datastore
+from persistence.feed_archive import FeedArchive
+from tests.conftest import migrated_connection
+
+RSS_DOCUMENT = b"""<?xml version="1.0" encoding="UTF-8"?>
+<rss version="2.0">
+  <channel>
+    <title>archived podcast</title>
+    <image><url>http://example.com/cover.jpg</url></image>
+    <item>
+      <title>archived episode</title>
+      <pubDate>Wed, 01 Jan 2025 12:00:00 GMT</pubDate>
+      <enclosure url="http://example.com/episode.mp3" type="audio/mpeg" length="1"/>
+    </item>
+  </channel>
+</rss>
+"""
+
+
+def fetched_feed(body: bytes, url: str = "http://example.com/feed.xml") -> FetchedFeed:
+    return FetchedFeed(
+        url=url,
+        body=body,
+        content_type="application/rss+xml",
+        stats=DownloadStats(seconds=0.1, size=len(body)),
+    )
+
+
+def test_archive_round_trip(tmp_path: Path) -> None:
+    archive = FeedArchive(tmp_path)
+    archive.put("http://example.com/feed.xml", fetched_feed(RSS_DOCUMENT))
+
+    fetched = archive.get("http://example.com/feed.xml")
+
+    assert fetched is not None
+    assert fetched.body == RSS_DOCUMENT
+    assert fetched.content_type == "application/rss+xml"
+    assert archive.get("http://example.com/unknown.xml") is None
+
+
+def test_identical_bodies_are_stored_once(tmp_path: Path) -> None:
+    archive = FeedArchive(tmp_path)
+    first_digest = archive.put("http://a.example/feed", fetched_feed(RSS_DOCUMENT))
+    second_digest = archive.put("http://b.example/feed", fetched_feed(RSS_DOCUMENT))
+
+    assert first_digest == second_digest
+    assert len(list((tmp_path / "objects").glob("*/*.z"))) == 1
+
+
+def test_replaced_body_is_dropped(tmp_path: Path) -> None:
+    archive = FeedArchive(tmp_path)
+    archive.put("http://a.example/feed", fetched_feed(b"first version"))
+    archive.put("http://a.example/feed", fetched_feed(b"second version"))
+
+    assert len(list((tmp_path / "objects").glob("*/*.z"))) == 1
+    fetched = archive.get("http://a.example/feed")
+    assert fetched is not None
+    assert fetched.body == b"second version"
+
+
+def test_least_recently_used_bodies_are_evicted(tmp_path: Path) -> None:
+    bodies = {f"http://{name}.example/feed": name.encode() * 200 for name in "abc"}
+    archive = FeedArchive(tmp_path)
+    for url, body in bodies.items():
+        archive.put(url, fetched_feed(body))
+    budget = archive.total_size() - 1
+    archive.close()
+
+    archive = FeedArchive(tmp_path, max_bytes=budget)
+    # reading a refreshes its position, so b is now the oldest
+    assert archive.get("http://a.example/feed") is not None
+    archive.put("http://d.example/feed", fetched_feed(b"d" * 200))
+
+    assert archive.get("http://b.example/feed") is None
+    assert archive.get("http://a.example/feed") is not None
+    assert archive.get("http://d.example/feed") is not None
+    assert archive.total_size() <= budget
+
+
+def test_archived_parser_reads_from_archive(tmp_path: Path) -> None:
+    archive = FeedArchive(tmp_path)
+    archive.put("http://example.com/feed.xml", fetched_feed(RSS_DOCUMENT))
+    parser = ArchivedRssParser(archive=archive)
+
+    podcast = parser.import_feed("http://example.com/feed.xml")
+
+    assert podcast.title == "archived podcast"
+    assert len(podcast.episode_assets) == 1
+    with pytest.raises(FeedFetchError):
+        parser.import_feed("http://example.com/unknown.xml")
+
+
+def test_reparsing_the_archive_keeps_the_etag_and_commits(tmp_path: Path) -> None:
+    url = "http://example.com/feed.xml"
+    downloaded = parse_feed(fetched_feed(RSS_DOCUMENT))
+    downloaded.download = DownloadStats(seconds=0.1, size=len(RSS_DOCUMENT))
+    downloaded.etag = '"v1"'
+    connection = migrated_connection()
+    service = PodcastService(
+        datastore=Datastore(connection=connection),
+        rss_parser=FakeRssParser(imports={url: downloaded}),
+    )
+    user = service.save_user("alice@example.com")
+    service.subscribe_user_to_podcast(user.id, url)
+    [feed] = service.datastore.get_all_feeds()
+
+    service.update_all_feeds()
+    assert not connection.in_transaction
+    service.reconcile_feed(feed, parse_feed(fetched_feed(RSS_DOCUMENT)))
+
+    assert not connection.in_transaction
+    assert service.datastore.get_feed_etag(feed.id) == '"v1"'
@@ -0,0 +1,128 @@
+import time
+from datetime import datetime
+from typing import Any, Optional
+
+import pytest
+
+from business.feed_entry import find_audio_url, parse_duration, parse_published_date
+from business.podcast import EpisodeAssets, NoAudio, NoPublishedDate
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        (None, None),
+        ("", None),
+        ("0", 0),
+        ("3600", 3600),
+        ("3600.7", 3600),
+        ("59", 59),
+        ("1:05", 65),
+        ("01:00:00", 3600),
+        ("1:02:03", 3723),
+        ("1:02:03.5", 3723),
+        ("25:00:00", 90000),
+        ("100:00", 6000),
+        ("1:2:3:4", None),
+        ("1::3", None),
+        ("abc", None),
+        ("12:ab", None),
+        ("-5", None),
+        ("nan", None),
+        ("inf", None),
+    ],
+)
+def test_parse_duration(value: Optional[str], expected: Optional[int]) -> None:
+    assert parse_duration(value) == expected
+
+
+@pytest.mark.parametrize(
+    "entry, expected",
+    [
+        ({}, None),
+        ({"links": [{"type": "text/html", "href": "http://e.com/page"}]}, None),
+        (
+            {"links": [{"type": "audio/mpeg", "href": "http://e.com/a.mp3"}]},
+            "http://e.com/a.mp3",
+        ),
+        (
+            {"links": [{"type": "audio/x-m4a", "href": "http://e.com/a.m4a"}]},
+            "http://e.com/a.m4a",
+        ),
+        (
+            {
+                "links": [
+                    {"rel": "related", "type": "audio/mpeg", "href": "http://e/l.mp3"},
+                    {"rel": "enclosure", "type": "audio/mp4", "href": "http://e/e.m4a"},
+                ]
+            },
+            "http://e/e.m4a",
+        ),
+        (
+            {"links": [{"rel": "enclosure", "href": "http://e.com/a.MP3?token=1"}]},
+            "http://e.com/a.MP3?token=1",
+        ),
+        ({"links": [{"rel": "enclosure", "type": "audio/mpeg"}]}, None),
+        (
+            {
+                "links": [
+                    {"rel": "enclosure", "type": "video/mp4", "href": "http://e/v"}
+                ]
+            },
+            None,
+        ),
+    ],
+)
+def test_find_audio_url(entry: dict[str, Any], expected: Optional[str]) -> None:
+    assert find_audio_url(entry) == expected
+
+
+@pytest.mark.parametrize(
+    "entry, expected",
+    [
+        ({}, None),
+        (
+            {"published_parsed": time.struct_time((2025, 3, 30, 1, 30, 0, 6, 89, 0))},
+            datetime(2025, 3, 30, 1, 30),
+        ),
+        (
+            {"updated_parsed": time.struct_time((2024, 12, 31, 23, 59, 60, 1, 366, 0))},
+            datetime(2024, 12, 31, 23, 59, 59),
+        ),
+    ],
+)
+def test_parse_published_date(
+    entry: dict[str, Any], expected: Optional[datetime]
+) -> None:
+    assert parse_published_date(entry) == expected
+
+
+def test_from_feed_entry() -> None:
+    assets = EpisodeAssets.from_feed_entry(
+        {
+            "title": "episode",
+            "summary": "description",
+            "links": [
+                {"rel": "enclosure", "type": "audio/mpeg", "href": "http://e.com/a.mp3"}
+            ],
+            "published_parsed": time.struct_time((2025, 1, 1, 12, 0, 0, 2, 1, 0)),
+            "itunes_duration": "1:02:03",
+        }
+    )
+    assert assets == EpisodeAssets(
+        title="episode",
+        description="description",
+        download_link="http://e.com/a.mp3",
+        published_date=datetime(2025, 1, 1, 12),
+        length=3723,
+    )
+
+
+def test_from_feed_entry_rejects_unusable_entries() -> None:
+    published = time.struct_time((2025, 1, 1, 12, 0, 0, 2, 1, 0))
+    with pytest.raises(NoAudio):
+        EpisodeAssets.from_feed_entry({"title": "t", "published_parsed": published})
+    with pytest.raises(NoPublishedDate):
+        EpisodeAssets.from_feed_entry(
+            {"title": "t", "links": [{"type": "audio/mpeg", "href": "http://e/a"}]}
+        )
@@ -0,0 +1,107 @@
+import sqlite3
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import endpoints
+from observability.metrics import Registry
+from observability.middleware import (
+    PHASE_DURATION,
+    REQUEST_DURATION,
+    MetricsMiddleware,
+    TimedJSONResponse,
+)
+from observability.timing import TimedConnection, phase
+from tests.conftest import Api
+
+
+def test_render_text_exposition() -> None:
+    registry = Registry()
+    requests = registry.counter("requests_total", "Requests.", ("path",))
+    in_flight = registry.gauge("in_flight", "In flight.")
+    latency = registry.histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0))
+
+    requests.inc('/a"b')
+    requests.inc('/a"b', amount=2)
+    in_flight.set(4)
+    latency.observe(0.05)
+    latency.observe(0.5)
+    latency.observe(7)
+
+    assert registry.render() == (
+        "# HELP requests_total Requests.\n"
+        "# TYPE requests_total counter\n"
+        'requests_total{path="/a\\"b"} 3\n'
+        "# HELP in_flight In flight.\n"
+        "# TYPE in_flight gauge\n"
+        "in_flight 4\n"
+        "# HELP latency_seconds Latency.\n"
+        "# TYPE latency_seconds histogram\n"
+        'latency_seconds_bucket{le="0.1"} 1\n'
+        'latency_seconds_bucket{le="1"} 2\n'
+        'latency_seconds_bucket{le="+Inf"} 3\n'
+        "latency_seconds_sum 7.55\n"
+        "latency_seconds_count 3\n"
+    )
+
+
+def test_gauge_callback_is_read_at_render_time() -> None:
+    registry = Registry()
+    values = iter([1, 2])
+    registry.gauge("queue_depth", "Depth.", function=lambda: next(values))
+
+    assert "queue_depth 1" in registry.render()
+    assert "queue_depth 2" in registry.render()
+
+
+def test_middleware_labels_by_route_template_and_records_phases() -> None:
+    app = FastAPI(default_response_class=TimedJSONResponse)
+    app.add_middleware(MetricsMiddleware)
+    connection = sqlite3.connect(
+        ":memory:", check_same_thread=False, factory=TimedConnection
+    )
+
+    @app.get("/items/{item_id}")
+    def item(item_id: int) -> dict[str, int]:
+        with phase("auth"):
+            pass
+        (value,) = connection.execute("select ?;", (item_id,)).fetchone()
+        return {"item": value}
+
+    before = REQUEST_DURATION.count("GET", "/items/{item_id}", "200")
+    client = TestClient(app)
+    assert client.get("/items/1").json() == {"item": 1}
+    assert client.get("/items/2").status_code == 200
+    assert client.get("/nowhere").status_code == 404
+
+    assert REQUEST_DURATION.count("GET", "/items/{item_id}", "200") == before + 2
+    assert REQUEST_DURATION.count("GET", "unmatched", "404") >= 1
+    for name in ("auth", "sql", "render"):
+        assert PHASE_DURATION.count("/items/{item_id}", name) >= 2
+
+
+def test_phase_outside_request_is_not_recorded() -> None:
+    connection = sqlite3.connect(":memory:", factory=TimedConnection)
+    with phase("sql"):
+        assert connection.execute("select 1;").fetchone() == (1,)
+
+
+def test_metrics_report_refresh_recorded_by_another_process(api: Api) -> None:
+    api.service.datastore.save_refresh_run(
+        job_id=endpoints.REFRESH_JOB_ID,
+        holder="refresher",
+        started_at=1000.0,
+        finished_at=1012.5,
+        processed=40,
+        failed=2,
+        lag_seconds=0.25,
+    )
+    api.service.datastore.count_skipped_refresh(endpoints.REFRESH_JOB_ID)
+
+    text = api.client.get("/metrics").text
+
+    assert "refresh_last_duration_seconds 12.5\n" in text
+    assert "refresh_last_processed_feeds 40\n" in text
+    assert "refresh_last_failed_feeds 2\n" in text
+    assert "refresh_schedule_lag_seconds 0.25\n" in text
+    assert "refresh_skipped_total 1\n" in text
@@ -0,0 +1,95 @@
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+from persistence import migration
+from persistence.migration import (
+    build_schema_snapshot,
+    dump_schema,
+    migrate,
+    replay_migrations,
+    schema_snapshot_is_current,
+)
+
+
+def test_schema_snapshot_matches_the_migrations() -> None:
+    # run `cli.py schema` after adding a migration
+    assert schema_snapshot_is_current()
+
+
+def test_new_database_from_snapshot_equals_replayed_migrations() -> None:
+    connection = sqlite3.connect(":memory:")
+    migrate(connection)
+    assert dump_schema(connection) == build_schema_snapshot()
+
+
+def test_existing_database_replays_missing_migrations(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    first, *_ = sorted(migration.MIGRATIONS_DIR.glob("*.sql"))
+    (tmp_path / first.name).write_text(first.read_text())
+    connection = sqlite3.connect(":memory:")
+    with monkeypatch.context() as patch:
+        patch.setattr(migration, "MIGRATIONS_DIR", tmp_path)
+        replay_migrations(connection)
+
+    migrate(connection)
+    assert dump_schema(connection) == build_schema_snapshot()
+
+
+def test_migrations_newer_than_the_snapshot_apply_after_it(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    for path in migration.MIGRATIONS_DIR.glob("*.sql"):
+        (tmp_path / path.name).write_text(path.read_text())
+    (tmp_path / "9999_later.sql").write_text("create table later (id text);")
+    monkeypatch.setattr(migration, "MIGRATIONS_DIR", tmp_path)
+    connection = sqlite3.connect(":memory:")
+    migrate(connection)
+    assert connection.execute("select count(*) from later").fetchone() == (0,)
+    assert ("9999_later",) in connection.execute("select version from schema_version")
+
+
+def test_feeds_sharing_a_url_are_merged_into_the_oldest(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    for path in migration.MIGRATIONS_DIR.glob("*.sql"):
+        if path.name < "0012":
+            (tmp_path / path.name).write_text(path.read_text())
+    connection = sqlite3.connect(":memory:")
+    with monkeypatch.context() as patch:
+        patch.setattr(migration, "MIGRATIONS_DIR", tmp_path)
+        replay_migrations(connection)
+    connection.executescript("""
+        insert into user (id, email) values ('alice', 'alice@example.com'), ('bob', 'bob@example.com');
+        insert into podcast_feed (id, feed_url, cover_art_url, title) values ('kept', 'https://example.com/feed', 'cover', 'feed'), ('merged', 'https://example.com/feed', 'cover', 'feed');
+        insert into episode (episode_id, title, published_date, feed_id, length) values ('one', 'one', 1, 'kept', 3600), ('one copy', 'one', 1, 'merged', 3600), ('two', 'two', 2, 'merged', 3600);
+        insert into subscription (user_id, feed_id) values ('alice', 'kept'), ('bob', 'merged');
+        insert into previous_listen (episode_id, user_id, seconds, time) values ('one copy', 'bob', 30, 1);
+    """)
+
+    migrate(connection)
+
+    assert connection.execute("select id from podcast_feed").fetchall() == [("kept",)]
+    assert connection.execute(
+        "select episode_id, feed_id from episode order by episode_id"
+    ).fetchall() == [("one", "kept"), ("two", "kept")]
+    assert connection.execute(
+        "select episode_id, user_id, seconds from previous_listen"
+    ).fetchall() == [("one", "bob", 30)]
+    assert connection.execute(
+        "select user_id, feed_id, unplayed_count, in_progress_count from subscription order by user_id"
+    ).fetchall() == [("alice", "kept", 2, 0), ("bob", "kept", 1, 1)]
+    assert connection.execute(
+        "select user_id, episode_id from timeline order by user_id, episode_id"
+    ).fetchall() == [
+        ("alice", "one"),
+        ("alice", "two"),
+        ("bob", "one"),
+        ("bob", "two"),
+    ]
+    with pytest.raises(sqlite3.IntegrityError):
+        connection.execute(
+            "insert into podcast_feed (id, feed_url) values ('other', 'https://example.com/feed')"
+        )
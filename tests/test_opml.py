@@ -0,0 +1,55 @@
+from xml.etree import ElementTree
+
+import pytest
+
+from business.opml import InvalidOpml, export_opml, parse_opml
+from business.podcast import Feed
+
+OPML_DOCUMENT = b"""<?xml version="1.0" encoding="UTF-8"?>
+<opml version="2.0">
+  <head><title>exported from another app</title></head>
+  <body>
+    <outline text="news">
+      <outline type="rss" text="Daily &amp; News" xmlUrl="https://a.example/feed"/>
+      <outline type="rss" title="Other" text="ignored" xmlUrl="https://b.example/rss"/>
+    </outline>
+    <outline type="rss" text="duplicate" xmlUrl="https://a.example/feed"/>
+    <outline type="link" text="not a feed" url="https://c.example"/>
+    <outline type="rss" text="local" xmlUrl="file:///etc/passwd"/>
+  </body>
+</opml>
+"""
+
+
+def test_parse_opml_keeps_unique_http_feeds() -> None:
+    outlines = parse_opml(OPML_DOCUMENT)
+
+    assert [outline.feed_url for outline in outlines] == [
+        "https://a.example/feed",
+        "https://b.example/rss",
+    ]
+    assert [outline.title for outline in outlines] == ["Daily & News", "Other"]
+
+
+@pytest.mark.parametrize("document", [b"not xml", b"<html><body/></html>"])
+def test_parse_opml_rejects_other_documents(document: bytes) -> None:
+    with pytest.raises(InvalidOpml):
+        parse_opml(document)
+
+
+def test_export_round_trips() -> None:
+    feeds = [
+        Feed(
+            id="1",
+            title='Tom & "Jerry" <live>',
+            url="https://a.example/feed?x=1&y=2",
+            cover_art_url="",
+        )
+    ]
+
+    document = "".join(export_opml(feeds)).encode()
+
+    ElementTree.fromstring(document)
+    outlines = parse_opml(document)
+    assert outlines[0].feed_url == "https://a.example/feed?x=1&y=2"
+    assert outlines[0].title == 'Tom & "Jerry" <live>'
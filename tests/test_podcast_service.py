@@ -1,14 +1,17 @@
 import sqlite3
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from pathlib import Path
 from typing import Callable, Optional
 
 import pytest
+from pydantic import TypeAdapter
 
-from business.podcast import EpisodeAssets, PreviousListen
-from business.podcast_service import PodcastService
+from business.opml import ImportProgress
+from business.podcast import Episode, EpisodeAssets, Feed, PlayInfo, PreviousListen
+from business.podcast_service import PodcastService, RetentionPolicy
 from business.rss import FakeRssParser, PodcastImport
 from persistence.datastore import Datastore, EpisodeNotFound, UnknownUser
-from persistence.migration import migrate
+from tests.conftest import migrated_connection
 
 
 class EpisodeAssetFactory:
@@ -47,8 +50,7 @@ def service_factory() -> Callable[..., PodcastService]:
     ) -> PodcastService:
         if rss_feed_podcasts is None:
             rss_feed_podcasts = {}
-        connection = sqlite3.connect(":memory:")
-        migrate(connection)
+        connection = migrated_connection()
         return PodcastService(
             datastore=Datastore(connection=connection),
             rss_parser=FakeRssParser(imports=rss_feed_podcasts),
@@ -188,6 +190,26 @@ def test_subscribe_to_feed(service_factory: Callable[..., PodcastService]) -> No
     assert isinstance(play_info.episode.assets.published_date, datetime)
 
 
+def test_subscribing_again_keeps_the_one_subscription(
+    service_factory: Callable[..., PodcastService],
+) -> None:
+    podcast = PodcastImport(
+        title="cool podcast title",
+        episode_assets=[EpisodeAssetFactory.build()],
+        cover_art_url="Fake cover url",
+    )
+    service = service_factory(rss_feed_podcasts={"this matters": podcast})
+    alice = service.save_user("alice@example.com")
+    service.subscribe_user_to_podcast(user_id=alice.id, feed_url="this matters")
+
+    service.subscribe_user_to_podcast(user_id=alice.id, feed_url="this matters")
+    # a concurrent request of hers fetched the feed before it was saved
+    service.save_subscription(alice.id, "this matters", podcast)
+
+    assert len(service.get_user_subscribed_feeds(alice.id)) == 1
+    assert len(service.get_user_home_feed(user_id=alice.id, page=1)) == 1
+
+
 def test_update_single_users_feed(
     service_factory: Callable[..., PodcastService],
 ) -> None:
@@ -298,6 +320,71 @@ def test_update_all_feeds(service_factory: Callable[..., PodcastService]) -> Non
     assert len(bobs_new_feed) == 2
 
 
+def test_update_all_feeds_continues_past_broken_feed(
+    service_factory: Callable[..., PodcastService],
+) -> None:
+    service = service_factory(
+        rss_feed_podcasts={
+            url: PodcastImport(
+                title=url,
+                episode_assets=[
+                    EpisodeAssetFactory.build(
+                        published_date=datetime(year=2000, month=1, day=1)
+                    )
+                ],
+                cover_art_url="Fake cover url",
+            )
+            for url in ("first", "broken", "last")
+        }
+    )
+    alice = service.save_user("alice@example.com")
+    for url in ("first", "broken", "last"):
+        service.subscribe_user_to_podcast(user_id=alice.id, feed_url=url)
+
+    assert isinstance(service.rss_parser, FakeRssParser)
+    del service.rss_parser.imports["broken"]
+    for podcast in service.rss_parser.imports.values():
+        podcast.episode_assets.append(
+            EpisodeAssetFactory.build(
+                title="new episode",
+                published_date=datetime(year=2000, month=1, day=2),
+            )
+        )
+
+    summary = service.update_all_feeds()
+
+    assert (summary.processed, summary.failed) == (2, 1)
+    assert len(service.get_user_home_feed(user_id=alice.id, page=1)) == 5
+
+
+def test_lease_is_held_until_released_or_expired(service: PodcastService) -> None:
+    datastore = service.datastore
+
+    assert datastore.acquire_lease("refresh", "a", seconds=60)
+    assert datastore.acquire_lease("refresh", "a", seconds=60)
+    assert not datastore.acquire_lease("refresh", "b", seconds=60)
+    datastore.release_lease("refresh", "a")
+    assert datastore.acquire_lease("refresh", "b", seconds=-1)
+    assert datastore.acquire_lease("refresh", "a", seconds=60)
+
+
+def test_refresh_is_skipped_while_another_process_holds_the_lease(
+    service: PodcastService,
+) -> None:
+    service.datastore.acquire_lease("refresh", "other", seconds=60)
+
+    skipped = service.refresh_all_feeds_exclusively("refresh", "me", 60)
+    service.datastore.release_lease("refresh", "other")
+    summary = service.refresh_all_feeds_exclusively("refresh", "me", 60, 1.5)
+
+    assert skipped is None
+    assert summary is not None
+    status = service.datastore.get_refresh_status("refresh")
+    assert status is not None
+    assert (status.holder, status.skipped, status.lag_seconds) == ("me", 1, 1.5)
+    assert service.datastore.acquire_lease("refresh", "other", seconds=60)
+
+
 def test_play_info(service_factory: Callable[..., PodcastService]) -> None:
     service = service_factory(
         rss_feed_podcasts={
@@ -362,6 +449,27 @@ def test_play_time_string() -> None:
     assert previous_listen.play_time_string() == "#t=1:01:01"
 
 
+def test_play_info_serializes_time_listened_as_seconds() -> None:
+    play_info = PlayInfo(
+        episode=Episode(
+            id="episode",
+            feed_id="feed",
+            assets=EpisodeAssetFactory.build(),
+            cover_art_url="cover",
+        ),
+        previous_listen=PreviousListen(
+            time_listened=timedelta(seconds=90),
+            time=datetime(day=1, month=1, year=2025),
+        ),
+    )
+    serialized = TypeAdapter(PlayInfo).dump_python(play_info, mode="json")
+    assert serialized["previous_listen"] == {
+        "time_listened": 90.0,
+        "time": "2025-01-01T00:00:00",
+    }
+    assert serialized["episode"]["assets"]["title"] == "test title"
+
+
 def test_refreshing_updates_download_links_podcast_title_and_cover_art_url(
     service_factory: Callable[..., PodcastService],
 ) -> None:
@@ -655,3 +763,426 @@ def test_fetch_subscribed_feeds(
     assert len(alice_feeds) == 1
     assert alice_feeds[0].title == "title under test"
     assert alice_feeds[0].cover_art_url == "cover art under test"
+
+
+def test_opml_import_reuses_known_feeds_and_fetches_new_ones(
+    service_factory: Callable[..., PodcastService],
+) -> None:
+    service = service_factory(
+        rss_feed_podcasts={
+            "https://known.example/feed": PodcastImport(
+                title="known podcast",
+                episode_assets=[EpisodeAssetFactory.build(title="known episode")],
+                cover_art_url="known cover",
+            ),
+            "https://new.example/feed": PodcastImport(
+                title="new podcast",
+                episode_assets=[EpisodeAssetFactory.build(title="new episode")],
+                cover_art_url="new cover",
+            ),
+        }
+    )
+    alice = service.save_user("alice@example.com")
+    bob = service.save_user("bob@example.com")
+    service.subscribe_user_to_podcast(
+        user_id=alice.id, feed_url="https://known.example/feed"
+    )
+    opml = b"""<opml version="2.0"><body>
+        <outline type="rss" text="known" xmlUrl="https://known.example/feed"/>
+        <outline type="rss" text="new" xmlUrl="https://new.example/feed"/>
+        <outline type="rss" text="broken" xmlUrl="https://broken.example/feed"/>
+    </body></opml>"""
+
+    new_feeds = service.import_opml(bob.id, opml)
+
+    assert sorted(feed.url for feed in new_feeds) == [
+        "https://broken.example/feed",
+        "https://new.example/feed",
+    ]
+    assert len(service.get_user_subscribed_feeds(bob.id)) == 3
+    # the known feed is shared, its episodes show up right away
+    assert len(service.get_user_home_feed(user_id=bob.id, page=1)) == 1
+
+    progress = ImportProgress(user_id=bob.id, total=len(new_feeds))
+    service.fetch_new_feeds(new_feeds, progress)
+
+    assert progress.fetched == 1
+    assert progress.failed == 1
+    assert progress.done
+    bobs_feed = service.get_user_home_feed(user_id=bob.id, page=1)
+    assert sorted(entry.episode.assets.title for entry in bobs_feed) == [
+        "known episode",
+        "new episode",
+    ]
+    titles = {
+        feed.url: feed.title for feed in service.get_user_subscribed_feeds(bob.id)
+    }
+    assert titles["https://new.example/feed"] == "new podcast"
+    assert titles["https://broken.example/feed"] == "broken"
+
+    exported = "".join(service.export_opml(bob.id))
+    assert exported.count("<outline") == 3
+
+
+def test_concurrent_imports_of_a_new_feed_create_it_once() -> None:
+    datastore = Datastore(connection=migrated_connection())
+    alice = datastore.save_user("alice", "alice@example.com")
+    bob = datastore.save_user("bob", "bob@example.com")
+    url = "https://new.example/feed"
+
+    # both imports parsed the OPML before either of them saved the feed
+    created = datastore.subscribe_to_feeds(
+        alice.id, [], [Feed(id="first", title="new", url=url, cover_art_url="")]
+    )
+    late = datastore.subscribe_to_feeds(
+        bob.id, [], [Feed(id="second", title="new", url=url, cover_art_url="")]
+    )
+
+    assert [feed.id for feed in created] == ["first"]
+    assert late == []
+    assert [feed.id for feed in datastore.get_feeds_by_urls([url])] == ["first"]
+    assert [s.feed_id for s in datastore.find_subscriptions(bob.id)] == ["first"]
+
+
+def test_opml_import_progress_is_shared_between_connections(tmp_path: Path) -> None:
+    path = tmp_path / "podcasts.db"
+    migrated_connection().backup(sqlite3.connect(path))
+    writer = Datastore(connection=sqlite3.connect(path))
+    reader = Datastore(connection=sqlite3.connect(path))
+    progress = ImportProgress(user_id="bob", total=2)
+
+    writer.save_opml_import(progress)
+    progress.fetched += 1
+    writer.update_opml_import(progress)
+
+    assert reader.get_opml_import(progress.id) == progress
+    assert reader.get_opml_import("unknown") is None
+
+
+def test_timeline_stays_consistent(
+    service_factory: Callable[..., PodcastService],
+) -> None:
+    service = service_factory(
+        rss_feed_podcasts={
+            "this matters": PodcastImport(
+                title="cool podcast title",
+                episode_assets=[
+                    EpisodeAssetFactory.build(
+                        published_date=datetime(year=2000, month=1, day=1)
+                    )
+                ],
+                cover_art_url="Fake cover url",
+            ),
+        }
+    )
+    alice = service.save_user("alice@example.com")
+    bob = service.save_user("bob@example.com")
+    service.subscribe_user_to_podcast(user_id=alice.id, feed_url="this matters")
+    feed_id = service.get_user_subscribed_feeds(alice.id)[0].id
+    service.datastore.subscribe(user_id=bob.id, feed_id=feed_id)
+
+    assert isinstance(service.rss_parser, FakeRssParser)
+    podcast = service.rss_parser.imports["this matters"]
+    podcast.episode_assets.append(
+        EpisodeAssetFactory.build(published_date=datetime(year=2000, month=1, day=2))
+    )
+    podcast.cover_art_url = "new cover url"
+    service.update_all_feeds()
+
+    assert service.datastore.check_timeline().consistent
+    bobs_feed = service.get_user_home_feed(user_id=bob.id, page=1)
+    assert len(bobs_feed) == 2
+    assert all(entry.episode.cover_art_url == "new cover url" for entry in bobs_feed)
+
+    service.datastore.connection.execute(
+        "delete from timeline where user_id = ?;", (bob.id,)
+    )
+    report = service.datastore.check_timeline()
+    assert report.missing == 2
+    assert report.unexpected == 0
+
+    service.datastore.rebuild_timeline()
+
+    assert service.datastore.check_timeline().consistent
+    assert len(service.get_user_home_feed(user_id=bob.id, page=1)) == 2
+
+
+def test_subscribed_feeds_carry_listening_counters(
+    service_factory: Callable[..., PodcastService],
+) -> None:
+    service = service_factory(
+        rss_feed_podcasts={
+            "this matters": PodcastImport(
+                title="cool podcast title",
+                episode_assets=[
+                    EpisodeAssetFactory.build(
+                        title=f"episode {day}",
+                        published_date=datetime(year=2000, month=1, day=day),
+                        length=200,
+                    )
+                    for day in range(1, 4)
+                ],
+                cover_art_url="Fake cover url",
+            ),
+        }
+    )
+    alice = service.save_user("alice@example.com")
+    service.subscribe_user_to_podcast(user_id=alice.id, feed_url="this matters")
+
+    [feed] = service.get_user_subscribed_feeds(alice.id)
+    assert feed.unplayed_count == 3
+    assert feed.in_progress_count == 0
+    assert feed.latest_episode_date == datetime(year=2000, month=1, day=3)
+
+    first, second, _ = service.get_user_home_feed(user_id=alice.id, page=1)
+    service.update_current_play_time(
+        episode_id=first.episode.id, user_id=alice.id, seconds=10
+    )
+    service.update_current_play_time(
+        episode_id=first.episode.id, user_id=alice.id, seconds=50
+    )
+    service.update_current_play_time(
+        episode_id=second.episode.id, user_id=alice.id, seconds=195
+    )
+
+    [feed] = service.get_user_subscribed_feeds(alice.id)
+    assert feed.unplayed_count == 1
+    assert feed.in_progress_count == 1
+
+    service.update_current_play_time(
+        episode_id=first.episode.id, user_id=alice.id, seconds=200
+    )
+    assert isinstance(service.rss_parser, FakeRssParser)
+    service.rss_parser.imports["this matters"].episode_assets.append(
+        EpisodeAssetFactory.build(
+            title="episode 4", published_date=datetime(year=2000, month=1, day=4)
+        )
+    )
+    service.update_all_feeds()
+
+    [feed] = service.get_user_subscribed_feeds(alice.id)
+    assert feed.unplayed_count == 2
+    assert feed.in_progress_count == 0
+    assert feed.latest_episode_date == datetime(year=2000, month=1, day=4)
+
+    service.datastore.recount_subscriptions()
+    assert service.get_user_subscribed_feeds(alice.id) == [feed]
+
+    # the feed now announces a longer second episode, which is no longer finished
+    service.rss_parser.imports["this matters"].episode_assets[1].length = 1000
+    service.update_all_feeds()
+
+    [feed] = service.get_user_subscribed_feeds(alice.id)
+    assert feed.in_progress_count == 1
+
+
+def test_continue_listening_lists_unfinished_episodes_by_last_listen(
+    service_factory: Callable[..., PodcastService],
+) -> None:
+    service = service_factory(
+        rss_feed_podcasts={
+            "this matters": PodcastImport(
+                title="cool podcast title",
+                episode_assets=[
+                    EpisodeAssetFactory.build(
+                        title=f"episode {day}",
+                        published_date=datetime(year=2000, month=1, day=day),
+                        length=200,
+                    )
+                    for day in range(1, 5)
+                ],
+                cover_art_url="Fake cover url",
+            ),
+        }
+    )
+    alice = service.save_user("alice@example.com")
+    service.subscribe_user_to_podcast(user_id=alice.id, feed_url="this matters")
+    first, second, third, _ = service.get_user_home_feed(user_id=alice.id, page=1)
+
+    for episode, seconds in [(first, 10), (second, 200), (third, 20), (first, 30)]:
+        service.update_current_play_time(
+            episode_id=episode.episode.id, user_id=alice.id, seconds=seconds
+        )
+
+    continue_listening = service.get_continue_listening(alice.id, limit=10)
+    assert [entry.episode.id for entry in continue_listening] == [
+        first.episode.id,
+        third.episode.id,
+    ]
+    assert continue_listening[0].previous_listen is not None
+    assert continue_listening[0].previous_listen.time_listened == timedelta(seconds=30)
+    assert len(service.get_continue_listening(alice.id, limit=1)) == 1
+
+
+def test_listening_stats_roll_up_position_deltas(
+    service_factory: Callable[..., PodcastService],
+) -> None:
+    service = service_factory(
+        rss_feed_podcasts={
+            "this matters": PodcastImport(
+                title="cool podcast title",
+                episode_assets=[
+                    EpisodeAssetFactory.build(title="first"),
+                    EpisodeAssetFactory.build(title="second"),
+                ],
+                cover_art_url="Fake cover url",
+            ),
+        }
+    )
+    alice = service.save_user("alice@example.com")
+    service.subscribe_user_to_podcast(user_id=alice.id, feed_url="this matters")
+    first, second = service.get_user_home_feed(user_id=alice.id, page=1)
+    now = datetime.combine(date.today(), datetime.min.time()) + timedelta(hours=12)
+    last_week = now - timedelta(weeks=1)
+
+    for episode, seconds, listened_at in [
+        (first, 600, last_week),
+        # seeking back is not listening
+        (first, 300, last_week + timedelta(minutes=10)),
+        (first, 900, now - timedelta(minutes=20)),
+        # a 2 hour jump within a minute is a seek, capped to 3x a minute
+        (second, 60, now - timedelta(minutes=2)),
+        (second, 7260, now - timedelta(minutes=1)),
+    ]:
+        service.datastore.set_current_time(
+            episode_id=episode.episode.id,
+            user_id=alice.id,
+            seconds=seconds,
+            time=listened_at,
+        )
+
+    stats = service.get_listening_stats(alice.id, weeks=4)
+
+    assert stats.total_seconds == 600 + 600 + 60 + 180
+    assert [week.seconds for week in stats.weeks][-2:] == [600, 600 + 60 + 180]
+    assert len(stats.shows) == 1
+    assert stats.shows[0].title == "cool podcast title"
+    assert stats.shows[0].seconds == stats.total_seconds
+
+    service.datastore.connection.execute("delete from listening_day;")
+    service.datastore.backfill_listening_stats()
+
+    # the backfill only knows last positions
+    assert service.get_listening_stats(alice.id, weeks=4).total_seconds == 900 + 7260
+
+
+def test_archived_episodes_come_back_when_paged_to_or_opened(
+    service_factory: Callable[..., PodcastService],
+) -> None:
+    service = service_factory(
+        rss_feed_podcasts={
+            "this matters": PodcastImport(
+                title="cool podcast title",
+                episode_assets=[
+                    EpisodeAssetFactory.build(
+                        published_date=datetime(day=day, month=1, year=2025)
+                    )
+                    for day in range(1, 31)
+                ],
+                cover_art_url="fake cover url",
+            )
+        }
+    )
+    alice = service.save_user("alice@example.com")
+    service.subscribe_user_to_podcast(user_id=alice.id, feed_url="this matters")
+    (feed,) = service.get_user_subscribed_feeds(alice.id)
+    oldest, second_oldest, *_ = service.get_single_feed(
+        user_id=alice.id, page=1, feed_id=feed.id, chronological=True
+    )
+    service.update_current_play_time(oldest.episode.id, alice.id, seconds=60)
+
+    report = service.datastore.archive_episodes(
+        published_before=datetime(day=26, month=1, year=2025), keep_latest=5
+    )
+
+    # listened to or newer than the cutoff
+    assert report.archived == 30 - 1 - 5
+    assert report.hot_bytes_before is not None
+    assert report.hot_bytes_after is not None
+    assert report.hot_bytes_after < report.hot_bytes_before
+    assert service.datastore.check_timeline().consistent
+    service.datastore.recount_subscriptions()
+    (feed,) = service.get_user_subscribed_feeds(alice.id)
+    assert feed.unplayed_count == 29
+
+    episode = service.get_episode(second_oldest.episode.id, alice.id)
+    assert episode.assets.published_date.day == 2
+    assert (
+        service.datastore.restore_archived_feed(feed.id, rows=30, chronological=True)
+        == 23
+    )
+
+    service.datastore.archive_episodes(
+        published_before=datetime(day=26, month=1, year=2025), keep_latest=5
+    )
+    page_one = service.get_user_home_feed(user_id=alice.id, page=1)
+    # only the page read came back
+    assert archived_days(service) == list(range(2, 16))
+    page_two = service.get_user_home_feed(user_id=alice.id, page=2)
+    assert [entry.episode.assets.published_date.day for entry in page_one] == list(
+        range(30, 20, -1)
+    )
+    assert [entry.episode.assets.published_date.day for entry in page_two] == list(
+        range(20, 10, -1)
+    )
+    assert service.datastore.check_timeline().consistent
+
+
+def archived_days(service: PodcastService) -> list[int]:
+    rows = service.datastore.connection.execute(
+        "select published_date from episode_archive order by published_date;"
+    ).fetchall()
+    return [datetime.fromtimestamp(row[0]).day for row in rows]
+
+
+def test_archived_episodes_stay_archived_while_pages_are_hot(
+    service_factory: Callable[..., PodcastService],
+) -> None:
+    service = service_factory(
+        rss_feed_podcasts={
+            "this matters": PodcastImport(
+                title="cool podcast title",
+                episode_assets=[
+                    EpisodeAssetFactory.build(
+                        published_date=datetime(day=day, month=1, year=2025)
+                    )
+                    for day in range(1, 31)
+                ],
+                cover_art_url="fake cover url",
+            )
+        }
+    )
+    alice = service.save_user("alice@example.com")
+    service.subscribe_user_to_podcast(user_id=alice.id, feed_url="this matters")
+    (feed,) = service.get_user_subscribed_feeds(alice.id)
+    (newest, *_) = service.get_user_home_feed(user_id=alice.id, page=1)
+    service.update_current_play_time(newest.episode.id, alice.id, seconds=2 * 3600)
+    service.datastore.archive_episodes(
+        published_before=datetime(day=21, month=1, year=2025), keep_latest=10
+    )
+
+    # the finished episode leaves the page one short, a search too
+    page_one = service.get_user_home_feed(user_id=alice.id, page=1)
+    searched = service.get_user_home_feed(user_id=alice.id, page=1, search="test")
+    single_feed = service.get_single_feed(user_id=alice.id, page=1, feed_id=feed.id)
+
+    assert len(page_one) == 9
+    assert len(searched) == 9
+    assert len(single_feed) == 10
+    assert archived_days(service) == list(range(1, 21))
+
+    oldest_first = service.get_single_feed(
+        user_id=alice.id, page=1, feed_id=feed.id, chronological=True
+    )
+
+    assert [entry.episode.assets.published_date.day for entry in oldest_first] == list(
+        range(1, 11)
+    )
+    assert archived_days(service) == list(range(11, 21))
+
+
+def test_retention_policy_keeps_the_latest_episode_of_each_feed() -> None:
+    policy = RetentionPolicy(max_age_days=30)
+    assert policy.published_before(datetime(2025, 3, 1)) == datetime(2025, 1, 30)
+    with pytest.raises(ValueError):
+        RetentionPolicy(keep_latest=0)
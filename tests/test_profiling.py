@@ -0,0 +1,59 @@
+import os
+import time
+
+from observability.profiling import sign_profile_token, verify_profile_token
+from tests.conftest import PROFILING_SECRET, Api
+
+
+def test_profile_tokens_expire_and_cannot_be_forged() -> None:
+    expires_at = int(time.time()) + 60
+    token = sign_profile_token("secret", expires_at)
+
+    assert verify_profile_token("secret", token)
+    assert not verify_profile_token("other secret", token)
+    assert not verify_profile_token("secret", token, now=expires_at + 1)
+    assert not verify_profile_token("secret", f"{expires_at + 3600}.{token[-64:]}")
+    assert not verify_profile_token("secret", "garbage")
+
+
+def test_signed_request_is_profiled_with_its_sql(api: Api) -> None:
+    token = api.client.post("/admin/profile_token").json()["token"]
+
+    response = api.client.get("/subscribed_feeds", headers={"X-Profile": token})
+
+    assert response.status_code == 200
+    profile_id = response.headers["X-Profile-Id"]
+    profile = api.client.get(f"/admin/profiles/{profile_id}").json()
+    assert profile["path"] == "/subscribed_feeds"
+    assert profile["status"] == 200
+    assert any("subscription" in sql["statement"] for sql in profile["sql"])
+    # the handler awaits the database thread, whose calls are attributed to
+    # the request through its context but are too short to sample reliably
+    assert profile["stacks"]
+
+    collapsed = api.client.get(f"/admin/profiles/{profile_id}/collapsed").text
+    stack, weight = collapsed.splitlines()[0].rsplit(" ", 1)
+    assert ";" in stack and weight.isdigit()
+    summaries = api.client.get("/admin/profiles").json()
+    assert profile_id in [summary["id"] for summary in summaries]
+
+
+def test_profiles_of_other_workers_are_not_reported_missing(api: Api) -> None:
+    other_worker = f"{os.getpid() + 1}-{'0' * 32}"
+
+    assert api.client.get(f"/admin/profiles/{other_worker}").status_code == 421
+    assert api.client.get(f"/admin/profiles/{os.getpid()}-unknown").status_code == 404
+
+
+def test_requests_without_a_valid_token_are_not_profiled(api: Api) -> None:
+    forged = sign_profile_token(PROFILING_SECRET + "?", int(time.time()) + 60)
+
+    assert "X-Profile-Id" not in api.client.get("/subscribed_feeds").headers
+    response = api.client.get("/subscribed_feeds", headers={"X-Profile": forged})
+    assert "X-Profile-Id" not in response.headers
+
+
+def test_only_admins_mint_profile_tokens(api: Api) -> None:
+    api.email = "alice@example.com"
+
+    assert api.client.post("/admin/profile_token").status_code == 403
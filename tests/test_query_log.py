@@ -0,0 +1,137 @@
+import logging
+import os
+import sqlite3
+
+import pytest
+
+import endpoints
+from observability.queries import (
+    QueryInstrumentation,
+    QueryLogSettings,
+    statement_shape,
+)
+from persistence.datastore import Datastore, QueryEvent
+from services import API_WORKERS_VARIABLE
+from tests.conftest import Api, migrated_connection
+
+
+class RecordingHook:
+    def __init__(self) -> None:
+        self.enabled = True
+        self.events: list[QueryEvent] = []
+
+    def __call__(self, event: QueryEvent, connection: sqlite3.Connection) -> None:
+        self.events.append(event)
+
+
+def datastore_with(hook) -> Datastore:
+    connection = migrated_connection()
+    return Datastore(connection=connection, query_hook=hook)
+
+
+def test_hook_sees_statements_with_their_method_and_rows() -> None:
+    hook = RecordingHook()
+    datastore = datastore_with(hook)
+
+    datastore.save_user(id="alice", email="alice@example.com")
+    datastore.get_user_by_email("alice@example.com")
+    datastore.get_feeds_by_urls(["a", "b", "c"])
+
+    assert [(event.method, event.rows) for event in hook.events] == [
+        ("save_user", 1),
+        ("get_user_by_email", 1),
+        ("get_feeds_by_urls", 0),
+    ]
+    assert hook.events[1].parameters == ("alice@example.com",)
+
+
+def test_statements_of_private_helpers_are_labelled_with_the_public_method() -> None:
+    hook = RecordingHook()
+    datastore = datastore_with(hook)
+    datastore.save_user(id="alice", email="alice@example.com")
+    datastore.save_podcast_feed(
+        feed_id="feed", feed_url="url", cover_art_url="cover", title="title"
+    )
+    hook.events.clear()
+
+    datastore.subscribe(user_id="alice", feed_id="feed")
+    datastore.check_timeline()
+
+    assert {event.method for event in hook.events} == {"subscribe", "check_timeline"}
+
+
+def test_disabled_hook_is_skipped() -> None:
+    hook = RecordingHook()
+    hook.enabled = False
+    datastore = datastore_with(hook)
+
+    datastore.save_user(id="alice", email="alice@example.com")
+
+    assert hook.events == []
+
+
+def test_statement_shape_ignores_whitespace_and_list_length() -> None:
+    assert statement_shape(
+        "select id from podcast_feed\n  where feed_url in (?,?,?);"
+    ) == statement_shape("select id from podcast_feed where feed_url in (?, ?);")
+
+
+def test_slow_queries_are_logged_without_their_parameters(
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    instrumentation = QueryInstrumentation(
+        QueryLogSettings(enabled=True, slow_query_seconds=0)
+    )
+    datastore = datastore_with(instrumentation)
+
+    with caplog.at_level(logging.WARNING, logger="observability.queries"):
+        datastore.save_user(id="alice", email="secret@example.com")
+
+    assert len(caplog.records) == 1
+    message = caplog.records[0].getMessage()
+    assert "save_user" in message
+    assert "secret@example.com" not in message
+    assert "['str', 'str']" in message
+
+
+def test_plan_is_captured_once_per_statement_shape() -> None:
+    instrumentation = QueryInstrumentation(
+        QueryLogSettings(enabled=True, slow_query_seconds=60, explain=True)
+    )
+    datastore = datastore_with(instrumentation)
+
+    datastore.get_feeds_by_urls(["a"])
+    datastore.get_feeds_by_urls(["a", "b"])
+    datastore.get_in_progress_play_infos("alice", limit=10)
+
+    plans = instrumentation.plans()
+    assert [plan.method for plan in plans] == [
+        "get_feeds_by_urls",
+        "get_in_progress_play_infos",
+    ]
+    assert any("previous_listen_in_progress" in line for line in plans[1].plan)
+
+
+def test_query_log_can_be_switched_by_admins_only(api: Api) -> None:
+    settings = {"enabled": True, "slow_query_seconds": 0.5, "explain": True}
+
+    response = api.client.put("/admin/query_log", json=settings)
+    assert response.status_code == 200
+    assert endpoints.query_instrumentation.enabled
+    assert api.client.get("/admin/query_log").json()["settings"] == settings
+
+    api.email = "alice@example.com"
+    assert api.client.put("/admin/query_log", json=settings).status_code == 403
+    assert api.client.get("/admin/query_log").status_code == 403
+
+
+def test_query_log_is_not_switched_for_one_of_several_workers(
+    api: Api, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setenv(API_WORKERS_VARIABLE, "4")
+    settings = {"enabled": True, "slow_query_seconds": 0.5, "explain": True}
+
+    response = api.client.put("/admin/query_log", json=settings)
+
+    assert response.status_code == 409
+    assert api.client.get("/admin/query_log").json()["worker"] == os.getpid()
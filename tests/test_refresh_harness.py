@@ -0,0 +1,61 @@
+import sqlite3
+
+import pytest
+
+from benchmarks.feed_server import FakeFeedServer, FeedServerConfig
+from benchmarks.refresh import prepare, run
+from business.rss import FeedFetcher
+
+
+def test_refresh_cycles_against_fake_feed_server() -> None:
+    config = FeedServerConfig(
+        feeds=6, episodes_per_feed=3, error_rate=0.3, redirect_rate=0.5, seed=1
+    )
+    with FakeFeedServer(config) as server:
+        broken = sum(server.behaviour(index).broken for index in range(config.feeds))
+    assert 0 < broken < config.feeds
+
+    first, second = run(config, cycles=2)
+
+    assert (first.processed, first.failed) == (config.feeds - broken, broken)
+    assert (second.processed, second.failed) == (config.feeds - broken, broken)
+    # only the newly published episode and the new ETag are written later on
+    assert second.db_changes == 2 * (config.feeds - broken)
+
+
+@pytest.mark.parametrize("etags", [True, False])
+def test_unchanged_feeds_are_not_downloaded_again(etags: bool) -> None:
+    config = FeedServerConfig(
+        feeds=4, episodes_per_feed=3, redirect_rate=0.5, etags=etags, seed=1
+    )
+    connection = sqlite3.connect(":memory:")
+    with FakeFeedServer(config) as server:
+        service = prepare(server, connection)
+        service._update_feeds(service.datastore.get_all_feeds())
+        bytes_sent = server.counters.bytes_sent
+        changes = connection.total_changes
+
+        summary = service._update_feeds(service.datastore.get_all_feeds())
+
+    assert summary.processed == config.feeds
+    assert connection.total_changes == changes
+    if etags:
+        assert server.counters.not_modified == config.feeds
+        assert server.counters.bytes_sent == bytes_sent
+    else:
+        assert server.counters.not_modified == 0
+        assert server.counters.bytes_sent == 2 * bytes_sent
+
+
+def test_fake_feed_server_etags_and_redirects() -> None:
+    config = FeedServerConfig(feeds=1, episodes_per_feed=1, redirect_rate=1.0)
+    with FakeFeedServer(config) as server:
+        fetched = FeedFetcher().fetch(server.url(0))
+        assert fetched.url.endswith("/moved/0.xml")
+
+        etag = server.document(0)[1]
+        response = FeedFetcher().session.get(
+            server.url(0), headers={"If-None-Match": etag}
+        )
+        assert response.status_code == 304
+        assert server.counters.not_modified == 1
@@ -0,0 +1,120 @@
+import gzip
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator
+
+import pytest
+
+from business.rss import FeedFetcher, FeedFetchError, FeedParserRssParser, FeedTooLarge
+
+RSS_DOCUMENT = b"""<?xml version="1.0" encoding="UTF-8"?>
+<rss version="2.0" xmlns:itunes="http://www.itunes.com/dtds/podcast-1.0.dtd">
+  <channel>
+    <title>served podcast</title>
+    <image><url>http://example.com/cover.jpg</url></image>
+    <itunes:image href="http://example.com/cover.jpg"/>
+    <item>
+      <title>served episode</title>
+      <description>served description</description>
+      <pubDate>Wed, 01 Jan 2025 12:00:00 GMT</pubDate>
+      <itunes:duration>01:00</itunes:duration>
+      <enclosure url="http://example.com/episode.mp3" type="audio/mpeg" length="1"/>
+    </item>
+  </channel>
+</rss>
+"""
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        match self.path:
+            case "/feed.xml":
+                body = gzip.compress(RSS_DOCUMENT)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/rss+xml")
+                self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            case "/huge.xml":
+                # no content length, the fetcher has to notice while streaming
+                self.send_response(200)
+                self.end_headers()
+                for _ in range(64):
+                    self.wfile.write(b"x" * 1024)
+            case "/bomb.xml":
+                # a few hundred bytes on the wire, far more once decoded
+                body = gzip.compress(b"x" * 64 * 1024)
+                self.send_response(200)
+                self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            case "/stalled.xml":
+                time.sleep(1)
+                self.send_response(200)
+                self.end_headers()
+            case _:
+                self.send_response(404)
+                self.end_headers()
+
+    def log_message(self, format, *args) -> None: ...
+
+
+@pytest.fixture
+def feed_server() -> Iterator[str]:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FeedHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_import_feed_over_http(feed_server: str) -> None:
+    parser = FeedParserRssParser(fetcher=FeedFetcher())
+    podcast = parser.import_feed(f"{feed_server}/feed.xml")
+
+    assert podcast.title == "served podcast"
+    assert len(podcast.episode_assets) == 1
+    assert podcast.episode_assets[0].download_link == "http://example.com/episode.mp3"
+    assert podcast.download is not None
+    assert podcast.download.size == len(RSS_DOCUMENT)
+
+
+def test_fetch_enforces_size_limit_while_streaming(feed_server: str) -> None:
+    fetcher = FeedFetcher(max_bytes=16 * 1024, chunk_size=1024)
+    with pytest.raises(FeedTooLarge):
+        fetcher.fetch(f"{feed_server}/huge.xml")
+
+
+def test_fetch_limits_the_decoded_size_of_compressed_feeds(feed_server: str) -> None:
+    fetcher = FeedFetcher(max_bytes=16 * 1024, chunk_size=1024)
+    with pytest.raises(FeedTooLarge, match="exceeded"):
+        fetcher.fetch(f"{feed_server}/bomb.xml")
+
+
+def test_fetch_times_out_on_stalled_server(feed_server: str) -> None:
+    fetcher = FeedFetcher(read_timeout=0.1)
+    with pytest.raises(FeedFetchError):
+        fetcher.fetch(f"{feed_server}/stalled.xml")
+
+
+def test_fetch_reports_http_errors(feed_server: str) -> None:
+    with pytest.raises(FeedFetchError):
+        FeedFetcher().fetch(f"{feed_server}/missing.xml")
+
+
+def test_import_logs_one_summary_per_feed(
+    feed_server: str, caplog: pytest.LogCaptureFixture
+) -> None:
+    parser = FeedParserRssParser(fetcher=FeedFetcher())
+    with caplog.at_level(logging.INFO, logger="business.rss"):
+        parser.import_feed(f"{feed_server}/feed.xml")
+
+    assert len(caplog.records) == 1
+    summary = caplog.records[0]
+    assert summary.episodes == 1  # type: ignore
+    assert summary.skipped_entries == 0  # type: ignore
@@ -0,0 +1,9 @@
+import pytest
+
+from benchmarks.startup import BUDGETS, Budget, check, measure
+
+
+@pytest.mark.parametrize("budget", BUDGETS, ids=lambda budget: budget.module)
+def test_entrypoints_start_within_budget(budget: Budget) -> None:
+    # best of two, a single import can be slowed down by the rest of the machine
+    assert check(budget, measure(budget.module, runs=2)) == []